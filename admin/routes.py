@@ -9,11 +9,11 @@ from models.book_model import Book
 from models.user_model import User
 from models.rating_model import Rating
 from config import Config
+from response_cache import response_cache
+from search import book_search
 import pandas as pd
 import os
 from pathlib import Path
-import subprocess
-from sqlalchemy import or_
 
 admin_bp = Blueprint('admin', __name__, template_folder='../templates')
 
@@ -62,6 +62,7 @@ def import_csv_to_db(csv_path):
         
         imported = 0
         skipped = 0
+        updated_ids = []
         
         for _, row in df.iterrows():
             title = str(row.get(title_col, '')).strip()
@@ -84,6 +85,7 @@ def import_csv_to_db(csv_path):
             
             if book:
                 # Update existing
+                updated_ids.append(book.id)
                 if description:
                     book.description = description
                 if genres:
@@ -111,6 +113,8 @@ def import_csv_to_db(csv_path):
             imported += 1
         
         db.session.commit()
+        # New books can match any cached search; updated ones change what cached lists show
+        response_cache.invalidate('catalog', *(f'book:{book_id}' for book_id in updated_ids))
         return imported, f"Successfully imported {imported} books, skipped {skipped} rows"
     
     except Exception as e:
@@ -133,12 +137,7 @@ def dashboard():
     recent_books = []
     search_results = []
     if query:
-        search_filter = or_(
-            Book.title.ilike(f'%{query}%'),
-            Book.author.ilike(f'%{query}%'),
-            Book.genres.ilike(f'%{query}%')
-        )
-        search_results = Book.query.filter(search_filter).order_by(Book.created_at.desc()).limit(50).all()
+        search_results = book_search.search(query, order='recent', limit=50)
     else:
         recent_books = Book.query.order_by(Book.created_at.desc()).limit(10).all()
     
@@ -170,6 +169,7 @@ def add_book():
         try:
             db.session.add(book)
             db.session.commit()
+            response_cache.invalidate('catalog')
             flash('Book added successfully!', 'success')
             return redirect(url_for('admin.dashboard'))
         except Exception as e:
@@ -195,6 +195,7 @@ def edit_book(book_id):
         
         try:
             db.session.commit()
+            response_cache.invalidate(f'book:{book_id}', 'catalog')
             flash('Book updated successfully!', 'success')
             return redirect(url_for('admin.dashboard'))
         except Exception as e:
@@ -213,6 +214,7 @@ def delete_book(book_id):
     try:
         db.session.delete(book)
         db.session.commit()
+        response_cache.invalidate(f'book:{book_id}')
         flash('Book deleted successfully!', 'success')
     except Exception as e:
         db.session.rollback()
@@ -261,34 +263,60 @@ def upload_csv():
 @admin_bp.route('/retrain', methods=['POST'])
 @admin_required
 def retrain_model():
-    """Retrain recommendation model"""
-    try:
-        # Run retrain script as subprocess
-        script_path = Path(__file__).parent.parent / 'recommender' / 'retrain_model.py'
-        result = subprocess.run(
-            ['python', str(script_path)],
-            capture_output=True,
-            text=True,
-            timeout=300  # 5 minute timeout
-        )
-        
-        if result.returncode == 0:
-            flash('Model retrained successfully!', 'success')
-        else:
-            flash(f'Retraining failed: {result.stderr}', 'error')
-    
-    except subprocess.TimeoutExpired:
-        flash('Retraining timed out. This may take a while for large datasets.', 'warning')
-    except Exception as e:
-        flash(f'Error retraining model: {str(e)}', 'error')
-    
+    """Queue a background retrain (one at a time)"""
+    from recommender.jobs import job_runner
+    full = request.form.get('full') == '1'
+    job, created = job_runner.enqueue(full=full, user_id=current_user.id)
+    if created:
+        flash('Retraining started. Progress is shown on the dashboard.', 'success')
+    elif job is not None:
+        flash(f'A retrain is already {job.status}.', 'info')
     return redirect(url_for('admin.dashboard'))
 
 
+@admin_bp.route('/retrain/status')
+@admin_required
+def retrain_status():
+    """JSON status of a retrain job (the latest one by default)"""
+    from models.job_model import RetrainJob
+    from recommender.jobs import job_runner
+    job_id = request.args.get('job_id', type=int)
+    job = db.session.get(RetrainJob, job_id) if job_id else job_runner.latest_job()
+    if job is None:
+        return jsonify({'job': None})
+    return jsonify({'job': job.to_dict()})
+
+
+@admin_bp.route('/retrain/<int:job_id>/cancel', methods=['POST'])
+@admin_required
+def cancel_retrain(job_id):
+    """Cancel a queued or running retrain job"""
+    from recommender.jobs import job_runner
+    job = job_runner.cancel(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify({'job': job.to_dict()})
+
+
+@admin_bp.route('/metrics')
+@admin_required
+def metrics():
+    """Cache hit rates and recommender stats of this worker process"""
+    from recommender.encoder import get_query_encoder
+    from recommender.service import recommender_service
+    return jsonify({
+        'response_cache': response_cache.stats(),
+        'query_encoder': get_query_encoder().stats(),
+        'recommender': recommender_service.stats(),
+    })
+
+
 @admin_bp.route('/embpath')
 @admin_required
 def check_embeddings():
-    """Check if embeddings file exists"""
-    exists = Config.EMBEDDINGS_PATH.exists()
-    return jsonify({'exists': exists, 'path': str(Config.EMBEDDINGS_PATH)})
+    """Check if embeddings artifacts exist"""
+    from recommender.artifacts import ArtifactStore
+    store = ArtifactStore.current()
+    exists = store.has('embeddings') and 'embeddings' in store.read_manifest()
+    return jsonify({'exists': exists, 'path': str(store.root), 'version': store.version})
 
@@ -5,11 +5,12 @@ from flask import Flask
 from config import Config
 from extensions import db, migrate, bcrypt, login_manager
 from threading import Timer
+import logging
 import os
 import webbrowser
 
 
-def create_app():
+def create_app(preload_recommender=True):
     """Application factory"""
     app = Flask(__name__)
     app.config.from_object(Config)
@@ -30,6 +31,10 @@ def create_app():
     from user.routes import user_bp
     from admin.routes import admin_bp
     from models.tag_model import Tag, BookTag
+    from models.job_model import RetrainJob
+    from models.recommendation_model import UserRecommendation
+    from models.mood_model import BookMood
+    from models.genre_model import Genre, BookGenre
     
     app.register_blueprint(user_bp)
     app.register_blueprint(admin_bp, url_prefix='/admin')
@@ -42,6 +47,34 @@ def create_app():
         instance_dir.mkdir(exist_ok=True)
         db.create_all()
     
+    # Full-text index over books (created on first start)
+    from search import book_search
+    book_search.init_app(app)
+    
+    # Mood tags of books (tagged on first start, then on every book write)
+    from search import mood_index
+    mood_index.init_app(app)
+    
+    # Normalized genres of books and their in-memory facet bitmaps
+    from search import genre_index
+    genre_index.init_app(app)
+    
+    # Title/author completions for search-as-you-type (built on first use)
+    from search import typeahead_index
+    typeahead_index.init_app(app)
+    
+    # Cached search and recommendation results
+    from response_cache import response_cache
+    response_cache.init_app(app)
+    
+    # Resident recommender (loaded once per worker process)
+    from recommender.service import recommender_service
+    recommender_service.init_app(app, preload=preload_recommender)
+    
+    # Background retrain jobs started from the admin panel
+    from recommender.jobs import job_runner
+    job_runner.init_app(app)
+    
     # Routes
     @app.route('/health')
     def health():
@@ -52,6 +85,7 @@ def create_app():
 
 
 if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
     app = create_app()
     
     # Auto-open browser after 1 second
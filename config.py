@@ -51,10 +51,98 @@ class Config:
     SQLALCHEMY_DATABASE_URI = _default_db_uri
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     
-    # Paths
-    EMBEDDINGS_PATH = DATA_FOLDER / 'embeddings.pkl'
-    BOOKS_INDEX_PATH = DATA_FOLDER / 'books_index.pkl'
-    CF_MATRIX_PATH = DATA_FOLDER / 'cf_matrix.pkl'
+    # Paths - binary artifacts (.npy arrays + manifest.json) that workers memory-map
+    ARTIFACTS_DIR = Path(os.getenv('ARTIFACTS_DIR', str(DATA_FOLDER / 'artifacts')))
+    # Each retrain publishes a new version under ARTIFACTS_DIR/versions; older ones beyond this are pruned
+    ARTIFACT_VERSIONS_KEEP = int(os.getenv('ARTIFACT_VERSIONS_KEEP', '3'))
+    
+    # Item-based CF: 'adjusted_cosine' or 'cosine', truncated to CF_NEIGHBORS per item
+    CF_SIMILARITY = os.getenv('CF_SIMILARITY', 'adjusted_cosine').lower()
+    CF_NEIGHBORS = int(os.getenv('CF_NEIGHBORS', '50'))
+    
+    # CF model used for serving: 'item_knn' or 'als' (matrix factorization)
+    CF_MODEL = os.getenv('CF_MODEL', 'item_knn').lower()
+    ALS_FACTORS = int(os.getenv('ALS_FACTORS', '64'))
+    ALS_ITERATIONS = int(os.getenv('ALS_ITERATIONS', '15'))
+    ALS_REGULARIZATION = float(os.getenv('ALS_REGULARIZATION', '0.1'))
+    ALS_IMPLICIT = os.getenv('ALS_IMPLICIT', 'True').lower() == 'true'
+    ALS_ALPHA = float(os.getenv('ALS_ALPHA', '40'))
+    ALS_THREADS = int(os.getenv('ALS_THREADS', '0'))  # 0 = all cores
+    ALS_ANN_MIN_ITEMS = int(os.getenv('ALS_ANN_MIN_ITEMS', '100000'))
+    ALS_INDEX_TYPE = os.getenv('ALS_INDEX_TYPE', 'hnsw').lower()
+    
+    # Vector index: 'flat' (exact), 'ivf' or 'hnsw' (approximate), 'none' (brute force)
+    VECTOR_INDEX_TYPE = os.getenv('VECTOR_INDEX_TYPE', 'flat').lower()
+    VECTOR_INDEX_NLIST = int(os.getenv('VECTOR_INDEX_NLIST', '1024'))
+    VECTOR_INDEX_NPROBE = int(os.getenv('VECTOR_INDEX_NPROBE', '16'))
+    VECTOR_INDEX_HNSW_M = int(os.getenv('VECTOR_INDEX_HNSW_M', '32'))
+    VECTOR_INDEX_EF_CONSTRUCTION = int(os.getenv('VECTOR_INDEX_EF_CONSTRUCTION', '200'))
+    VECTOR_INDEX_EF_SEARCH = int(os.getenv('VECTOR_INDEX_EF_SEARCH', '64'))
+    
+    # Embedding model
+    EMBEDDING_MODEL_NAME = os.getenv('EMBEDDING_MODEL_NAME', 'all-MiniLM-L6-v2')
+    QUERY_CACHE_SIZE = int(os.getenv('QUERY_CACHE_SIZE', '1024'))
+    
+    # Embedding build: worker processes (1 = in-process) and padded tokens per length-sorted batch
+    EMBEDDING_WORKERS = int(os.getenv('EMBEDDING_WORKERS', '1'))
+    EMBEDDING_TOKEN_BUDGET = int(os.getenv('EMBEDDING_TOKEN_BUDGET', '8192'))
+    
+    # Retrain streaming: rows per chunk read from the database, chunks buffered between stages
+    RETRAIN_CHUNK_SIZE = int(os.getenv('RETRAIN_CHUNK_SIZE', '2048'))
+    RETRAIN_QUEUE_SIZE = int(os.getenv('RETRAIN_QUEUE_SIZE', '4'))
+    
+    # Background retrain jobs (admin panel)
+    RETRAIN_PROGRESS_INTERVAL = float(os.getenv('RETRAIN_PROGRESS_INTERVAL', '1.0'))  # seconds between progress writes
+    RETRAIN_CANCEL_GRACE_SECONDS = int(os.getenv('RETRAIN_CANCEL_GRACE_SECONDS', '30'))
+    RETRAIN_JOB_STALE_SECONDS = int(os.getenv('RETRAIN_JOB_STALE_SECONDS', '120'))
+    RETRAIN_LOG_DIR = Path(os.getenv('RETRAIN_LOG_DIR', str(DATA_FOLDER / 'logs')))
+    
+    # Embedding storage: 'none' (float32), 'float16', 'int8' (per-dimension scale) or 'pq' (FAISS product quantization)
+    EMBEDDING_QUANTIZATION = os.getenv('EMBEDDING_QUANTIZATION', 'none').lower()
+    EMBEDDING_PQ_M = int(os.getenv('EMBEDDING_PQ_M', '48'))  # sub-quantizers, divides the embedding dim
+    EMBEDDING_PQ_BITS = int(os.getenv('EMBEDDING_PQ_BITS', '8'))
+    # Quantized candidates re-scored against full-precision vectors (0 = no re-rank)
+    RERANK_CANDIDATES = int(os.getenv('RERANK_CANDIDATES', '100'))
+    
+    # Batch recommendations: queries/users scored per matrix product, and inputs allowed per API call
+    RECOMMEND_BATCH_CHUNK = int(os.getenv('RECOMMEND_BATCH_CHUNK', '256'))
+    RECOMMEND_BATCH_MAX = int(os.getenv('RECOMMEND_BATCH_MAX', '1000'))
+    # Length of the precomputed per-user lists written after each retrain
+    PRECOMPUTE_TOP_N = int(os.getenv('PRECOMPUTE_TOP_N', '24'))
+    # Users whose taste vector (CBF query for personalized recommendations) each worker keeps
+    TASTE_CACHE_SIZE = int(os.getenv('TASTE_CACHE_SIZE', '10000'))
+    
+    # Book search: SQLite FTS5 index ranked by bm25 x (1 + weight x rating popularity); False = LIKE scans
+    SEARCH_FTS = os.getenv('SEARCH_FTS', 'True').lower() == 'true'
+    SEARCH_POPULARITY_WEIGHT = float(os.getenv('SEARCH_POPULARITY_WEIGHT', '1.0'))
+    # Seconds before a worker reloads its genre facet bitmaps to see other workers' book writes
+    GENRE_INDEX_REFRESH = float(os.getenv('GENRE_INDEX_REFRESH', '60'))
+    # Hybrid search (/api/search?mode=hybrid): candidates per generator, RRF constant, per-stage budgets
+    HYBRID_CANDIDATES = int(os.getenv('HYBRID_CANDIDATES', '100'))
+    HYBRID_RRF_K = int(os.getenv('HYBRID_RRF_K', '60'))
+    HYBRID_LEXICAL_BUDGET_MS = float(os.getenv('HYBRID_LEXICAL_BUDGET_MS', '150'))
+    HYBRID_SEMANTIC_BUDGET_MS = float(os.getenv('HYBRID_SEMANTIC_BUDGET_MS', '300'))
+    HYBRID_SEARCH_THREADS = int(os.getenv('HYBRID_SEARCH_THREADS', '8'))
+    # Typeahead (/api/autocomplete): completions per keystroke and seconds before a worker rebuilds its index
+    TYPEAHEAD_LIMIT = int(os.getenv('TYPEAHEAD_LIMIT', '10'))
+    TYPEAHEAD_REFRESH = float(os.getenv('TYPEAHEAD_REFRESH', '300'))
+    
+    # Response cache for search/recommendation endpoints: 'memory' (per process), 'sqlite' (shared by workers) or 'none'
+    RESPONSE_CACHE_BACKEND = os.getenv('RESPONSE_CACHE_BACKEND', 'memory').lower()
+    RESPONSE_CACHE_TTL = int(os.getenv('RESPONSE_CACHE_TTL', '300'))  # seconds
+    RESPONSE_CACHE_SIZE = int(os.getenv('RESPONSE_CACHE_SIZE', '2048'))  # entries
+    RESPONSE_CACHE_PATH = Path(os.getenv('RESPONSE_CACHE_PATH', str(DATA_FOLDER / 'cache' / 'responses.sqlite')))
+    
+    # Recommender service
+    RECOMMENDER_PRELOAD = os.getenv('RECOMMENDER_PRELOAD', 'True').lower() == 'true'
+    # Seconds between checks for a newly published artifact version (0 disables hot reload)
+    RECOMMENDER_RELOAD_INTERVAL = float(os.getenv('RECOMMENDER_RELOAD_INTERVAL', '5'))
+    # Seconds between reads of the rating delta log into the CF model (0 disables online updates)
+    CF_DELTA_INTERVAL = float(os.getenv('CF_DELTA_INTERVAL', '2'))
+    # Log rows one poll applies at most; a longer backlog is worked off over several polls
+    CF_DELTA_MAX_ROWS = int(os.getenv('CF_DELTA_MAX_ROWS', '20000'))
+    # Users the online overlay holds before a worker stops applying deltas until the next retrain/compaction
+    CF_ONLINE_MAX_USERS = int(os.getenv('CF_ONLINE_MAX_USERS', '50000'))
     
     # CSV paths (optional)
     GOODREADS_BOOKS_PATH = os.getenv('GOODREADS_BOOKS_PATH', '')
@@ -21,7 +21,7 @@ def create_admin():
     project_dir = Path(__file__).parent
     os.chdir(project_dir)
     
-    app = create_app()
+    app = create_app(preload_recommender=False)
     
     with app.app_context():
         # Create tables if they don't exist
@@ -1,10 +1,13 @@
 """
 Extension singletons - initialized here, bound to app in app.py
 """
+import sqlite3
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 from flask_bcrypt import Bcrypt
 from flask_login import LoginManager
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
 
 # Initialize extensions (no app context here)
 db = SQLAlchemy()
@@ -17,3 +20,11 @@ login_manager.login_view = 'user.login'
 login_manager.login_message = 'Please log in to access this page.'
 login_manager.login_message_category = 'info'
 
+
+@event.listens_for(Engine, 'connect')
+def _sqlite_wal(dbapi_connection, connection_record):
+    """Write-ahead logging so writes don't wait for long reads (e.g. a streaming retrain)"""
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.close()
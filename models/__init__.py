@@ -1,7 +1,11 @@
 # Models package - import all models to register with SQLAlchemy
 from .user_model import User
 from .book_model import Book
-from .rating_model import Rating, Favorite, Feedback
+from .rating_model import Rating, Favorite, Feedback, RatingDelta
+from .job_model import RetrainJob
+from .recommendation_model import UserRecommendation
+from .mood_model import BookMood
+from .genre_model import Genre, BookGenre
 
-__all__ = ['User', 'Book', 'Rating', 'Favorite', 'Feedback']
+__all__ = ['User', 'Book', 'Rating', 'Favorite', 'Feedback', 'RatingDelta', 'RetrainJob', 'UserRecommendation', 'BookMood', 'Genre', 'BookGenre']
 
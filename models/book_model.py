@@ -22,6 +22,8 @@ class Book(db.Model):
     ratings = db.relationship('Rating', backref='book', lazy='dynamic', cascade='all, delete-orphan')
     favorites = db.relationship('Favorite', backref='book', lazy='dynamic', cascade='all, delete-orphan')
     feedbacks = db.relationship('Feedback', backref='book', lazy='dynamic', cascade='all, delete-orphan')
+    moods = db.relationship('BookMood', backref='book', lazy='dynamic', cascade='all, delete-orphan')
+    genre_links = db.relationship('BookGenre', backref='book', lazy='dynamic', cascade='all, delete-orphan')
     
     def get_genres_list(self):
         if not self.genres:
@@ -0,0 +1,25 @@
+from extensions import db
+
+
+class Genre(db.Model):
+    """A genre named in Book.genres (see search.genres)"""
+    __tablename__ = 'genres'
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False)  # as first written
+    key = db.Column(db.String(100), nullable=False, unique=True, index=True)  # lowercase, single spaces
+
+    def __repr__(self):
+        return f'<Genre {self.name}>'
+
+
+class BookGenre(db.Model):
+    """Junction of books and their genres"""
+    __tablename__ = 'book_genres'
+
+    # Genre first, so the books of a genre are one contiguous index range
+    genre_id = db.Column(db.Integer, db.ForeignKey('genres.id'), primary_key=True)
+    book_id = db.Column(db.Integer, db.ForeignKey('books.id'), primary_key=True, index=True)
+
+    def __repr__(self):
+        return f'<BookGenre {self.genre_id}: book {self.book_id}>'
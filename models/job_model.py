@@ -0,0 +1,53 @@
+from datetime import datetime
+from extensions import db
+
+# A job counts as active (and blocks new ones) while queued or running
+ACTIVE_STATUSES = ('queued', 'running')
+_ACTIVE_WHERE = db.text("status IN ('queued', 'running')")
+
+
+class RetrainJob(db.Model):
+    __tablename__ = 'retrain_jobs'
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), default='retrain', nullable=False)
+    status = db.Column(db.String(20), default='queued', nullable=False, index=True)  # queued, running, succeeded, failed, cancelled
+    full = db.Column(db.Boolean, default=False, nullable=False)  # re-encode every book
+    stage = db.Column(db.String(50), nullable=True)
+    progress = db.Column(db.JSON, nullable=True)  # per-stage done/total counters
+    message = db.Column(db.Text, nullable=True)
+    cancel_requested = db.Column(db.Boolean, default=False, nullable=False)
+    created_by = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    started_at = db.Column(db.DateTime, nullable=True)
+    heartbeat_at = db.Column(db.DateTime, nullable=True)
+    pid = db.Column(db.Integer, nullable=True)  # retrain child process, while running
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    # At most one active job per kind, enforced by the database so concurrent enqueues dedupe
+    __table_args__ = (
+        db.Index('uq_retrain_jobs_active', 'kind', unique=True,
+                 sqlite_where=_ACTIVE_WHERE, postgresql_where=_ACTIVE_WHERE),
+    )
+
+    @property
+    def is_active(self):
+        return self.status in ACTIVE_STATUSES
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'full': self.full,
+            'stage': self.stage,
+            'progress': self.progress or {},
+            'message': self.message,
+            'cancel_requested': self.cancel_requested,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+        }
+
+    def __repr__(self):
+        return f'<RetrainJob {self.id} {self.status}>'
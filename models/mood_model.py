@@ -0,0 +1,13 @@
+from extensions import db
+
+
+class BookMood(db.Model):
+    """A mood from the search lexicon that a book's text mentions (see search.moods)"""
+    __tablename__ = 'book_moods'
+
+    # Mood first, so the books of a mood are one contiguous index range
+    mood = db.Column(db.String(50), primary_key=True)
+    book_id = db.Column(db.Integer, db.ForeignKey('books.id'), primary_key=True, index=True)
+
+    def __repr__(self):
+        return f'<BookMood {self.mood}: book {self.book_id}>'
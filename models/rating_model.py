@@ -50,3 +50,25 @@ class Feedback(db.Model):
     def __repr__(self):
         return f'<Feedback user {self.user_id} -> book {self.book_id}: {"like" if self.is_like else "dislike"}>'
 
+
+class RatingDelta(db.Model):
+    """Append-only log of rating and like/dislike changes, applied to the CF model between retrains"""
+    __tablename__ = 'rating_deltas'
+
+    id = db.Column(db.Integer, primary_key=True)  # increasing; workers tail the log by id
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    book_id = db.Column(db.Integer, db.ForeignKey('books.id'), nullable=False)
+    kind = db.Column(db.String(10), nullable=False)  # 'rating' or 'feedback'
+    value = db.Column(db.Integer, nullable=False)  # 1-5 stars, or 1 like / 0 dislike
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    # Ids must never be reused after compaction empties the table, or workers would skip new rows
+    __table_args__ = {'sqlite_autoincrement': True}
+
+    @classmethod
+    def record(cls, user_id, book_id, kind, value):
+        """Append a change; call in the transaction that writes the rating or feedback"""
+        db.session.add(cls(user_id=user_id, book_id=book_id, kind=kind, value=value))
+
+    def __repr__(self):
+        return f'<RatingDelta {self.id}: user {self.user_id} {self.kind} {self.value} for book {self.book_id}>'
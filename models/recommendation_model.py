@@ -0,0 +1,23 @@
+from datetime import datetime
+from extensions import db
+
+
+class UserRecommendation(db.Model):
+    """Precomputed top-N hybrid recommendations, one row per (user, rank)"""
+    __tablename__ = 'user_recommendations'
+
+    # The composite primary key makes a user's list one contiguous index range
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    rank = db.Column(db.SmallInteger, primary_key=True, autoincrement=False)
+    book_id = db.Column(db.Integer, db.ForeignKey('books.id'), nullable=False)
+    score = db.Column(db.Float, nullable=False)
+    model_version = db.Column(db.String(32), nullable=False)  # artifact version the scores came from
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    @classmethod
+    def invalidate(cls, user_id):
+        """Drop a user's precomputed list; call in the transaction that changes their ratings or feedback"""
+        cls.query.filter_by(user_id=user_id).delete(synchronize_session=False)
+
+    def __repr__(self):
+        return f'<UserRecommendation user {self.user_id} #{self.rank}: book {self.book_id}>'
@@ -0,0 +1,126 @@
+"""
+Alternating least squares matrix factorization for collaborative filtering
+
+Explicit mode fits observed ratings directly. Implicit mode follows Hu, Koren & Volinsky:
+every user-item cell has a binary preference weighted by a confidence that grows with the
+strength of the interaction.
+"""
+import os
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from scipy import sparse
+
+
+def build_preferences(ratings, feedback, implicit=True, alpha=40.0):
+    """Combine the rating and like/dislike matrices into (preference, confidence) CSR matrices
+
+    `ratings` holds 1-5 stars and `feedback` holds +1 (like) / -1 (dislike), both users x items.
+    A like counts as a 5-star rating and a dislike as a 1-star rating where no rating exists.
+    """
+    ratings = sparse.csr_matrix(ratings, dtype=np.float32)
+    feedback = sparse.csr_matrix(feedback, dtype=np.float32)
+    feedback_as_rating = feedback.copy()
+    feedback_as_rating.data = np.where(feedback_as_rating.data > 0, 5.0, 1.0).astype(np.float32)
+
+    # Explicit ratings win over feedback for the same cell
+    has_rating = ratings.copy()
+    has_rating.data = np.ones_like(has_rating.data)
+    combined = ratings + feedback_as_rating - feedback_as_rating.multiply(has_rating)
+    combined = sparse.csr_matrix(combined, dtype=np.float32)
+    combined.eliminate_zeros()
+    combined.sort_indices()
+
+    if not implicit:
+        confidence = combined.copy()
+        confidence.data = np.ones_like(confidence.data)
+        return combined, confidence
+
+    # Implicit: liked / rated >= 3 is a positive preference, everything else is negative;
+    # confidence scales with how far the signal is from neutral
+    preference = combined.copy()
+    preference.data = (combined.data >= 3).astype(np.float32)
+    confidence = combined.copy()
+    confidence.data = (1.0 + alpha * np.abs(combined.data - 3.0) / 2.0).astype(np.float32)
+    return preference, confidence
+
+
+def _solve_rows(fixed, gram, preference, confidence, rows, regularization, implicit):
+    """Least-squares update for a block of rows; returns a (len(rows), k) array"""
+    k = fixed.shape[1]
+    eye = regularization * np.eye(k, dtype=np.float32)
+    lhs = np.empty((len(rows), k, k), dtype=np.float32)
+    rhs = np.zeros((len(rows), k), dtype=np.float32)
+    indptr, indices = preference.indptr, preference.indices
+    for i, row in enumerate(rows):
+        lo, hi = indptr[row], indptr[row + 1]
+        cols = indices[lo:hi]
+        factors = fixed[cols]
+        conf = confidence.data[lo:hi]
+        pref = preference.data[lo:hi]
+        if implicit:
+            # Y'CY = Y'Y + Y'(C - I)Y over the observed cells only
+            lhs[i] = gram + (factors.T * (conf - 1.0)) @ factors + eye
+            rhs[i] = (conf * pref) @ factors
+        else:
+            lhs[i] = factors.T @ factors + eye * max(hi - lo, 1)
+            rhs[i] = pref @ factors
+    return np.linalg.solve(lhs, rhs[:, :, None])[:, :, 0]
+
+
+def _update(solve_for, fixed, preference, confidence, regularization, implicit, executor, block_size):
+    gram = fixed.T @ fixed if implicit else None
+    blocks = [np.arange(start, min(start + block_size, preference.shape[0]))
+              for start in range(0, preference.shape[0], block_size)]
+    futures = [
+        (block, executor.submit(_solve_rows, fixed, gram, preference, confidence, block, regularization, implicit))
+        for block in blocks
+    ]
+    for block, future in futures:
+        solve_for[block] = future.result()
+
+
+def fold_in(item_factors, preference, confidence, regularization=0.1, implicit=True, gram=None):
+    """User factor rows for new preference rows against fixed item factors
+
+    One half-step of ALS: each row of the users x items `preference` / `confidence` CSR
+    matrices is solved exactly as in training, without touching the item factors. `gram`
+    (item_factors' item_factors) can be passed in to reuse it across calls.
+    """
+    preference = sparse.csr_matrix(preference, dtype=np.float32)
+    confidence = sparse.csr_matrix(confidence, dtype=np.float32)
+    item_factors = np.asarray(item_factors, dtype=np.float32)
+    if implicit and gram is None:
+        gram = item_factors.T @ item_factors
+    return _solve_rows(item_factors, gram, preference, confidence, np.arange(preference.shape[0]),
+                       regularization, implicit)
+
+
+def train_als(preference, confidence, factors=64, iterations=15, regularization=0.1,
+              implicit=True, threads=None, block_size=512, seed=42, callback=None):
+    """Fit user and item factor matrices; returns (user_factors, item_factors) as float32
+
+    Row solves run in a thread pool. NumPy's batched solve releases the GIL, so
+    blocks of users (or items) are factored in parallel.
+    """
+    preference = sparse.csr_matrix(preference, dtype=np.float32)
+    confidence = sparse.csr_matrix(confidence, dtype=np.float32)
+    n_users, n_items = preference.shape
+    rng = np.random.default_rng(seed)
+    user_factors = (rng.standard_normal((n_users, factors)) * 0.01).astype(np.float32)
+    item_factors = (rng.standard_normal((n_items, factors)) * 0.01).astype(np.float32)
+
+    preference_t = preference.T.tocsr()
+    confidence_t = confidence.T.tocsr()
+    preference_t.sort_indices()
+    confidence_t.sort_indices()
+
+    threads = threads or os.cpu_count() or 1
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        for iteration in range(iterations):
+            _update(user_factors, item_factors, preference, confidence,
+                    regularization, implicit, executor, block_size)
+            _update(item_factors, user_factors, preference_t, confidence_t,
+                    regularization, implicit, executor, block_size)
+            if callback is not None:
+                callback(iteration + 1, iterations)
+    return user_factors, item_factors
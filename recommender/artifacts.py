@@ -0,0 +1,339 @@
+"""
+On-disk formats for recommender artifacts
+
+Artifacts live in one directory as raw .npy arrays plus a small manifest.json.
+Readers open the arrays with np.load(mmap_mode='r'), so every worker process
+shares the same page-cache pages instead of deserializing a private copy.
+
+Each build writes a complete version directory under ARTIFACTS_DIR/versions and
+publishes it by atomically replacing the CURRENT pointer file, so readers never see
+a mix of old and new files. A new version starts as hard links to the current one;
+every writer replaces files instead of modifying them, so published versions are
+never changed underneath the workers that have them mapped.
+"""
+import json
+import logging
+import os
+import shutil
+import time
+import numpy as np
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from scipy import sparse
+from config import Config
+
+MANIFEST_NAME = 'manifest.json'
+VECTOR_INDEX_FILE = 'vector.index'
+ALS_INDEX_FILE = 'als_items.index'
+FORMAT_VERSION = 1
+
+CURRENT_POINTER = 'CURRENT'
+VERSIONS_DIR = 'versions'
+_STAGING_SUFFIX = '.staging'
+
+# Staging directories left behind by a killed build are removed after this long
+_STALE_STAGING_SECONDS = 24 * 3600
+
+logger = logging.getLogger(__name__)
+
+
+class IdIndex:
+    """Sorted id array -> position lookup without a Python dict per worker"""
+
+    def __init__(self, ids):
+        self.ids = ids
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _find(self, item_id):
+        pos = int(np.searchsorted(self.ids, item_id))
+        if pos < len(self.ids) and self.ids[pos] == item_id:
+            return pos
+        return None
+
+    def __contains__(self, item_id):
+        return self._find(item_id) is not None
+
+    def __getitem__(self, item_id):
+        pos = self._find(item_id)
+        if pos is None:
+            raise KeyError(item_id)
+        return pos
+
+    def get(self, item_id, default=None):
+        pos = self._find(item_id)
+        return default if pos is None else pos
+
+    def positions(self, item_ids):
+        """Positions of the known ids among item_ids (unknown ids are dropped)"""
+        item_ids = np.asarray(item_ids, dtype=np.int64)
+        if len(item_ids) == 0 or len(self.ids) == 0:
+            return np.empty(0, dtype=np.int64)
+        pos = np.searchsorted(self.ids, item_ids)
+        pos[pos >= len(self.ids)] = 0
+        return pos[self.ids[pos] == item_ids].astype(np.int64)
+
+
+def _versions_dir(base=None):
+    return Path(base or Config.ARTIFACTS_DIR) / VERSIONS_DIR
+
+
+def current_version(base=None):
+    """Name of the published version, None before the first versioned build"""
+    try:
+        return (Path(base or Config.ARTIFACTS_DIR) / CURRENT_POINTER).read_text().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def list_versions(base=None):
+    """Published version names, oldest first"""
+    versions = _versions_dir(base)
+    if not versions.exists():
+        return []
+    return sorted(path.name for path in versions.iterdir()
+                  if path.is_dir() and not path.name.endswith(_STAGING_SUFFIX))
+
+
+def _link_or_copy(source, target):
+    try:
+        os.link(source, target)
+    except OSError:
+        # Filesystems without hard links get a copy
+        shutil.copy2(source, target)
+
+
+class ArtifactStore:
+    """Directory of .npy arrays described by manifest.json
+
+    ArtifactStore.current() opens the published version for reading; ArtifactStore.stage()
+    starts a new version that becomes visible with publish().
+    """
+
+    def __init__(self, root=None, version=None, base=None):
+        self.root = Path(root or Config.ARTIFACTS_DIR)
+        self.version = version
+        self.base = Path(base or Config.ARTIFACTS_DIR)
+        self.staged = False
+        self.dirty = False  # set by every write, so unchanged stages are not published
+
+    @classmethod
+    def current(cls, base=None, version=None):
+        """The published version (or `version`); the flat ARTIFACTS_DIR for pre-versioning builds"""
+        base = Path(base or Config.ARTIFACTS_DIR)
+        version = version or current_version(base)
+        if version is None:
+            return cls(base, base=base)
+        return cls(_versions_dir(base) / version, version=version, base=base)
+
+    @classmethod
+    def stage(cls, base=None):
+        """Start a new version, seeded with hard links to the current one's files"""
+        base = Path(base or Config.ARTIFACTS_DIR)
+        # Timestamped names sort in publish order
+        version = datetime.utcnow().strftime('%Y%m%dT%H%M%S%f')
+        root = _versions_dir(base) / (version + _STAGING_SUFFIX)
+        root.mkdir(parents=True)
+
+        source = cls.current(base)
+        if source.root.exists():
+            for path in source.root.iterdir():
+                if path.is_file() and path.name != CURRENT_POINTER and not path.name.endswith('.tmp'):
+                    _link_or_copy(path, root / path.name)
+
+        store = cls(root, version=version, base=base)
+        store.staged = True
+        return store
+
+    def publish(self, keep=None):
+        """Make a staged version current with one atomic pointer swap, then prune old versions"""
+        if not self.staged:
+            raise RuntimeError("Only a staged version can be published")
+        root = self.root.with_name(self.version)
+        os.replace(self.root, root)
+        self.root = root
+        self.staged = False
+
+        pointer = self.base / CURRENT_POINTER
+        tmp = pointer.with_name(CURRENT_POINTER + '.tmp')
+        tmp.write_text(self.version)
+        os.replace(tmp, pointer)
+        prune_versions(self.base, keep)
+
+    def discard(self):
+        """Delete a staged version that will not be published"""
+        if self.staged:
+            shutil.rmtree(self.root, ignore_errors=True)
+            self.staged = False
+
+    def path(self, name):
+        return self.root / name
+
+    def _array_path(self, name):
+        return self.root / f'{name}.npy'
+
+    def has(self, name):
+        return self._array_path(name).exists()
+
+    def write_array(self, name, array):
+        """Write an array atomically (temp file + rename)"""
+        self.root.mkdir(parents=True, exist_ok=True)
+        target = self._array_path(name)
+        tmp = target.with_suffix('.npy.tmp')
+        with open(tmp, 'wb') as f:
+            np.save(f, np.ascontiguousarray(array))
+        os.replace(tmp, target)
+        self.dirty = True
+
+    def create_array(self, name, shape, dtype):
+        """Preallocated writable memmap in a temp file, filled incrementally and published with commit_array"""
+        self.root.mkdir(parents=True, exist_ok=True)
+        tmp = self._array_path(name).with_suffix('.npy.tmp')
+        return np.lib.format.open_memmap(tmp, mode='w+', dtype=dtype, shape=tuple(shape))
+
+    def commit_array(self, name, array, rows=None):
+        """Flush an array from create_array and move it into place, keeping the first `rows` rows"""
+        tmp = Path(array.filename)
+        array.flush()
+        if rows is not None and rows != array.shape[0]:
+            # Fewer rows arrived than were allocated: publish a compacted copy. The mapped
+            # file is moved aside first, since write_array truncates the same temp path.
+            partial = tmp.with_suffix('.partial.tmp')
+            os.replace(tmp, partial)
+            self.write_array(name, array[:rows])
+            del array
+            partial.unlink(missing_ok=True)
+            return
+        del array
+        os.replace(tmp, self._array_path(name))
+        self.dirty = True
+
+    def discard_array(self, array):
+        """Drop an unpublished array from create_array"""
+        tmp = Path(array.filename)
+        del array
+        tmp.unlink(missing_ok=True)
+
+    def read_array(self, name, mmap=True):
+        """Open an array, memory-mapped read-only by default"""
+        return np.load(self._array_path(name), mmap_mode='r' if mmap else None)
+
+    def remove(self, *names):
+        for name in names:
+            path = self._array_path(name)
+            if path.exists():
+                path.unlink()
+                self.dirty = True
+
+    def _write_compressed(self, prefix, matrix):
+        matrix.sort_indices()
+        self.write_array(f'{prefix}_data', matrix.data)
+        self.write_array(f'{prefix}_indices', matrix.indices)
+        self.write_array(f'{prefix}_indptr', matrix.indptr)
+        return list(matrix.shape)
+
+    def write_csr(self, prefix, matrix):
+        """Write a CSR matrix as three arrays; returns the shape for the manifest"""
+        return self._write_compressed(prefix, sparse.csr_matrix(matrix))
+
+    def write_csc(self, prefix, matrix):
+        """Write a CSC matrix as three arrays; returns the shape for the manifest"""
+        return self._write_compressed(prefix, sparse.csc_matrix(matrix))
+
+    def _read_compressed(self, prefix, shape, cls, mmap):
+        arrays = (
+            self.read_array(f'{prefix}_data', mmap),
+            self.read_array(f'{prefix}_indices', mmap),
+            self.read_array(f'{prefix}_indptr', mmap),
+        )
+        return cls(arrays, shape=tuple(shape), copy=False)
+
+    def read_csr(self, prefix, shape, mmap=True):
+        return self._read_compressed(prefix, shape, sparse.csr_matrix, mmap)
+
+    def read_csc(self, prefix, shape, mmap=True):
+        return self._read_compressed(prefix, shape, sparse.csc_matrix, mmap)
+
+    def read_manifest(self):
+        path = self.path(MANIFEST_NAME)
+        if not path.exists():
+            return {'format': FORMAT_VERSION}
+        with open(path) as f:
+            return json.load(f)
+
+    def update_manifest(self, section, meta):
+        """Replace one section of the manifest (None removes it)"""
+        manifest = self.read_manifest()
+        manifest['format'] = FORMAT_VERSION
+        if meta is None:
+            manifest.pop(section, None)
+        else:
+            manifest[section] = meta
+        self.root.mkdir(parents=True, exist_ok=True)
+        tmp = self.path(MANIFEST_NAME + '.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp, self.path(MANIFEST_NAME))
+        self.dirty = True
+
+
+@contextmanager
+def staged_version(store=None):
+    """Yield `store` as is, or stage a new version that is published if anything was written to it
+
+    Lets a build step run on its own (publishing its own version) or as part of a retrain
+    that publishes every step together.
+    """
+    if store is not None:
+        yield store
+        return
+    store = ArtifactStore.stage()
+    try:
+        yield store
+    except BaseException:
+        store.discard()
+        raise
+    if store.dirty:
+        store.publish()
+        logger.info(f"Published artifact version {store.version}")
+    else:
+        store.discard()
+
+
+def prune_versions(base=None, keep=None):
+    """Delete published versions beyond the newest `keep` and stale staging directories
+
+    Workers still mapping a deleted version keep reading it until they reload; the files
+    are freed once the last mapping is closed.
+    """
+    base = Path(base or Config.ARTIFACTS_DIR)
+    keep = max(1, keep or Config.ARTIFACT_VERSIONS_KEEP)
+    current = current_version(base)
+    versions = [version for version in list_versions(base) if version != current]
+    for version in versions[:max(0, len(versions) - (keep - 1))]:
+        shutil.rmtree(_versions_dir(base) / version, ignore_errors=True)
+
+    cutoff = time.time() - _STALE_STAGING_SECONDS
+    for path in _versions_dir(base).glob('*' + _STAGING_SUFFIX):
+        if path.stat().st_mtime < cutoff:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def sparse_nbytes(matrix):
+    """Memory held by a scipy CSR/CSC matrix"""
+    return matrix.data.nbytes + matrix.indices.nbytes + matrix.indptr.nbytes
+
+
+def private_nbytes(array):
+    """Bytes of an array held in this process's heap (0 for memory-mapped arrays)"""
+    if array is None:
+        return 0
+    # Views (e.g. the arrays scipy wraps a mapped matrix in) chain back to the memmap
+    base = array
+    while base is not None:
+        if isinstance(base, np.memmap):
+            return 0
+        base = getattr(base, 'base', None)
+    return array.nbytes
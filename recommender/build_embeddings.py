@@ -1,7 +1,7 @@
 """
 Build embeddings for books using SentenceTransformers
 """
-import pickle
+import hashlib
 import pandas as pd
 from pathlib import Path
 import sys
@@ -18,13 +18,274 @@ from app import create_app
 from extensions import db
 from models.book_model import Book
 from config import Config
-from sentence_transformers import SentenceTransformer
+from sqlalchemy import func, select
+from recommender import vector_index
+from recommender.artifacts import VECTOR_INDEX_FILE, staged_version
+from recommender.encoding import BatchEncoder
+from recommender.pipeline import BackgroundWriter, prefetch, stream_rows
+from recommender.quantization import QUANTIZATION_TYPES, measure_recall, quantize, remove_quantized
 import numpy as np
 
 
-def build_embeddings():
-    """Build and save book embeddings"""
-    app = create_app()
+def book_text(book):
+    """Text that is embedded for a book"""
+    text = f"{book.title} by {book.author}"
+    if book.description:
+        text += f". {book.description}"
+    return text
+
+
+def content_hash(text):
+    """64-bit blake2b digest of a book's embedding text"""
+    return int.from_bytes(hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+def _index_type(quantization):
+    """Kind of FAISS index the build should leave on disk (None for no index)"""
+    if quantization in ('float16', 'int8'):
+        # A float32 FAISS copy would undo the savings of the quantized store
+        if Config.VECTOR_INDEX_TYPE not in ('none', 'flat'):
+            print(f"Warning: VECTOR_INDEX_TYPE={Config.VECTOR_INDEX_TYPE} is ignored with "
+                  f"EMBEDDING_QUANTIZATION={quantization}; the vector index is removed and searches "
+                  f"scan the {quantization} codes (use EMBEDDING_QUANTIZATION=pq for an approximate index)")
+        return None
+    index_type = 'pq' if quantization == 'pq' else Config.VECTOR_INDEX_TYPE
+    if index_type == 'none' or not vector_index.faiss_available():
+        return None
+    return index_type
+
+
+def _previous_build(store):
+    """Arrays of the last build if it can be updated incrementally, else None"""
+    meta = store.read_manifest().get('embeddings')
+    if not meta or meta.get('model') != Config.EMBEDDING_MODEL_NAME or not meta.get('normalized'):
+        return None
+    if not all(store.has(name) for name in ('embeddings', 'book_ids', 'content_hashes')):
+        return None
+    return {
+        'meta': meta,
+        'embeddings': store.read_array('embeddings'),
+        'book_ids': store.read_array('book_ids'),
+        'hashes': store.read_array('content_hashes'),
+    }
+
+
+def _read_books(app, max_id):
+    """Reader stage: (book_ids, texts, hashes) chunks in id order, streamed from the database"""
+    statement = (
+        select(Book.id, Book.title, Book.author, Book.description)
+        .where(Book.id <= max_id)
+        .order_by(Book.id)
+    )
+    for rows in stream_rows(app, statement):
+        texts = [book_text(row) for row in rows]
+        book_ids = np.array([row.id for row in rows], dtype=np.int64)
+        hashes = np.array([content_hash(text) for text in texts], dtype=np.uint64)
+        yield book_ids, texts, hashes
+
+
+class _EmbeddingSink:
+    """Writer stage: copies finished chunks into preallocated memory-mapped arrays in id order"""
+    
+    def __init__(self, store, count):
+        self.store = store
+        self.count = count
+        self.rows = 0
+        self.book_ids = store.create_array('book_ids', (count,), np.int64)
+        self.hashes = store.create_array('content_hashes', (count,), np.uint64)
+        self.embeddings = None  # allocated once the embedding width is known
+    
+    def write(self, chunk):
+        book_ids, hashes, embeddings = chunk
+        if self.embeddings is None:
+            self.embeddings = self.store.create_array('embeddings', (self.count, embeddings.shape[1]), np.float32)
+        end = self.rows + len(book_ids)
+        if end > self.count:
+            raise RuntimeError("Catalog grew while it was being read, run the build again")
+        self.book_ids[self.rows:end] = book_ids
+        self.hashes[self.rows:end] = hashes
+        self.embeddings[self.rows:end] = embeddings
+        self.rows = end
+    
+    def _arrays(self):
+        return [('book_ids', self.book_ids), ('content_hashes', self.hashes), ('embeddings', self.embeddings)]
+    
+    def commit(self):
+        # Books deleted during the read leave unused rows at the end
+        for name, array in self._arrays():
+            self.store.commit_array(name, array, rows=self.rows)
+    
+    def discard(self):
+        for name, array in self._arrays():
+            if array is not None:
+                self.store.discard_array(array)
+
+
+def _stream_embeddings(app, sink, max_id, previous, progress=None):
+    """Read, encode and write every book as overlapping stages; returns a summary of the changes
+
+    Rows whose id and content hash match the previous build are copied from it instead of
+    re-encoded. changes['appended_from'] is the number of leading rows identical to the
+    previous build when the only change is new books with higher ids (so an index can be
+    appended to), else None.
+    """
+    old_ids = previous['book_ids'] if previous is not None else np.empty(0, dtype=np.int64)
+    n_old = len(old_ids)
+    prefix_unchanged = previous is not None
+    reused = encoded = matched = 0
+    
+    with BatchEncoder() as encoder, BackgroundWriter(sink.write, maxsize=Config.RETRAIN_QUEUE_SIZE) as writer:
+        offset = 0
+        for book_ids, texts, hashes in prefetch(_read_books(app, max_id), maxsize=Config.RETRAIN_QUEUE_SIZE):
+            reuse = np.zeros(len(book_ids), dtype=bool)
+            if n_old:
+                old_pos = np.searchsorted(old_ids, book_ids)
+                old_pos[old_pos >= n_old] = 0
+                known = old_ids[old_pos] == book_ids
+                reuse = known & (previous['hashes'][old_pos] == hashes)
+                matched += int(known.sum())
+            
+            # Rows that also exist at the same position in the previous build
+            overlap = max(0, min(len(book_ids), n_old - offset))
+            if overlap and prefix_unchanged:
+                prefix_unchanged = (np.array_equal(book_ids[:overlap], old_ids[offset:offset + overlap])
+                                    and bool(reuse[:overlap].all()))
+            
+            to_encode = np.flatnonzero(~reuse)
+            vectors = encoder.encode([texts[i] for i in to_encode]) if len(to_encode) else None
+            dim = vectors.shape[1] if vectors is not None else previous['embeddings'].shape[1]
+            rows = np.empty((len(book_ids), dim), dtype=np.float32)
+            if reuse.any():
+                rows[reuse] = previous['embeddings'][old_pos[reuse]]
+            if vectors is not None:
+                rows[to_encode] = vectors
+            writer.submit((book_ids, hashes, rows))
+            
+            reused += int(reuse.sum())
+            encoded += len(to_encode)
+            offset += len(book_ids)
+            print(f"Processed {offset}/{sink.count} books...")
+            if progress is not None:
+                progress('embeddings', offset, sink.count)
+    
+    encoder.report()
+    removed = n_old - matched
+    if previous is not None:
+        print(f"Reused {reused} embeddings, encoded {encoded} new or changed books, dropped {removed} deleted")
+    return {
+        'encoded': encoded,
+        'removed': removed,
+        'unchanged': previous is not None and encoded == 0 and removed == 0,
+        'appended_from': n_old if prefix_unchanged and sink.rows >= n_old else None,
+    }
+
+
+def _update_index(store, embeddings, index_type, previous_kind, appended_from):
+    """Bring the vector index on disk in line with the embeddings; returns it (or None)
+
+    New books with higher ids are appended to the existing index. Other changes refill it,
+    which keeps trained IVF centroids / PQ codebooks; a new index type is built from scratch.
+    """
+    index_path = store.path(VECTOR_INDEX_FILE)
+    if index_type is None:
+        index_path.unlink(missing_ok=True)
+        return None
+    
+    index = None
+    if previous_kind == index_type and index_path.exists():
+        index = vector_index.load_index(index_path, mmap=False)
+        if appended_from is not None and index.ntotal == appended_from:
+            print(f"Appending {len(embeddings) - appended_from} vectors to the {index.kind} index...")
+            index.add(embeddings[appended_from:])
+        else:
+            print(f"Refilling the {index.kind} index with {len(embeddings)} vectors...")
+            index.refill(embeddings)
+    else:
+        print(f"Building {index_type} vector index...")
+        # Rows are already unit length, so FAISS reads the memory-mapped array without a copy
+        index = vector_index.build_index(embeddings, index_type, normalize=False)
+    index.save(index_path)
+    print(f"Saved vector index to {index_path}")
+    return index
+
+
+def _write_embeddings(app, store, count, max_id, full, progress):
+    """Encode changed books into `store` and rebuild the derived artifacts"""
+    quantization = Config.EMBEDDING_QUANTIZATION
+    if quantization not in QUANTIZATION_TYPES:
+        raise ValueError(f"Unknown embedding quantization: {quantization}")
+    index_type = _index_type(quantization)
+    
+    # Stream books through reader -> encoder -> writer stages into preallocated arrays
+    previous = None if full else _previous_build(store)
+    sink = _EmbeddingSink(store, count)
+    try:
+        changes = _stream_embeddings(app, sink, max_id, previous, progress)
+    except BaseException:
+        sink.discard()
+        raise
+    previous_kind = previous['meta'].get('vector_index') if previous else None
+    previous_quantization = previous['meta'].get('quantization', 'none') if previous else None
+    previous = None  # release the memory-mapped arrays before replacing them
+    
+    if changes['unchanged'] and previous_quantization == quantization and previous_kind == index_type:
+        sink.discard()
+        print("Embeddings are up to date, nothing to rebuild")
+        return
+    
+    # Publish embeddings, ids and content hashes as raw arrays that workers memory-map
+    print(f"Saving embeddings to {store.root}...")
+    sink.commit()
+    embeddings = store.read_array('embeddings')
+    
+    # Compact codes the recommender scores against instead of the float32 rows
+    remove_quantized(store)
+    quantized = None
+    if quantization in ('float16', 'int8'):
+        quantized = quantize(embeddings, quantization)
+        quantized.save(store)
+        print(f"Saved {quantization} embeddings: {quantized.nbytes / (1024 * 1024):.1f} MiB "
+              f"(float32: {embeddings.nbytes / (1024 * 1024):.1f} MiB)")
+    
+    # Update the nearest-neighbour index next to the embeddings; PQ codes live in the index
+    index = _update_index(store, embeddings, index_type, previous_kind, changes['appended_from'])
+    if quantization == 'pq' and index is None:
+        print("Product quantization needs faiss, storing float32 embeddings only")
+        quantization = 'none'
+    
+    if quantization != 'none':
+        # Accuracy cost of the compressed store, with and without the exact re-rank
+        def candidates(q, n):
+            if quantized is not None:
+                return np.argsort(-quantized.scores(q))[:n]
+            return index.search(q, n)[1][0]
+        recall = measure_recall(embeddings, candidates, k=10, rerank_candidates=Config.RERANK_CANDIDATES)
+        print(f"Recall@{recall['k']} ({quantization}, {recall['queries']} queries): {recall['recall']:.3f}")
+        if recall['recall_reranked'] is not None:
+            print(f"Recall@{recall['k']} after re-ranking {Config.RERANK_CANDIDATES} candidates: "
+                  f"{recall['recall_reranked']:.3f}")
+    
+    store.update_manifest('embeddings', {
+        'count': int(embeddings.shape[0]),
+        'dim': int(embeddings.shape[1]),
+        'dtype': 'float32',
+        'model': Config.EMBEDDING_MODEL_NAME,
+        'normalized': True,
+        'quantization': quantization,
+        'vector_index': index.kind if index is not None else None,
+    })
+    
+    print(f"Successfully built embeddings for {len(embeddings)} books!")
+    print(f"Embeddings shape: {embeddings.shape}")
+
+
+def build_embeddings(full=False, progress=None, store=None):
+    """Build and save book embeddings, re-encoding only new or changed books unless full=True
+
+    `progress('embeddings', done, total)` is called as books are processed. Writes into
+    `store` (a staged version) when given, otherwise publishes a new artifact version.
+    """
+    app = create_app(preload_recommender=False)
     
     with app.app_context():
         csv_path = Path('data/books.csv')
@@ -87,61 +348,18 @@ def build_embeddings():
                 db.session.commit()
                 print(f"Imported {imported} new books from CSV")
         print("Reading books from database...")
-        books = Book.query.all()
-        books_data = []
-        for book in books:
-            text = f"{book.title} by {book.author}"
-            if book.description:
-                text += f". {book.description}"
-            books_data.append({
-                'id': book.id,
-                'text': text,
-                'title': book.title,
-                'author': book.author
-            })
-        
-        if not books_data:
+        count, max_id = db.session.query(func.count(Book.id), func.max(Book.id)).one()
+        db.session.rollback()  # end the read transaction; the reader stage uses its own session
+        if not count:
             print("No books found. Please add books first.")
             return
+        print(f"Processing {count} books...")
         
-        print(f"Processing {len(books_data)} books...")
-        
-        # Load SentenceTransformer model
-        print("Loading SentenceTransformer model (this may take a moment on first run)...")
-        model = SentenceTransformer('all-MiniLM-L6-v2')
-        
-        # Extract texts
-        texts = [b['text'] for b in books_data]
-        
-        # Generate embeddings in batches
-        print("Generating embeddings...")
-        batch_size = 32
-        embeddings = []
-        
-        for i in range(0, len(texts), batch_size):
-            batch = texts[i:i + batch_size]
-            batch_embeddings = model.encode(batch, show_progress_bar=False)
-            embeddings.append(batch_embeddings)
-            print(f"Processed {min(i + batch_size, len(texts))}/{len(texts)} books...")
-        
-        embeddings = np.vstack(embeddings)
-        
-        # Create index mapping (book_id -> index)
-        books_index = {b['id']: idx for idx, b in enumerate(books_data)}
-        
-        # Save embeddings and index
-        print(f"Saving embeddings to {Config.EMBEDDINGS_PATH}...")
-        with open(Config.EMBEDDINGS_PATH, 'wb') as f:
-            pickle.dump(embeddings, f)
-        
-        print(f"Saving index to {Config.BOOKS_INDEX_PATH}...")
-        with open(Config.BOOKS_INDEX_PATH, 'wb') as f:
-            pickle.dump(books_index, f)
-        
-        print(f"Successfully built embeddings for {len(books_data)} books!")
-        print(f"Embeddings shape: {embeddings.shape}")
+        with staged_version(store) as store:
+            _write_embeddings(app, store, count, max_id, full, progress)
 
 
 if __name__ == '__main__':
-    build_embeddings()
+    # --full re-encodes every book and rebuilds the index from scratch
+    build_embeddings(full='--full' in sys.argv)
 
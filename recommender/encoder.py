@@ -0,0 +1,129 @@
+"""
+Shared query encoder - loads the SentenceTransformer once per process and caches query embeddings
+"""
+import logging
+import threading
+from collections import OrderedDict
+import numpy as np
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_query(text):
+    """Cache key for a free-text query: lowercased with collapsed whitespace"""
+    return ' '.join(str(text).lower().split())
+
+
+class QueryEncoder:
+    """SentenceTransformer front-end with a bounded LRU cache of query embeddings"""
+
+    def __init__(self, model_name=None, cache_size=None):
+        self.model_name = model_name or Config.EMBEDDING_MODEL_NAME
+        self.cache_size = Config.QUERY_CACHE_SIZE if cache_size is None else cache_size
+        self._model = None
+        self._model_lock = threading.Lock()
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def model(self):
+        """Load the SentenceTransformer on first use"""
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    from sentence_transformers import SentenceTransformer
+                    logger.info(f"Loading SentenceTransformer model {self.model_name}")
+                    self._model = SentenceTransformer(self.model_name)
+        return self._model
+
+    def encode(self, text):
+        """Return the embedding for a query, served from cache when possible"""
+        key = normalize_query(text)
+        with self._cache_lock:
+            emb = self._cache.get(key)
+            if emb is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return emb
+            self.misses += 1
+
+        # Encode outside the lock so concurrent misses don't serialize on each other
+        emb = self.model.encode([key])[0]
+        emb.setflags(write=False)
+
+        with self._cache_lock:
+            if self.cache_size > 0:
+                self._cache[key] = emb
+                self._cache.move_to_end(key)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+                    self.evictions += 1
+        return emb
+
+    def encode_batch(self, texts):
+        """Embeddings for several queries as one (m, d) array; cache misses share one forward pass"""
+        keys = [normalize_query(text) for text in texts]
+        found = {}
+        with self._cache_lock:
+            for key in keys:
+                emb = self._cache.get(key)
+                if emb is not None:
+                    self._cache.move_to_end(key)
+                    found[key] = emb
+            self.hits += sum(key in found for key in keys)
+            self.misses += sum(key not in found for key in keys)
+
+        missing = list(dict.fromkeys(key for key in keys if key not in found))
+        if missing:
+            embs = self.model.encode(missing, batch_size=min(len(missing), 256), show_progress_bar=False)
+            with self._cache_lock:
+                for key, emb in zip(missing, embs):
+                    # Own copy per row, so a cached query doesn't pin the whole batch
+                    emb = np.array(emb, dtype=np.float32)
+                    emb.setflags(write=False)
+                    found[key] = emb
+                    if self.cache_size > 0:
+                        self._cache[key] = emb
+                        self._cache.move_to_end(key)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+                    self.evictions += 1
+        if not keys:
+            return np.empty((0, 0), dtype=np.float32)
+        return np.stack([found[key] for key in keys]).astype(np.float32, copy=False)
+
+    def clear(self):
+        """Drop all cached query embeddings"""
+        with self._cache_lock:
+            self._cache.clear()
+
+    def stats(self):
+        """Cache counters for monitoring"""
+        with self._cache_lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._cache),
+                'capacity': self.cache_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+
+_encoder = None
+_encoder_lock = threading.Lock()
+
+
+def get_query_encoder():
+    """Return the process-wide QueryEncoder"""
+    global _encoder
+    if _encoder is None:
+        with _encoder_lock:
+            if _encoder is None:
+                _encoder = QueryEncoder()
+    return _encoder
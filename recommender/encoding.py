@@ -0,0 +1,142 @@
+"""
+Batch encoding pipeline for the embedding build
+
+Texts are sorted by estimated token length and packed into batches under a padded-token
+budget, so short titles are not padded to the longest description. Batches are encoded
+in-process or across a pool of worker processes, each holding its own model, and the
+results are written back in input order.
+"""
+import os
+import time
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import multiprocessing
+from config import Config
+from recommender import vector_index
+
+# Upper bound on texts per batch, however short they are
+MAX_BATCH_SIZE = 256
+
+_worker_model = None
+
+
+def estimate_tokens(text, max_tokens=256):
+    """Rough wordpiece count (~4 characters per token) capped at the model's sequence length"""
+    return min(len(text) // 4 + 2, max_tokens)
+
+
+def token_batches(texts, token_budget=None, max_tokens=256):
+    """Split text positions into length-sorted batches of at most token_budget padded tokens
+
+    Returns a list of position arrays, longest batches first.
+    """
+    token_budget = token_budget or Config.EMBEDDING_TOKEN_BUDGET
+    lengths = np.array([estimate_tokens(text, max_tokens) for text in texts], dtype=np.int64)
+    order = np.argsort(-lengths, kind='stable')
+
+    batches, start = [], 0
+    while start < len(order):
+        # Sorted descending, so the first text sets the padded length of the batch
+        size = max(1, min(token_budget // lengths[order[start]], MAX_BATCH_SIZE))
+        batches.append(order[start:start + size])
+        start += size
+    return batches
+
+
+def _init_worker(model_name, threads):
+    """Load one model per worker process and keep its BLAS/torch threads in its share of cores"""
+    global _worker_model
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+    from sentence_transformers import SentenceTransformer
+    _worker_model = SentenceTransformer(model_name)
+
+
+def _encode_batch(texts):
+    return np.asarray(_worker_model.encode(texts, batch_size=len(texts), show_progress_bar=False),
+                      dtype=np.float32)
+
+
+class BatchEncoder:
+    """Encodes chunks of texts with one model in-process or a persistent pool of worker processes
+
+    Use as a context manager; the model or pool is started on the first encode and reused
+    across chunks.
+    """
+
+    def __init__(self, model=None, workers=None, token_budget=None):
+        self.model = model
+        self.workers = workers or Config.EMBEDDING_WORKERS
+        self.token_budget = token_budget
+        self.pool = None
+        self.encoded = 0
+        self.batches = 0
+        self.seconds = 0.0
+
+    def _start(self):
+        if self.workers > 1:
+            threads = max(1, (os.cpu_count() or 1) // self.workers)
+            print(f"Encoding with {self.workers} worker processes ({threads} threads each)...")
+            # spawn: forked copies of an initialized torch runtime can deadlock
+            context = multiprocessing.get_context('spawn')
+            self.pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=context, initializer=_init_worker,
+                                            initargs=(Config.EMBEDDING_MODEL_NAME, threads))
+        elif self.model is None:
+            from sentence_transformers import SentenceTransformer
+            self.model = SentenceTransformer(Config.EMBEDDING_MODEL_NAME)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.pool is not None:
+            self.pool.shutdown(cancel_futures=exc_type is not None)
+            self.pool = None
+
+    def encode(self, texts):
+        """Unit-length float32 embeddings for texts, row i for texts[i]"""
+        if self.pool is None and self.model is None:
+            self._start()
+        start = time.perf_counter()
+        batches = token_batches(texts, self.token_budget)
+        out = None
+
+        def collect(positions, embeddings):
+            nonlocal out
+            if out is None:
+                out = np.empty((len(texts), embeddings.shape[1]), dtype=np.float32)
+            out[positions] = embeddings
+
+        if self.pool is None:
+            for positions in batches:
+                batch = [texts[i] for i in positions]
+                collect(positions, np.asarray(
+                    self.model.encode(batch, batch_size=len(batch), show_progress_bar=False), dtype=np.float32))
+        else:
+            # Longest batches are submitted first so the pool drains evenly
+            futures = {self.pool.submit(_encode_batch, [texts[i] for i in positions]): positions
+                       for positions in batches}
+            for future in as_completed(futures):
+                collect(futures[future], future.result())
+
+        self.encoded += len(texts)
+        self.batches += len(batches)
+        self.seconds += time.perf_counter() - start
+        return vector_index.l2_normalize(out) if out is not None else np.empty((0, 0), dtype=np.float32)
+
+    def report(self):
+        """Print throughput of everything encoded so far"""
+        if self.encoded:
+            print(f"Encoded {self.encoded} books in {self.seconds:.1f}s "
+                  f"({self.encoded / max(self.seconds, 1e-9):.1f} books/sec, {self.batches} batches)")
+
+
+def encode_texts(texts, model=None, workers=None, token_budget=None):
+    """Unit-length float32 embeddings for texts in one call; prints throughput in books/sec"""
+    with BatchEncoder(model, workers, token_budget) as encoder:
+        embeddings = encoder.encode(texts)
+    encoder.report()
+    return embeddings
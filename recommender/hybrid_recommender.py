@@ -1,24 +1,86 @@
 """
 Hybrid recommender: combines content-based filtering (CBF) and collaborative filtering (CF)
 """
-import pickle
 import numpy as np
 from pathlib import Path
-from sklearn.metrics.pairwise import cosine_similarity
+from scipy import sparse
 import sys
 
 # Add parent directory to path
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
-from app import create_app
 from extensions import db
 from models.book_model import Book
 from models.rating_model import Rating
 from config import Config
+from recommender import item_knn, quantization, vector_index
+from recommender.artifacts import ALS_INDEX_FILE, VECTOR_INDEX_FILE, ArtifactStore, IdIndex, private_nbytes
+from recommender.encoder import get_query_encoder
+from recommender.online import OnlineCF
+from recommender.taste import TasteProfiles
 import logging
 
 logger = logging.getLogger(__name__)
 
+_EMPTY_IDS = np.empty(0, dtype=np.int64)
+_EMPTY_SCORES = np.empty(0, dtype=np.float32)
+
+# Ids per IN (...) query when hydrating, below SQLite's bound-parameter limit
+_HYDRATE_CHUNK = 900
+
+
+def top_k_indices(scores, k, exclude=None):
+    """Positions and scores of the k highest scores in descending order
+
+    Uses argpartition so the cost is O(N + k log k) instead of a full sort.
+    `scores` is modified in place when `exclude` is given.
+    """
+    if exclude is not None and len(exclude):
+        scores[exclude] = -np.inf
+        k = min(k, len(scores) - len(np.unique(exclude)))
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=scores.dtype)
+    top = np.argpartition(-scores, k - 1)[:k]
+    top = top[np.argsort(-scores[top], kind='stable')]
+    return top, scores[top]
+
+
+def top_k_rows(scores, k):
+    """Row-wise top_k_indices for an (m, n) score matrix, as a list of (positions, scores) per row
+
+    One argpartition over the whole matrix; entries at -inf (excluded) are dropped.
+    """
+    k = min(k, scores.shape[1])
+    if k <= 0:
+        return [(_EMPTY_IDS, _EMPTY_SCORES)] * len(scores)
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    top_scores = np.take_along_axis(scores, top, axis=1)
+    order = np.argsort(-top_scores, axis=1, kind='stable')
+    top = np.take_along_axis(top, order, axis=1)
+    top_scores = np.take_along_axis(top_scores, order, axis=1)
+    keep = np.isfinite(top_scores)
+    return [(positions[row_keep], row_scores[row_keep])
+            for positions, row_scores, row_keep in zip(top, top_scores, keep)]
+
+
+def _mask_rows(scores, excludes):
+    """Set scores[i, excludes[i]] to -inf for every row i"""
+    lengths = [len(exclude) for exclude in excludes]
+    if sum(lengths):
+        rows = np.repeat(np.arange(len(excludes)), lengths)
+        scores[rows, np.concatenate(excludes).astype(np.int64)] = -np.inf
+
+
+def prepare_embeddings(embeddings):
+    """Contiguous float32 embeddings with unit-length rows"""
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(embeddings, axis=1)
+    if len(norms) and not np.allclose(norms, 1.0, atol=1e-3):
+        # Artifacts built before normalization was stored at build time
+        embeddings = vector_index.l2_normalize(embeddings)
+    return embeddings
+
 
 class HybridRecommender:
     """Hybrid recommendation engine"""
@@ -26,221 +88,534 @@ class HybridRecommender:
     def __init__(self):
         self.embeddings = None
         self.books_index = None
-        self.index_books = None  # reverse mapping
+        self.book_ids = None  # embedding row -> book id
         self.cf_matrix = None
         self.user_index = None
         self.item_index = None
+        self.item_ids = None  # CF column -> book id
+        self.cf_matrix_csc = None
+        self.item_means = None
+        self.item_similarity = None
+        self.user_factors = None
+        self.item_factors = None
+        self.item_factor_index = None
+        self.als_params = None
+        self.online = None  # rating changes since the CF artifacts were built
+        self.taste = None  # per-user taste vectors over the embeddings
+        self.vector_index = None
+        self.quantization = 'none'
+        self.quantized = None  # compact codes scored in place of the float32 rows
+        self.version = None  # artifact version the arrays were loaded from
     
-    def load_artifacts(self):
-        """Load embeddings, index, and CF matrix"""
+    def load_artifacts(self, store=None):
+        """Open embeddings, index, and CF artifacts (memory-mapped, shared across workers)"""
+        store = store or ArtifactStore.current()
+        self.version = store.version
         try:
+            manifest = store.read_manifest()
+            
             # Load embeddings
-            if Config.EMBEDDINGS_PATH.exists():
-                with open(Config.EMBEDDINGS_PATH, 'rb') as f:
-                    self.embeddings = pickle.load(f)
+            emb_meta = manifest.get('embeddings')
+            if emb_meta and store.has('embeddings'):
+                self.embeddings = store.read_array('embeddings')
+                if not emb_meta.get('normalized'):
+                    # Artifacts built before normalization was stored at build time
+                    self.embeddings = prepare_embeddings(self.embeddings)
+                self.book_ids = store.read_array('book_ids')
+                self.books_index = IdIndex(self.book_ids)
                 logger.info(f"Loaded embeddings: {self.embeddings.shape}")
+                
+                # Quantized codes (PQ codes live in the vector index instead)
+                self.quantization = emb_meta.get('quantization', 'none')
+                if self.quantization in quantization.QUANTIZERS:
+                    self.quantized = quantization.load_quantized(store, self.quantization)
+                    logger.info(f"Loaded {self.quantization} embeddings: {self.quantized.nbytes} bytes")
             else:
-                logger.warning("Embeddings file not found")
+                logger.warning("Embeddings not found")
             
-            # Load books index
-            if Config.BOOKS_INDEX_PATH.exists():
-                with open(Config.BOOKS_INDEX_PATH, 'rb') as f:
-                    self.books_index = pickle.load(f)
-                # Create reverse mapping
-                self.index_books = {v: k for k, v in self.books_index.items()}
-                logger.info(f"Loaded books index: {len(self.books_index)} books")
-            else:
-                logger.warning("Books index file not found")
+            # Load vector index (optional, falls back to brute-force search)
+            self.vector_index = None
+            index_path = store.path(VECTOR_INDEX_FILE)
+            if self.embeddings is not None and Config.VECTOR_INDEX_TYPE != 'none' and index_path.exists():
+                if not vector_index.faiss_available():
+                    logger.warning("Vector index found but faiss is not installed, using brute force")
+                else:
+                    index = vector_index.load_index(index_path)
+                    if index.ntotal != len(self.embeddings):
+                        logger.warning("Vector index is out of date with embeddings, ignoring it")
+                    else:
+                        self.vector_index = index
+                        logger.info(f"Loaded {index.kind} vector index: {index.ntotal} vectors")
             
             # Load CF matrix (optional)
-            if Config.CF_MATRIX_PATH.exists():
-                with open(Config.CF_MATRIX_PATH, 'rb') as f:
-                    cf_data = pickle.load(f)
-                    self.cf_matrix = cf_data.get('matrix')
-                    self.user_index = cf_data.get('user_index')
-                    self.item_index = cf_data.get('item_index')
-                logger.info("Loaded collaborative filtering matrix")
+            cf_meta = manifest.get('cf')
+            if cf_meta:
+                shape = cf_meta['shape']
+                self.cf_matrix = store.read_csr('cf_csr', shape)
+                # Column-major copy for per-item statistics
+                self.cf_matrix_csc = store.read_csc('cf_csc', shape)
+                self.user_index = IdIndex(store.read_array('cf_user_ids'))
+                self.item_ids = store.read_array('cf_item_ids')
+                self.item_index = IdIndex(self.item_ids)
+                self.item_means = store.read_array('cf_item_means')
+                logger.info(f"Loaded collaborative filtering matrix: {self.cf_matrix.shape}, {self.cf_matrix.nnz} ratings")
+                
+                # Item-item neighbourhoods (optional, falls back to item means)
+                sim_meta = cf_meta.get('similarity')
+                if sim_meta:
+                    self.item_similarity = store.read_csr('item_sim', sim_meta['shape'])
+                    logger.info(f"Loaded item similarity: {self.item_similarity.nnz} neighbour pairs")
+                
+                # Matrix-factorization model (optional)
+                als_meta = manifest.get('als')
+                if Config.CF_MODEL == 'als' and als_meta:
+                    self._load_als(store, als_meta, cf_meta)
             else:
                 logger.info("CF matrix not found, will use CBF only")
+            
+            if self.embeddings is not None:
+                self.taste = TasteProfiles(self)
+            # Rating changes logged after the CF matrix was read are applied on top of it
+            self.online = OnlineCF(self, cf_meta.get('delta_watermark', 0) if cf_meta else 0)
         
         except Exception as e:
             logger.error(f"Error loading artifacts: {e}")
             raise
     
-    def recommend_by_text(self, query_emb, top_k=12):
-        """Recommend books based on text query embedding"""
-        if self.embeddings is None or self.books_index is None:
-            return []
+    def _load_als(self, store, als_meta, cf_meta):
+        """Open ALS factors aligned with the CF matrix, plus the optional item-factor index"""
+        if als_meta.get('cf_version') != cf_meta.get('version'):
+            logger.warning("ALS factors were trained on another CF matrix, ignoring them")
+            return
+        user_factors = store.read_array('als_user_factors')
+        item_factors = store.read_array('als_item_factors')
+        if user_factors.shape[0] != len(self.user_index) or item_factors.shape[0] != len(self.item_ids):
+            logger.warning("ALS factors are out of date with the CF matrix, ignoring them")
+            return
+        self.user_factors = user_factors
+        self.item_factors = item_factors
+        self.als_params = als_meta
+        logger.info(f"Loaded ALS factors: {item_factors.shape[1]} factors")
+        
+        index_path = store.path(ALS_INDEX_FILE)
+        if als_meta.get('item_index') and index_path.exists() and vector_index.faiss_available():
+            index = vector_index.load_index(index_path)
+            if index.ntotal == len(item_factors):
+                self.item_factor_index = index
+                logger.info(f"Loaded {index.kind} index over item factors")
+    
+    def _arrays(self):
+        arrays = [self.embeddings, self.book_ids, self.item_ids, self.item_means,
+                  self.quantized.codes if self.quantized is not None else None,
+                  getattr(self.quantized, 'scale', None),
+                  self.user_factors, self.item_factors,
+                  self.user_index.ids if self.user_index is not None else None]
+        for matrix in (self.cf_matrix, self.cf_matrix_csc, self.item_similarity):
+            if matrix is not None:
+                arrays.extend((matrix.data, matrix.indices, matrix.indptr))
+        return [a for a in arrays if a is not None]
+    
+    def memory_usage(self):
+        """Approximate private (non-shared) resident size of loaded artifacts in bytes"""
+        total = sum(private_nbytes(a) for a in self._arrays())
+        for index in (self.vector_index, self.item_factor_index):
+            if index is not None:
+                total += index.nbytes
+        return total
+    
+    def mapped_usage(self):
+        """Bytes of memory-mapped artifacts shared through the page cache"""
+        return sum(a.nbytes - private_nbytes(a) for a in self._arrays())
+    
+    def _positions_for(self, book_ids):
+        """Embedding row positions for the given book ids (unknown ids are skipped)"""
+        if book_ids is None or len(book_ids) == 0 or self.books_index is None:
+            return np.empty(0, dtype=np.int64)
+        return self.books_index.positions(book_ids)
+    
+    def _search_embeddings(self, query_vec, top_k, exclude=None):
+        """Top-K (positions, scores) for a normalized query vector, skipping excluded positions"""
+        n_exclude = 0 if exclude is None else len(exclude)
+        # Quantized scores are approximate: take extra candidates and re-score them exactly
+        rerank = self.quantization != 'none' and Config.RERANK_CANDIDATES > 0
+        n_candidates = max(top_k, Config.RERANK_CANDIDATES) if rerank else top_k
         
-        # Compute cosine similarity
-        similarities = cosine_similarity([query_emb], self.embeddings)[0]
+        if self.vector_index is not None:
+            # Over-fetch so excluded hits don't leave the page short
+            scores, positions = self.vector_index.search(query_vec, n_candidates + n_exclude)
+            positions, scores = positions[0], scores[0]
+            keep = positions >= 0
+            if n_exclude:
+                keep &= ~np.isin(positions, exclude)
+            positions, scores = positions[keep][:n_candidates], scores[keep][:n_candidates]
+        elif self.quantized is not None:
+            positions, scores = top_k_indices(self.quantized.scores(query_vec), n_candidates, exclude)
+        else:
+            # Exact path: one matrix-vector product over the pre-normalized matrix
+            scores = self.embeddings @ query_vec
+            return top_k_indices(scores, top_k, exclude)
         
-        # Get top-K indices
-        top_indices = np.argsort(similarities)[::-1][:top_k]
+        if rerank:
+            # Only the candidate rows of the full-precision matrix are paged in
+            return quantization.rerank(self.embeddings, query_vec, positions, top_k)
+        return positions[:top_k], scores[:top_k]
+    
+    def _search_embeddings_batch(self, query_vecs, top_k, excludes=None):
+        """_search_embeddings for each row of a normalized (m, d) query matrix
+
+        Queries are scored RECOMMEND_BATCH_CHUNK at a time with one matrix-matrix product
+        (or one batched index search) per chunk. Returns a list of (positions, scores).
+        """
+        excludes = excludes if excludes is not None else [_EMPTY_IDS] * len(query_vecs)
+        rerank = self.quantization != 'none' and Config.RERANK_CANDIDATES > 0
+        n_candidates = max(top_k, Config.RERANK_CANDIDATES) if rerank else top_k
         
-        # Get book IDs and scores
         results = []
-        app = create_app()
-        with app.app_context():
-            for idx in top_indices:
-                if idx in self.index_books:
-                    book_id = self.index_books[idx]
-                    book = Book.query.get(book_id)
-                    if book:
-                        results.append({
-                            'id': book.id,
-                            'title': book.title,
-                            'author': book.author,
-                            'genres': book.genres or '',
-                            'score': float(similarities[idx])
-                        })
-        
+        chunk = Config.RECOMMEND_BATCH_CHUNK
+        for start in range(0, len(query_vecs), chunk):
+            queries = query_vecs[start:start + chunk]
+            chunk_excludes = excludes[start:start + chunk]
+            if self.vector_index is not None:
+                n_exclude = max(len(exclude) for exclude in chunk_excludes)
+                scores, positions = self.vector_index.search(queries, n_candidates + n_exclude)
+                candidates = []
+                for row_positions, row_scores, exclude in zip(positions, scores, chunk_excludes):
+                    keep = row_positions >= 0
+                    if len(exclude):
+                        keep &= ~np.isin(row_positions, exclude)
+                    candidates.append((row_positions[keep][:n_candidates], row_scores[keep][:n_candidates]))
+            elif self.quantized is not None:
+                scores = self.quantized.scores(queries)
+                _mask_rows(scores, chunk_excludes)
+                candidates = top_k_rows(scores, n_candidates)
+            else:
+                # Exact path: one matrix-matrix product over the pre-normalized matrix
+                scores = queries @ self.embeddings.T
+                _mask_rows(scores, chunk_excludes)
+                results.extend(top_k_rows(scores, top_k))
+                continue
+            
+            for query_vec, (positions, scores) in zip(queries, candidates):
+                if rerank:
+                    results.append(quantization.rerank(self.embeddings, query_vec, positions, top_k))
+                else:
+                    results.append((positions[:top_k], scores[:top_k]))
         return results
     
-    def recommend_similar_books(self, book_id, top_k=12):
-        """Find similar books based on content"""
-        if self.embeddings is None or self.books_index is None:
-            return []
+    def score_by_text(self, query_emb, top_k=12, exclude_ids=None):
+        """Top-K (book_ids, scores) for a text query embedding"""
+        if self.embeddings is None or self.book_ids is None:
+            return _EMPTY_IDS, _EMPTY_SCORES
+        
+        query_vec = vector_index.l2_normalize(query_emb)[0]
+        positions, scores = self._search_embeddings(query_vec, top_k, self._positions_for(exclude_ids))
+        return self.book_ids[positions], scores
+    
+    def score_similar_books(self, book_id, top_k=12, exclude_ids=None):
+        """Top-K (book_ids, scores) of books similar in content to book_id"""
+        if self.embeddings is None or self.book_ids is None:
+            return _EMPTY_IDS, _EMPTY_SCORES
         
         if book_id not in self.books_index:
-            return []
+            return _EMPTY_IDS, _EMPTY_SCORES
         
         book_idx = self.books_index[book_id]
         book_emb = self.embeddings[book_idx]
         
-        # Compute similarities
-        similarities = cosine_similarity([book_emb], self.embeddings)[0]
-        
-        # Exclude the book itself
-        similarities[book_idx] = -1
+        # Exclude the seed book itself along with any caller-supplied books
+        exclude = np.union1d(self._positions_for(exclude_ids), [book_idx])
+        positions, scores = self._search_embeddings(book_emb, top_k, exclude)
+        return self.book_ids[positions], scores
+    
+    def score_by_text_batch(self, query_embs, top_k=12, exclude_ids=None):
+        """score_by_text for each row of a query embedding matrix; exclude_ids holds one id list per query"""
+        if self.embeddings is None or self.book_ids is None or len(query_embs) == 0:
+            return [(_EMPTY_IDS, _EMPTY_SCORES)] * len(query_embs)
         
-        # Get top-K
-        top_indices = np.argsort(similarities)[::-1][:top_k]
+        query_vecs = vector_index.l2_normalize(query_embs)
+        excludes = [self._positions_for(ids) for ids in exclude_ids] if exclude_ids is not None else None
+        return [(self.book_ids[positions], scores)
+                for positions, scores in self._search_embeddings_batch(query_vecs, top_k, excludes)]
+    
+    def score_by_taste(self, user_id, top_k=12):
+        """Top-K (book_ids, scores) for the user's taste vector, skipping books they rated or gave feedback on"""
+        if self.taste is None:
+            return _EMPTY_IDS, _EMPTY_SCORES
         
-        results = []
-        app = create_app()
-        with app.app_context():
-            for idx in top_indices:
-                if idx in self.index_books:
-                    similar_book_id = self.index_books[idx]
-                    if similar_book_id != book_id:
-                        book = Book.query.get(similar_book_id)
-                        if book:
-                            results.append({
-                                'id': book.id,
-                                'title': book.title,
-                                'author': book.author,
-                                'genres': book.genres or '',
-                                'score': float(similarities[idx])
-                            })
+        profile = self.taste.get(user_id)
+        taste_vec = profile.vector()
+        if taste_vec is None:
+            return _EMPTY_IDS, _EMPTY_SCORES
+        positions, scores = self._search_embeddings(
+            vector_index.l2_normalize(taste_vec)[0], top_k, profile.positions()
+        )
+        return self.book_ids[positions], scores
+    
+    def score_by_taste_batch(self, user_ids, top_k=12):
+        """score_by_taste for each of user_ids; profiles missing from the cache are built together"""
+        results = [(_EMPTY_IDS, _EMPTY_SCORES)] * len(user_ids)
+        if self.taste is None or not user_ids:
+            return results
         
+        profiles = self.taste.get_many(user_ids)
+        known = [(slot, profiles[user_id]) for slot, user_id in enumerate(user_ids)
+                 if profiles[user_id].vector() is not None]
+        if not known:
+            return results
+        slots, known_profiles = zip(*known)
+        query_vecs = vector_index.l2_normalize(np.array([profile.vector() for profile in known_profiles]))
+        excludes = [profile.positions() for profile in known_profiles]
+        for slot, (positions, scores) in zip(slots, self._search_embeddings_batch(query_vecs, top_k, excludes)):
+            results[slot] = (self.book_ids[positions], scores)
         return results
     
-    def recommend_collaborative(self, user_id, top_k=12):
-        """Collaborative filtering recommendations"""
-        if self.cf_matrix is None or self.user_index is None or self.item_index is None:
-            return []
+    def score_similar_books_batch(self, book_ids, top_k=12):
+        """score_similar_books for each of book_ids (unknown books get no results)"""
+        results = [(_EMPTY_IDS, _EMPTY_SCORES)] * len(book_ids)
+        if self.embeddings is None or self.book_ids is None:
+            return results
         
-        if user_id not in self.user_index:
+        known = [(slot, self.books_index[book_id]) for slot, book_id in enumerate(book_ids)
+                 if book_id in self.books_index]
+        if not known:
+            return results
+        slots, positions = zip(*known)
+        query_vecs = np.asarray(self.embeddings[np.array(positions)], dtype=np.float32)
+        excludes = [np.array([position]) for position in positions]
+        for slot, (found, scores) in zip(slots, self._search_embeddings_batch(query_vecs, top_k, excludes)):
+            results[slot] = (self.book_ids[found], scores)
+        return results
+    
+    def _user_ratings(self, user_id):
+        """(column positions, ratings) of the user's rated items, None for users CF doesn't know"""
+        if self.online is None:
+            return None
+        return self.online.row(user_id)
+    
+    def _user_vector(self, user_id):
+        """The user's ALS factors, folded in again after any rating change"""
+        user_vec = self.online.user_factors.get(user_id)
+        if user_vec is None and user_id in self.user_index:
+            user_vec = self.user_factors[self.user_index[user_id]]
+        return user_vec
+    
+    def rated_book_ids(self, user_id):
+        """Book ids the user has rated according to the CF matrix and newer ratings"""
+        row = self._user_ratings(user_id)
+        if row is None:
             return []
+        return self.item_ids[row[0]].tolist()
+    
+    def score_collaborative(self, user_id, top_k=12):
+        """Top-K (book_ids, scores) from collaborative filtering"""
+        if self.cf_matrix is None or self.user_index is None or self.item_index is None:
+            return _EMPTY_IDS, _EMPTY_SCORES
         
-        user_idx = self.user_index[user_id]
-        user_ratings = self.cf_matrix[user_idx]
-        
-        # Simple item-based CF: find items similar to user's rated items
-        # For now, return top-rated items by other users with similar preferences
-        # This is a simplified version
-        
-        # Get items user hasn't rated
-        unrated_items = np.where(user_ratings == 0)[0]
+        row = self._user_ratings(user_id)
+        if row is None:
+            return _EMPTY_IDS, _EMPTY_SCORES
         
-        if len(unrated_items) == 0:
-            return []
+        rated, ratings = row
+        if self.user_factors is not None:
+            # Matrix factorization: one dot product per item, independent of the number of users
+            user_vec = self._user_vector(user_id)
+            if user_vec is None:
+                return _EMPTY_IDS, _EMPTY_SCORES
+            if self.item_factor_index is not None:
+                scores, positions = self.item_factor_index.search(user_vec, top_k + len(rated))
+                positions, scores = positions[0], scores[0]
+                keep = (positions >= 0) & ~np.isin(positions, rated)
+                return self.item_ids[positions[keep][:top_k]], scores[keep][:top_k]
+            scores = self.item_factors @ user_vec
+        elif self.item_similarity is not None:
+            # Weighted average over the neighbours of the user's rated items
+            scores = item_knn.score_user(
+                self.item_similarity, rated, ratings, adjusted=Config.CF_SIMILARITY == 'adjusted_cosine'
+            )
+        else:
+            # Mean rating of every item among the users who rated it (precomputed at load)
+            scores = self.item_means.copy()
         
-        # Compute item-item similarity (simplified)
-        item_scores = np.zeros(len(unrated_items))
+        top, scores = top_k_indices(scores, top_k, rated)
+        # Items with no rated neighbour score -inf and are never recommended
+        keep = np.isfinite(scores)
+        return self.item_ids[top[keep]], scores[keep]
+    
+    def score_collaborative_batch(self, user_ids, top_k=12):
+        """score_collaborative for each of user_ids, scoring RECOMMEND_BATCH_CHUNK users per matrix product"""
+        results = [(_EMPTY_IDS, _EMPTY_SCORES)] * len(user_ids)
+        if self.cf_matrix is None or self.user_index is None or self.item_index is None:
+            return results
         
-        for i, item_idx in enumerate(unrated_items):
-            # Find users who rated this item
-            item_ratings = self.cf_matrix[:, item_idx]
-            rated_by = np.where(item_ratings > 0)[0]
+        known = []
+        for slot, user_id in enumerate(user_ids):
+            row = self._user_ratings(user_id)
+            if row is not None and (self.user_factors is None or self._user_vector(user_id) is not None):
+                known.append((slot, user_id, row))
+        chunk = Config.RECOMMEND_BATCH_CHUNK
+        for start in range(0, len(known), chunk):
+            slots, chunk_users, rows = zip(*known[start:start + chunk])
+            rated = [positions for positions, _ in rows]
             
-            if len(rated_by) > 0:
-                # Average rating for this item
-                item_scores[i] = np.mean(item_ratings[rated_by])
-        
-        # Get top-K items
-        top_item_indices = np.argsort(item_scores)[::-1][:top_k]
+            if self.user_factors is not None:
+                user_vecs = np.array([self._user_vector(user_id) for user_id in chunk_users], dtype=np.float32)
+                if self.item_factor_index is not None:
+                    scores, positions = self.item_factor_index.search(user_vecs, top_k + max(map(len, rated)))
+                    for slot, row_positions, row_scores, row_rated in zip(slots, positions, scores, rated):
+                        keep = (row_positions >= 0) & ~np.isin(row_positions, row_rated)
+                        results[slot] = (self.item_ids[row_positions[keep][:top_k]], row_scores[keep][:top_k])
+                    continue
+                scores = user_vecs @ self.item_factors.T
+            elif self.item_similarity is not None:
+                indptr = np.cumsum([0] + [len(positions) for positions in rated])
+                ratings = sparse.csr_matrix(
+                    (np.concatenate([values for _, values in rows]), np.concatenate(rated), indptr),
+                    shape=(len(rows), len(self.item_ids)), dtype=np.float32
+                )
+                scores = item_knn.score_users(
+                    self.item_similarity, ratings, adjusted=Config.CF_SIMILARITY == 'adjusted_cosine'
+                )
+            else:
+                scores = np.tile(self.item_means, (len(rows), 1))
+            
+            _mask_rows(scores, rated)
+            for slot, (top, top_scores) in zip(slots, top_k_rows(scores, top_k)):
+                results[slot] = (self.item_ids[top], top_scores)
+        return results
+    
+    def _book_rows(self, book_ids):
+        """Book id -> (id, title, author, genres) row, _HYDRATE_CHUNK ids per query"""
+        book_ids = sorted({int(b) for b in book_ids})
+        by_id = {}
+        for start in range(0, len(book_ids), _HYDRATE_CHUNK):
+            rows = db.session.query(Book.id, Book.title, Book.author, Book.genres).filter(
+                Book.id.in_(book_ids[start:start + _HYDRATE_CHUNK])
+            ).all()
+            by_id.update((row.id, row) for row in rows)
+        return by_id
+    
+    def hydrate(self, book_ids, scores, by_id=None):
+        """Attach book details to ranked ids with a single query, preserving rank order
+
+        Must be called inside an app context (the caller's request context). `by_id`
+        reuses rows already fetched with _book_rows.
+        """
+        book_ids = [int(b) for b in book_ids]
+        if not book_ids:
+            return []
+        if by_id is None:
+            by_id = self._book_rows(book_ids)
         
         results = []
-        app = create_app()
-        with app.app_context():
-            for item_idx in top_item_indices:
-                actual_item_idx = unrated_items[item_idx]
-                if actual_item_idx in self.item_index:
-                    book_id = self.item_index[actual_item_idx]
-                    book = Book.query.get(book_id)
-                    if book:
-                        results.append({
-                            'id': book.id,
-                            'title': book.title,
-                            'author': book.author,
-                            'genres': book.genres or '',
-                            'score': float(item_scores[item_idx])
-                        })
-        
+        for book_id, score in zip(book_ids, scores):
+            row = by_id.get(book_id)
+            if row is not None:
+                results.append({
+                    'id': row.id,
+                    'title': row.title,
+                    'author': row.author,
+                    'genres': row.genres or '',
+                    'score': float(score)
+                })
         return results
     
-    def recommend_hybrid(self, user_id=None, book_id=None, query_emb=None, top_k=12):
-        """Hybrid recommendations combining CBF and CF"""
-        results = []
+    def recommend_by_text(self, query_emb, top_k=12, exclude_ids=None):
+        """Recommend books based on text query embedding"""
+        return self.hydrate(*self.score_by_text(query_emb, top_k, exclude_ids))
+    
+    def recommend_similar_books(self, book_id, top_k=12, exclude_ids=None):
+        """Find similar books based on content"""
+        return self.hydrate(*self.score_similar_books(book_id, top_k, exclude_ids))
+    
+    def recommend_collaborative(self, user_id, top_k=12):
+        """Collaborative filtering recommendations"""
+        return self.hydrate(*self.score_collaborative(user_id, top_k))
+    
+    def _top_rated(self, top_k):
+        """Fallback content stage: (book_ids, avg ratings) of the top-rated books"""
+        rows = db.session.query(Book.id, Book.avg_rating).order_by(
+            Book.avg_rating.desc()
+        ).limit(top_k).all()
+        return (np.array([r.id for r in rows], dtype=np.int64),
+                np.array([r.avg_rating for r in rows], dtype=np.float32))
+    
+    def _blend(self, cbf_ids, cbf_scores, cf_ids, cf_scores, top_k):
+        """Merge the two stages on book id (0.6 CBF + 0.4 CF); a book missing from one stage scores 0 there"""
+        merged_ids = np.union1d(cbf_ids, cf_ids)
+        if len(merged_ids) == 0:
+            return _EMPTY_IDS, _EMPTY_SCORES
+        hybrid = np.zeros(len(merged_ids), dtype=np.float32)
+        hybrid[np.searchsorted(merged_ids, cbf_ids)] += 0.6 * cbf_scores
+        hybrid[np.searchsorted(merged_ids, cf_ids)] += 0.4 * cf_scores
         
-        # Content-based recommendations
-        cbf_results = []
+        top, scores = top_k_indices(hybrid, top_k)
+        return merged_ids[top], scores
+    
+    def score_hybrid(self, user_id=None, book_id=None, query_emb=None, top_k=12):
+        """Top-K (book_ids, scores) blending CBF and CF (0.6 CBF + 0.4 CF)"""
+        # Books the user already rated are masked out of the content-based stage
+        rated_ids = self.rated_book_ids(user_id) if user_id else None
+        
+        # Content-based scores
         if book_id:
-            cbf_results = self.recommend_similar_books(book_id, top_k=top_k * 2)
+            cbf_ids, cbf_scores = self.score_similar_books(book_id, top_k=top_k * 2, exclude_ids=rated_ids)
         elif query_emb is not None:
-            cbf_results = self.recommend_by_text(query_emb, top_k=top_k * 2)
+            cbf_ids, cbf_scores = self.score_by_text(query_emb, top_k=top_k * 2, exclude_ids=rated_ids)
         else:
-            # Fallback: top-rated books
-            app = create_app()
-            with app.app_context():
-                books = Book.query.order_by(Book.avg_rating.desc()).limit(top_k).all()
-                cbf_results = [{'id': b.id, 'title': b.title, 'author': b.author, 
-                              'genres': b.genres or '', 'score': b.avg_rating} for b in books]
-        
-        # Collaborative filtering recommendations
-        cf_results = []
-        if user_id:
-            cf_results = self.recommend_collaborative(user_id, top_k=top_k * 2)
-        
-        # Merge results with weighting (0.6 CBF + 0.4 CF)
-        score_dict = {}
-        
-        # Add CBF results
-        for item in cbf_results:
-            book_id = item['id']
-            if book_id not in score_dict:
-                score_dict[book_id] = {'item': item, 'cbf_score': item['score'], 'cf_score': 0.0}
-            else:
-                score_dict[book_id]['cbf_score'] = item['score']
+            # The user's taste vector; top-rated books without one
+            cbf_ids, cbf_scores = self.score_by_taste(user_id, top_k=top_k * 2) if user_id else (_EMPTY_IDS, _EMPTY_SCORES)
+            if len(cbf_ids) == 0:
+                cbf_ids, cbf_scores = self._top_rated(top_k)
         
-        # Add CF results
-        for item in cf_results:
-            book_id = item['id']
-            if book_id not in score_dict:
-                score_dict[book_id] = {'item': item, 'cbf_score': 0.0, 'cf_score': item['score']}
-            else:
-                score_dict[book_id]['cf_score'] = item['score']
-        
-        # Calculate hybrid scores
-        for book_id, data in score_dict.items():
-            hybrid_score = 0.6 * data['cbf_score'] + 0.4 * data['cf_score']
-            data['item']['score'] = hybrid_score
-        
-        # Sort by hybrid score and return top-K
-        sorted_results = sorted(score_dict.values(), key=lambda x: x['item']['score'], reverse=True)
-        results = [r['item'] for r in sorted_results[:top_k]]
+        # Collaborative filtering scores
+        cf_ids, cf_scores = _EMPTY_IDS, _EMPTY_SCORES
+        if user_id:
+            cf_ids, cf_scores = self.score_collaborative(user_id, top_k=top_k * 2)
         
-        return results
+        return self._blend(cbf_ids, cbf_scores, cf_ids, cf_scores, top_k)
+    
+    def score_hybrid_batch(self, user_ids, top_k=12):
+        """score_hybrid(user_id=...) for each of user_ids; the top-rated fallback is read once"""
+        cbf = self.score_by_taste_batch(user_ids, top_k=top_k * 2)
+        if any(len(ids) == 0 for ids, _ in cbf):
+            top_rated = self._top_rated(top_k)
+            cbf = [stage if len(stage[0]) else top_rated for stage in cbf]
+        return [self._blend(cbf_ids, cbf_scores, cf_ids, cf_scores, top_k)
+                for (cbf_ids, cbf_scores), (cf_ids, cf_scores)
+                in zip(cbf, self.score_collaborative_batch(user_ids, top_k=top_k * 2))]
+    
+    def recommend_hybrid(self, user_id=None, book_id=None, query_emb=None, top_k=12):
+        """Hybrid recommendations combining CBF and CF"""
+        return self.hydrate(*self.score_hybrid(user_id, book_id, query_emb, top_k))
 
+    def recommend_batch(self, user_ids=None, book_ids=None, queries=None, top_k=12, encoder=None):
+        """Recommendations for many users, seed books and/or text queries in one call
+
+        Users get hybrid recommendations, book ids similar books and queries text matches;
+        queries are encoded in one batched forward pass. Returns
+        {'users': {user_id: [...]}, 'books': {book_id: [...]}, 'queries': {query: [...]}} with
+        book details for the whole batch loaded in one hydration pass. Must be called inside
+        an app context.
+        """
+        ranked = {'users': {}, 'books': {}, 'queries': {}}
+        if user_ids:
+            user_ids = list(dict.fromkeys(user_ids))
+            ranked['users'] = dict(zip(user_ids, self.score_hybrid_batch(user_ids, top_k)))
+        if book_ids:
+            book_ids = list(dict.fromkeys(book_ids))
+            ranked['books'] = dict(zip(book_ids, self.score_similar_books_batch(book_ids, top_k)))
+        if queries:
+            queries = list(dict.fromkeys(queries))
+            results = [(_EMPTY_IDS, _EMPTY_SCORES)] * len(queries)
+            if self.embeddings is not None:
+                encoder = encoder or get_query_encoder()
+                results = self.score_by_text_batch(encoder.encode_batch(queries), top_k)
+            ranked['queries'] = dict(zip(queries, results))
+        
+        by_id = self._book_rows(np.concatenate(
+            [_EMPTY_IDS] + [ids for group in ranked.values() for ids, _ in group.values()]
+        ))
+        return {
+            group: {key: self.hydrate(ids, scores, by_id) for key, (ids, scores) in items.items()}
+            for group, items in ranked.items()
+        }
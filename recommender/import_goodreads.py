@@ -16,7 +16,7 @@ os.chdir(project_dir)
 sys.path.insert(0, str(project_dir))
 
 def import_books(path):
-    app = create_app()
+    app = create_app(preload_recommender=False)
     with app.app_context():
         if not path:
             return 0
@@ -103,7 +103,7 @@ def ensure_users(user_ids):
     return created
 
 def import_ratings(path, limit=0):
-    app = create_app()
+    app = create_app(preload_recommender=False)
     with app.app_context():
         if not path:
             return 0
@@ -149,8 +149,22 @@ def import_ratings(path, limit=0):
             total += len(chunk)
         return imported
 
+def fold_imported_ratings():
+    """Rebuild the CF artifacts from the ratings table after a bulk import
+
+    A bulk import doesn't write the rating delta log: replaying it row by row would stall
+    every worker. The imported ratings reach serving workers through a compacted version
+    instead, which they load in the background.
+    """
+    from recommender.artifacts import current_version
+    if current_version() is None:
+        print("No model published yet; run recommender/retrain_model.py to train on the imported ratings.")
+        return
+    from recommender.retrain_model import compact
+    compact()
+
 def import_tags(path):
-    app = create_app()
+    app = create_app(preload_recommender=False)
     with app.app_context():
         p = Path(path)
         if not p.exists():
@@ -187,7 +201,7 @@ def import_tags(path):
         return imported
 
 def import_book_tags(path):
-    app = create_app()
+    app = create_app(preload_recommender=False)
     with app.app_context():
         p = Path(path)
         if not p.exists():
@@ -230,6 +244,8 @@ def main():
     limit = Config.GOODREADS_RATINGS_LIMIT
     b = import_books(books_path)
     r = import_ratings(ratings_path, limit)
+    if ratings_path:
+        fold_imported_ratings()
     t = 0
     bt = 0
     if tags_path:
@@ -0,0 +1,302 @@
+"""
+Background retrain jobs - a jobs table, a per-process runner thread and progress reporting
+
+The admin panel enqueues a RetrainJob. A runner thread in the web process claims it
+atomically and runs recommender/retrain_model.py as a child process, so the request
+returns immediately and a large retrain never holds a gunicorn worker. The child writes
+stage progress (books embedded, ratings processed, ETA) to the job row through
+JobProgress and stops at its next progress report once the job is cancelled.
+"""
+import logging
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError
+from config import Config
+from extensions import db
+from models.job_model import ACTIVE_STATUSES, RetrainJob
+from recommender.artifacts import current_version
+from response_cache import response_cache
+
+logger = logging.getLogger(__name__)
+
+RETRAIN_SCRIPT = Path(__file__).parent / 'retrain_model.py'
+
+# What each stage counts
+STAGE_UNITS = {'embeddings': 'books', 'cf': 'ratings', 'als': 'iterations', 'precompute': 'users', 'moods': 'books'}
+
+# Seconds between checks of the child process and the cancel flag
+_POLL_SECONDS = 1.0
+
+
+class JobCancelled(Exception):
+    """Raised inside a retrain once its job has been cancelled"""
+
+
+class JobProgress:
+    """Progress callback for a retrain running as a job
+
+    Call as progress(stage, done, total). Counters and the stage ETA are written to the
+    job row at most every RETRAIN_PROGRESS_INTERVAL seconds; raises JobCancelled when the
+    job was cancelled.
+    """
+
+    def __init__(self, app, job_id):
+        self.app = app
+        self.job_id = job_id
+        self.stage = None
+        self.stages = {}
+        self._stage_started = {}
+        self._last_write = 0.0
+
+    def __call__(self, stage, done, total=None):
+        now = time.monotonic()
+        started = self._stage_started.setdefault(stage, now)
+        info = self.stages.setdefault(stage, {'unit': STAGE_UNITS.get(stage), 'done': 0, 'total': None})
+        info['done'] = int(done)
+        if total is not None:
+            info['total'] = int(total)
+        # Linear extrapolation from the stage's throughput so far
+        info['eta_seconds'] = None
+        if info['total'] and done:
+            info['eta_seconds'] = round((now - started) / done * max(info['total'] - done, 0), 1)
+        self.stage = stage
+
+        finished = info['total'] is not None and done >= info['total']
+        if finished or now - self._last_write >= Config.RETRAIN_PROGRESS_INTERVAL:
+            self._last_write = now
+            self.flush()
+
+    def flush(self):
+        with self.app.app_context():
+            job = db.session.get(RetrainJob, self.job_id)
+            if job is None:
+                return
+            job.stage = self.stage
+            # New dict so the JSON column is seen as changed
+            job.progress = {
+                'stages': {name: dict(info) for name, info in self.stages.items()},
+                'eta_seconds': self.stages[self.stage]['eta_seconds'] if self.stage else None,
+            }
+            job.heartbeat_at = datetime.utcnow()
+            cancelled = job.cancel_requested
+            db.session.commit()
+        if cancelled:
+            raise JobCancelled(f"Job {self.job_id} was cancelled")
+
+
+class JobRunner:
+    """Runs queued retrain jobs one at a time on a background thread of this process"""
+
+    def __init__(self):
+        self.app = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.app = app
+        app.extensions['retrain_jobs'] = self
+
+    def active_job(self):
+        return RetrainJob.query.filter(RetrainJob.status.in_(ACTIVE_STATUSES)).order_by(RetrainJob.id.desc()).first()
+
+    def latest_job(self):
+        return RetrainJob.query.order_by(RetrainJob.id.desc()).first()
+
+    def enqueue(self, full=False, user_id=None):
+        """Queue a retrain; returns (job, created). While a job is active it is returned instead"""
+        self._expire_stale()
+        job = RetrainJob(full=full, created_by=user_id)
+        db.session.add(job)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # The partial unique index allows one active job: someone else got there first.
+            # If it is queued in a process that died before claiming it, this one claims it.
+            db.session.rollback()
+            self._ensure_worker()
+            return self.active_job(), False
+        self._ensure_worker()
+        return job, True
+
+    def cancel(self, job_id):
+        """Cancel a queued job now, or ask a running one to stop; returns the job (None if unknown)"""
+        job = db.session.get(RetrainJob, job_id)
+        if job is None or not job.is_active:
+            return job
+        if job.status == 'queued':
+            job.status = 'cancelled'
+            job.finished_at = datetime.utcnow()
+        job.cancel_requested = True
+        db.session.commit()
+        return job
+
+    def _expire_stale(self):
+        """Fail jobs whose runner went away (e.g. its worker was restarted)
+
+        A running job is stale once its heartbeats stop; its retrain process is stopped
+        first if it is still alive, so it can't publish alongside the next job. A queued
+        job is stale once it has waited that long without being claimed.
+        """
+        now = datetime.utcnow()
+        cutoff = now - timedelta(seconds=Config.RETRAIN_JOB_STALE_SECONDS)
+        running = RetrainJob.query.filter(RetrainJob.status == 'running', RetrainJob.heartbeat_at < cutoff).all()
+        for job in running:
+            if job.pid and _retrain_alive(job.pid):
+                logger.warning(f"Stopping retrain process {job.pid} of stale job {job.id}")
+                _stop(job.pid)
+            job.status = 'failed'
+            job.message = 'Retrain worker stopped responding'
+            job.finished_at = now
+        queued = RetrainJob.query.filter(RetrainJob.status == 'queued', RetrainJob.created_at < cutoff).all()
+        for job in queued:
+            job.status = 'failed'
+            job.message = 'Retrain worker stopped before starting the job'
+            job.finished_at = now
+        if running or queued:
+            db.session.commit()
+
+    def _ensure_worker(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='retrain-jobs', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        with self.app.app_context():
+            while True:
+                job_id = self._claim_next()
+                if job_id is None:
+                    return
+                try:
+                    self._execute(job_id)
+                except Exception as e:
+                    logger.exception(f"Retrain job {job_id} crashed: {e}")
+                    db.session.rollback()
+                    self._finish(job_id, 'failed', str(e))
+
+    def _claim_next(self):
+        """Atomically move the oldest queued job to running; None when the queue is empty"""
+        while True:
+            job = RetrainJob.query.filter_by(status='queued').order_by(RetrainJob.id).first()
+            if job is None:
+                return None
+            now = datetime.utcnow()
+            claimed = db.session.execute(
+                update(RetrainJob)
+                .where(RetrainJob.id == job.id, RetrainJob.status == 'queued')
+                .values(status='running', started_at=now, heartbeat_at=now)
+            ).rowcount
+            db.session.commit()
+            if claimed:
+                return job.id
+
+    def _execute(self, job_id):
+        job = db.session.get(RetrainJob, job_id)
+        command = [sys.executable, str(RETRAIN_SCRIPT), '--job', str(job_id)]
+        if job.full:
+            command.append('--full')
+        Config.RETRAIN_LOG_DIR.mkdir(parents=True, exist_ok=True)
+        log_path = Config.RETRAIN_LOG_DIR / f'retrain_{job_id}.log'
+        logger.info(f"Starting retrain job {job_id}, log at {log_path}")
+
+        started = time.monotonic()
+        version = current_version()
+        cancel_seen = None
+        with open(log_path, 'w') as log:
+            process = subprocess.Popen(command, stdout=log, stderr=subprocess.STDOUT, cwd=RETRAIN_SCRIPT.parent.parent)
+            job.pid = process.pid
+            db.session.commit()
+            while process.poll() is None:
+                time.sleep(_POLL_SECONDS)
+                db.session.expire_all()
+                job = db.session.get(RetrainJob, job_id)
+                job.heartbeat_at = datetime.utcnow()
+                db.session.commit()
+                if job.cancel_requested:
+                    # The child stops at its next progress report; stop it if it doesn't
+                    cancel_seen = cancel_seen or time.monotonic()
+                    if time.monotonic() - cancel_seen > Config.RETRAIN_CANCEL_GRACE_SECONDS:
+                        process.terminate()
+
+        db.session.expire_all()
+        job = db.session.get(RetrainJob, job_id)
+        elapsed = time.monotonic() - started
+        # A cancel that arrives once the new version is published only skips the steps after it
+        # (the child exits 0), or stops a child that ignored it past the grace period
+        published = process.returncode == 0 or (job.cancel_requested and current_version() != version)
+        if published:
+            message = f"Retrained in {elapsed:.0f}s"
+            if job.cancel_requested:
+                message += "; cancelled after the new version was published, later steps may have been skipped"
+            self._finish(job_id, 'succeeded', message)
+            # The retrain re-imports data/books.csv, which can change any book's text
+            response_cache.invalidate('catalog')
+            self._reload_recommender()
+        elif job.cancel_requested:
+            self._finish(job_id, 'cancelled', f"Cancelled after {elapsed:.0f}s")
+        else:
+            self._finish(job_id, 'failed', _tail(log_path))
+
+    def _finish(self, job_id, status, message):
+        job = db.session.get(RetrainJob, job_id)
+        job.status = status
+        job.message = message
+        job.finished_at = datetime.utcnow()
+        db.session.commit()
+        logger.info(f"Retrain job {job_id} {status}: {message}")
+
+    def _reload_recommender(self):
+        from recommender.service import recommender_service
+        try:
+            recommender_service.load()
+        except Exception as e:
+            logger.error(f"Reloading recommender after retrain failed: {e}")
+
+
+def _retrain_alive(pid):
+    """Whether process `pid` (of this host) is still running a retrain"""
+    if os.name == 'nt':
+        # os.kill(pid, 0) would terminate the process on Windows
+        listing = subprocess.run(['tasklist', '/FI', f'PID eq {pid}', '/NH'], capture_output=True, text=True).stdout
+        return str(pid) in listing.split()
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    cmdline = Path('/proc') / str(pid) / 'cmdline'
+    if cmdline.exists():
+        # The pid may have been reused by an unrelated process
+        try:
+            return RETRAIN_SCRIPT.name.encode() in cmdline.read_bytes()
+        except OSError:
+            return False
+    return True
+
+
+def _stop(pid):
+    try:
+        os.kill(pid, signal.SIGTERM)
+    except OSError as e:
+        logger.warning(f"Stopping retrain process {pid} failed: {e}")
+
+
+def _tail(path, lines=20):
+    """Last lines of a log file, for the job's failure message"""
+    try:
+        with open(path) as f:
+            return ''.join(f.readlines()[-lines:]).strip()
+    except OSError:
+        return 'Retrain failed'
+
+
+# One runner per process; only one job runs at a time across processes (see RetrainJob)
+job_runner = JobRunner()
@@ -0,0 +1,255 @@
+"""
+Online collaborative filtering updates between retrains
+
+rate_book, submit_feedback and the ratings import append every change to the
+rating_deltas log in the transaction that writes it. Each worker tails the log (rows
+above the last id it applied) every CF_DELTA_INTERVAL seconds and folds the users it
+names into an overlay over the memory-mapped CF artifacts:
+- the user's rating row is replaced by their current ratings
+- per-item rating sums and counts, and with them the item means, move by the difference
+- with ALS, the user's factor vector is re-solved against the fixed item factors (fold-in)
+Item-kNN scores are computed from the user's row at request time, so a user's neighbour
+scores follow their new row directly. Users the artifacts don't know yet are scored the
+same way. Books added since the retrain stay out of CF until the next one. Each row is
+also passed on to the user's cached taste vector (see recommender.taste).
+
+Polls run on a background thread, so no request waits for the log, and apply at most
+CF_DELTA_MAX_ROWS rows each; a longer backlog is worked off over the next polls. Once the
+overlay holds CF_ONLINE_MAX_USERS users the worker stops tailing until a retrain or
+compaction publishes a version that includes the log. Bulk imports don't write the log;
+they compact instead (see recommender.import_goodreads).
+
+A retrain reads the log's high-water mark before it reads ratings and records it in the
+manifest; once that version is published, rows up to the mark are compacted away.
+"""
+import logging
+import threading
+import time
+import numpy as np
+from flask import current_app
+from scipy import sparse
+from sqlalchemy import func
+from config import Config
+from extensions import db
+from models.rating_model import Feedback, Rating, RatingDelta
+from recommender.als import build_preferences, fold_in
+
+logger = logging.getLogger(__name__)
+
+# Log rows read per query, and users refreshed per IN (...) query
+_SYNC_BATCH = 5000
+_USER_CHUNK = 500
+
+_EMPTY_POSITIONS = np.empty(0, dtype=np.int32)
+_EMPTY_RATINGS = np.empty(0, dtype=np.float32)
+
+
+def delta_watermark():
+    """Highest id in the rating delta log (0 when empty); must be called inside an app context"""
+    return db.session.query(func.max(RatingDelta.id)).scalar() or 0
+
+
+def compact_deltas(watermark):
+    """Delete log rows already folded into a published CF matrix; returns the number deleted"""
+    deleted = RatingDelta.query.filter(RatingDelta.id <= watermark).delete(synchronize_session=False)
+    db.session.commit()
+    return deleted
+
+
+def _group_by_user(rows, item_ids):
+    """user_id -> (sorted CF column positions, values) for (user_id, book_id, value) rows
+
+    Books outside the CF matrix are dropped.
+    """
+    if not rows:
+        return {}
+    triples = np.array(rows, dtype=np.int64).reshape(-1, 3)
+    positions = np.searchsorted(item_ids, triples[:, 1])
+    positions[positions >= len(item_ids)] = 0
+    known = item_ids[positions] == triples[:, 1]
+    triples, positions = triples[known], positions[known]
+    order = np.lexsort((positions, triples[:, 0]))
+    users, positions, values = triples[order, 0], positions[order].astype(np.int32), triples[order, 2]
+    starts = np.flatnonzero(np.r_[True, users[1:] != users[:-1]])
+    ends = np.r_[starts[1:], len(users)]
+    return {int(users[s]): (positions[s:e], values[s:e].astype(np.float32)) for s, e in zip(starts, ends)}
+
+
+class OnlineCF:
+    """Overlay of rating changes made since the loaded CF artifacts were built"""
+
+    def __init__(self, recommender, watermark=0):
+        self.recommender = recommender
+        self.last_id = int(watermark)  # last delta applied
+        self.rows = {}  # user_id -> (positions, ratings) replacing the artifact row
+        self.user_factors = {}  # user_id -> folded-in ALS vector
+        self.applied = 0
+        self._item_sum_delta = None
+        self._item_count_delta = None
+        self._gram = None
+        self._last_poll = 0.0
+        self._lock = threading.Lock()
+        self.paused = False  # set once the overlay is full
+
+    def row(self, user_id):
+        """The user's current (positions, ratings), or None when neither the overlay nor the artifacts know them"""
+        row = self.rows.get(user_id)
+        if row is not None:
+            return row
+        rec = self.recommender
+        if rec.user_index is None:
+            return None
+        user_idx = rec.user_index.get(user_id)
+        if user_idx is None:
+            return None
+        indptr = rec.cf_matrix.indptr
+        lo, hi = indptr[user_idx], indptr[user_idx + 1]
+        return rec.cf_matrix.indices[lo:hi], rec.cf_matrix.data[lo:hi]
+
+    def poll(self):
+        """Start a background sync at most every CF_DELTA_INTERVAL seconds; must be called inside an app context"""
+        interval = Config.CF_DELTA_INTERVAL
+        now = time.monotonic()
+        if interval <= 0 or self.paused or now - self._last_poll < interval:
+            return
+        self._last_poll = now
+        if self._lock.locked():
+            # The previous sync is still working off a backlog
+            return
+        threading.Thread(target=self._background_sync, args=(current_app._get_current_object(),),
+                         name='cf-deltas', daemon=True).start()
+
+    def _background_sync(self, app):
+        with app.app_context():
+            try:
+                self.sync(wait=False, limit=Config.CF_DELTA_MAX_ROWS)
+            except Exception as e:
+                db.session.rollback()
+                logger.warning(f"Applying rating deltas failed: {e}")
+
+    def sync(self, wait=True, limit=None):
+        """Apply log rows above last_id (at most `limit` of them); returns the number of rows read
+
+        Must be called inside an app context. With wait=False a sync already running in
+        another thread is left to finish instead. SQLite commits log ids in order, so
+        tailing by id never skips a row.
+        """
+        if not self._lock.acquire(blocking=wait):
+            return 0
+        try:
+            read = 0
+            while limit is None or read < limit:
+                if self.recommender.cf_matrix is not None and len(self.rows) >= Config.CF_ONLINE_MAX_USERS:
+                    if not self.paused:
+                        self.paused = True
+                        logger.warning(f"Online CF overlay holds {len(self.rows)} users; new ratings wait for the "
+                                       f"next retrain or compaction (python recommender/retrain_model.py --compact)")
+                    break
+                batch = _SYNC_BATCH if limit is None else min(_SYNC_BATCH, limit - read)
+                rows = db.session.query(
+                    RatingDelta.id, RatingDelta.user_id, RatingDelta.book_id, RatingDelta.kind, RatingDelta.value
+                ).filter(RatingDelta.id > self.last_id).order_by(RatingDelta.id).limit(batch).all()
+                if not rows:
+                    break
+                if self.recommender.cf_matrix is not None:
+                    # The users' rows are re-read rather than patched, so replays are harmless
+                    user_ids = sorted({row.user_id for row in rows})
+                    for start in range(0, len(user_ids), _USER_CHUNK):
+                        self._refresh(user_ids[start:start + _USER_CHUNK])
+                taste = self.recommender.taste
+                if taste is not None:
+                    # In log order; each row sets an absolute value, so replays are harmless too
+                    for row in rows:
+                        taste.apply(row.user_id, row.book_id, row.kind, row.value)
+                self.last_id = rows[-1].id
+                read += len(rows)
+                if len(rows) < batch:
+                    break
+            self.applied += read
+            return read
+        finally:
+            self._lock.release()
+
+    def _refresh(self, user_ids):
+        """Replace the rows (and ALS vectors) of user_ids with their current ratings and feedback"""
+        rec = self.recommender
+        ratings = _group_by_user(db.session.query(Rating.user_id, Rating.book_id, Rating.rating).filter(
+            Rating.user_id.in_(user_ids)
+        ).all(), rec.item_ids)
+
+        for user_id in user_ids:
+            positions, values = ratings.get(user_id, (_EMPTY_POSITIONS, _EMPTY_RATINGS))
+            old = self.row(user_id)
+            self._update_item_stats(old, positions, values)
+            self.rows[user_id] = (positions, values)
+
+        if rec.item_factors is not None:
+            feedback = _group_by_user(db.session.query(Feedback.user_id, Feedback.book_id, Feedback.is_like).filter(
+                Feedback.user_id.in_(user_ids)
+            ).all(), rec.item_ids)
+            self._fold_in(user_ids, ratings, feedback)
+
+    def _update_item_stats(self, old, positions, values):
+        """Move per-item rating sums and counts from the user's old row to the new one"""
+        rec = self.recommender
+        if self._item_sum_delta is None:
+            n_items = len(rec.item_ids)
+            self._item_sum_delta = np.zeros(n_items, dtype=np.float64)
+            self._item_count_delta = np.zeros(n_items, dtype=np.int64)
+            # Private copy of the memory-mapped means, written in place from now on
+            rec.item_means = np.array(rec.item_means, dtype=np.float32)
+
+        touched = positions
+        if old is not None:
+            old_positions, old_values = old
+            np.subtract.at(self._item_sum_delta, old_positions, old_values)
+            np.subtract.at(self._item_count_delta, old_positions, 1)
+            touched = np.union1d(old_positions, positions)
+        np.add.at(self._item_sum_delta, positions, values)
+        np.add.at(self._item_count_delta, positions, 1)
+
+        # Only the touched columns of the artifact matrix are read
+        indptr = rec.cf_matrix_csc.indptr
+        for item in np.asarray(touched, dtype=np.int64):
+            lo, hi = indptr[item], indptr[item + 1]
+            count = (hi - lo) + self._item_count_delta[item]
+            total = float(rec.cf_matrix_csc.data[lo:hi].sum(dtype=np.int64)) + self._item_sum_delta[item]
+            rec.item_means[item] = total / count if count > 0 else 0.0
+
+    def _fold_in(self, user_ids, ratings, feedback):
+        """Re-solve the ALS vectors of user_ids from their ratings and feedback"""
+        rec = self.recommender
+        n_items = len(rec.item_ids)
+
+        def matrix(rows, transform=None):
+            indptr, indices, data = [0], [], []
+            for user_id in user_ids:
+                positions, values = rows.get(user_id, (_EMPTY_POSITIONS, _EMPTY_RATINGS))
+                indices.append(positions)
+                data.append(transform(values) if transform is not None else values)
+                indptr.append(indptr[-1] + len(positions))
+            return sparse.csr_matrix((np.concatenate(data), np.concatenate(indices), indptr),
+                                     shape=(len(user_ids), n_items), dtype=np.float32)
+
+        params = rec.als_params or {}
+        implicit = params.get('implicit', Config.ALS_IMPLICIT)
+        preference, confidence = build_preferences(
+            matrix(ratings), matrix(feedback, lambda is_like: np.where(is_like > 0, 1.0, -1.0)),
+            implicit=implicit, alpha=params.get('alpha', Config.ALS_ALPHA)
+        )
+        if implicit and self._gram is None:
+            item_factors = np.asarray(rec.item_factors, dtype=np.float32)
+            self._gram = item_factors.T @ item_factors
+        vectors = fold_in(rec.item_factors, preference, confidence,
+                          regularization=params.get('regularization', Config.ALS_REGULARIZATION),
+                          implicit=implicit, gram=self._gram)
+        for user_id, vector in zip(user_ids, vectors):
+            self.user_factors[user_id] = vector
+
+    def stats(self):
+        return {
+            'last_delta_id': self.last_id,
+            'deltas_applied': self.applied,
+            'users': len(self.rows),
+            'paused': self.paused,
+        }
@@ -0,0 +1,114 @@
+"""
+Bounded-queue stages for the retrain pipeline
+
+A stage runs in a background thread and talks to the next one through a queue of at
+most `maxsize` items, so a fast producer blocks instead of buffering the whole catalog.
+Exceptions raised in a stage are re-raised in the consuming thread.
+"""
+import queue
+import threading
+from config import Config
+from extensions import db
+
+_DONE = object()
+
+
+class _Failure:
+    def __init__(self, error):
+        self.error = error
+
+
+def prefetch(iterable, maxsize=2):
+    """Iterate `iterable` in a background thread, keeping up to maxsize items ready"""
+    items = queue.Queue(maxsize=maxsize)
+    stop = threading.Event()
+
+    def produce():
+        iterator = iter(iterable)
+        try:
+            for item in iterator:
+                if stop.is_set():
+                    return
+                items.put(item)
+            items.put(_DONE)
+        except BaseException as e:
+            items.put(_Failure(e))
+        finally:
+            # Generators are finalized in the thread that ran them (app contexts are per thread)
+            close = getattr(iterator, 'close', None)
+            if close is not None:
+                close()
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = items.get()
+            if item is _DONE:
+                break
+            if isinstance(item, _Failure):
+                raise item.error
+            yield item
+    finally:
+        # Unblock the producer if the consumer stopped early
+        stop.set()
+        while thread.is_alive():
+            try:
+                items.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        thread.join()
+
+
+def stream_rows(app, statement, chunk_size=None):
+    """Yield the rows of a SELECT in lists of chunk_size without materializing the whole result
+
+    Opens its own app context (and so its own session), so it can run as a prefetch() producer.
+    """
+    chunk_size = chunk_size or Config.RETRAIN_CHUNK_SIZE
+    with app.app_context():
+        result = db.session.execute(statement.execution_options(yield_per=chunk_size))
+        for chunk in result.partitions(chunk_size):
+            yield chunk
+
+
+class BackgroundWriter:
+    """Apply fn(item) to submitted items in a background thread, in submission order"""
+
+    def __init__(self, fn, maxsize=2):
+        self.fn = fn
+        self._items = queue.Queue(maxsize=maxsize)
+        self._error = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            item = self._items.get()
+            if item is _DONE:
+                return
+            if self._error is None:
+                try:
+                    self.fn(item)
+                except BaseException as e:
+                    # Keep draining so submit() never blocks on a dead writer
+                    self._error = e
+
+    def submit(self, item):
+        if self._error is not None:
+            raise self._error
+        self._items.put(item)
+
+    def close(self):
+        """Wait for every submitted item to be written; re-raise the first write error"""
+        if self._thread.is_alive():
+            self._items.put(_DONE)
+            self._thread.join()
+        if self._error is not None:
+            raise self._error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
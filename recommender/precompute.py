@@ -0,0 +1,120 @@
+"""
+Precomputed per-user recommendations
+
+After a retrain, the top PRECOMPUTE_TOP_N hybrid recommendations of every active user are
+scored in batches and written to the user_recommendations table. /recommendations then
+serves a user's list with one primary-key range read. Lists are tagged with the artifact
+version they were scored with; a user's list is dropped when they rate, favorite or give
+feedback, and recomputed (and stored again) on their next visit, once the worker's online
+CF model has applied the change.
+"""
+import sys
+from pathlib import Path
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from sqlalchemy import delete, func, insert, union
+from sqlalchemy.exc import IntegrityError
+from config import Config
+from extensions import db
+from models.book_model import Book
+from models.rating_model import Favorite, Feedback, Rating, RatingDelta
+from models.recommendation_model import UserRecommendation
+
+
+def active_user_ids():
+    """Users with at least one rating, favorite or like/dislike, in id order"""
+    statement = union(
+        db.select(Rating.user_id), db.select(Favorite.user_id), db.select(Feedback.user_id)
+    ).subquery()
+    return sorted(db.session.execute(db.select(statement.c.user_id)).scalars())
+
+
+def store_user_recommendations(user_ids, ranked, version):
+    """Replace the lists of user_ids with ranked (book_ids, scores) pairs; the caller commits"""
+    db.session.execute(delete(UserRecommendation).where(UserRecommendation.user_id.in_(user_ids)))
+    rows = [
+        {'user_id': int(user_id), 'rank': rank, 'book_id': int(book_id), 'score': float(score),
+         'model_version': version}
+        for user_id, (book_ids, scores) in zip(user_ids, ranked)
+        for rank, (book_id, score) in enumerate(zip(book_ids, scores))
+    ]
+    if rows:
+        db.session.execute(insert(UserRecommendation), rows)
+
+
+def precompute_recommendations(recommender, top_n=None, progress=None):
+    """Score and store the lists of all active users; returns the number of users
+
+    `progress('precompute', done, total)` is called after each batch. Must be called inside
+    an app context.
+    """
+    top_n = top_n or Config.PRECOMPUTE_TOP_N
+    version = recommender.version or ''
+    if recommender.online is not None:
+        # Ratings changed while the artifacts were being built
+        recommender.online.sync()
+    user_ids = active_user_ids()
+    chunk = Config.RECOMMEND_BATCH_CHUNK
+    for start in range(0, len(user_ids), chunk):
+        batch = user_ids[start:start + chunk]
+        store_user_recommendations(batch, recommender.score_hybrid_batch(batch, top_n), version)
+        # One transaction per batch keeps the write lock short for concurrent requests
+        db.session.commit()
+        if progress is not None:
+            progress('precompute', start + len(batch), len(user_ids))
+
+    # Lists scored with older versions are recomputed on demand anyway
+    db.session.execute(delete(UserRecommendation).where(UserRecommendation.model_version != version))
+    db.session.commit()
+    return len(user_ids)
+
+
+def cached_recommendations(recommender, user_id, top_k=12):
+    """A user's hybrid recommendations from the precomputed table, computed and stored on a miss"""
+    version = recommender.version or ''
+    rows = db.session.query(
+        UserRecommendation.score, Book.id, Book.title, Book.author, Book.genres
+    ).join(Book, Book.id == UserRecommendation.book_id).filter(
+        UserRecommendation.user_id == user_id,
+        UserRecommendation.model_version == version
+    ).order_by(UserRecommendation.rank).limit(top_k).all()
+    if rows:
+        return [
+            {'id': row.id, 'title': row.title, 'author': row.author, 'genres': row.genres or '',
+             'score': row.score}
+            for row in rows
+        ]
+
+    caught_up = True
+    if recommender.online is not None:
+        # The miss is usually caused by a rating this worker hasn't applied yet. A bounded,
+        # non-blocking sync: a long backlog is left to the background poll.
+        online = recommender.online
+        online.sync(wait=False, limit=Config.CF_DELTA_MAX_ROWS)
+        caught_up = online.last_id >= (db.session.query(func.max(RatingDelta.id)).scalar() or 0)
+    book_ids, scores = recommender.score_hybrid(user_id=user_id, top_k=max(top_k, Config.PRECOMPUTE_TOP_N))
+    if not caught_up:
+        # Possibly missing the user's latest rating; the next visit scores again
+        return recommender.hydrate(book_ids[:top_k], scores[:top_k])
+    try:
+        store_user_recommendations([user_id], [(book_ids, scores)], version)
+        db.session.commit()
+    except IntegrityError:
+        # A concurrent request stored the same list first
+        db.session.rollback()
+    return recommender.hydrate(book_ids[:top_k], scores[:top_k])
+
+
+if __name__ == '__main__':
+    import os
+    os.chdir(Path(__file__).parent.parent)
+    from app import create_app
+    from recommender.service import recommender_service
+
+    app = create_app(preload_recommender=False)
+    with app.app_context():
+        recommender = recommender_service.get()
+        count = precompute_recommendations(recommender)
+        print(f"Precomputed recommendations for {count} users (version {recommender.version})")
@@ -15,79 +15,390 @@ sys.path.insert(0, str(project_dir))
 from app import create_app
 from extensions import db
 from models.book_model import Book
-from models.rating_model import Rating
+from models.rating_model import Rating, Feedback
 from models.user_model import User
 from config import Config
-import pickle
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
+from scipy import sparse
+from sqlalchemy import func, select
+from recommender import vector_index
+from recommender.als import build_preferences, train_als
+from recommender.artifacts import ALS_INDEX_FILE, ArtifactStore, staged_version
+from recommender.item_knn import build_item_similarity
+from recommender.jobs import JobCancelled, JobProgress, job_runner
+from recommender.online import compact_deltas, delta_watermark
+from recommender.pipeline import prefetch, stream_rows
 
 
-def build_cf_matrix():
-    """Build collaborative filtering matrix"""
-    app = create_app()
+def _read_ids(model):
+    """Sorted primary keys of a table, streamed into an int64 array"""
+    statement = select(model.id).order_by(model.id).execution_options(yield_per=Config.RETRAIN_CHUNK_SIZE)
+    return np.fromiter(db.session.execute(statement).scalars(), dtype=np.int64)
+
+
+def _stream_sparse(app, columns, user_ids, item_ids, dtype, transform=None, progress=None):
+    """CSR users x items matrix from streamed (user_id, book_id, value) rows; unknown ids are dropped
+
+    `columns` are the three columns to select from one table. Rows are read in chunks on a
+    background thread and mapped into preallocated COO arrays, so no ORM objects or Python
+    tuples for the whole table are held at once. `transform` maps each chunk's values;
+    `progress(done, total)` is called with the number of rows read after each chunk.
+    """
+    model = columns[0].class_
+    total, max_id = db.session.query(func.count(model.id), func.max(model.id)).one()
+    db.session.rollback()
+    rows = np.empty(total, dtype=np.int32)
+    cols = np.empty(total, dtype=np.int32)
+    values = np.empty(total, dtype=dtype)
+    
+    n = read = 0
+    statement = select(*columns).where(model.id <= (max_id or 0)).order_by(model.id)
+    for chunk in prefetch(stream_rows(app, statement), maxsize=Config.RETRAIN_QUEUE_SIZE):
+        triples = np.array(chunk, dtype=np.int64).reshape(-1, 3)
+        # Map ids to row/column positions (both id arrays are sorted)
+        r = np.searchsorted(user_ids, triples[:, 0])
+        c = np.searchsorted(item_ids, triples[:, 1])
+        valid = (r < len(user_ids)) & (c < len(item_ids))
+        valid[valid] &= (user_ids[r[valid]] == triples[valid, 0]) & (item_ids[c[valid]] == triples[valid, 1])
+        k = int(valid.sum())
+        # Rows deleted during the read only ever shrink the count
+        k = min(k, total - n)
+        v = triples[valid, 2][:k]
+        values[n:n + k] = transform(v) if transform is not None else v
+        rows[n:n + k] = r[valid][:k]
+        cols[n:n + k] = c[valid][:k]
+        n += k
+        read += len(chunk)
+        if progress is not None:
+            progress(read, total)
+    
+    matrix = sparse.csr_matrix(
+        (values[:n], (rows[:n], cols[:n])),
+        shape=(len(user_ids), len(item_ids))
+    )
+    matrix.sum_duplicates()
+    return matrix
+
+
+def _column_means(matrix_csc):
+    """Mean of the stored (non-zero) entries of each column, 0 for empty columns"""
+    counts = np.diff(matrix_csc.indptr)
+    sums = np.asarray(matrix_csc.sum(axis=0, dtype=np.int64)).ravel()
+    means = np.zeros(matrix_csc.shape[1], dtype=np.float32)
+    np.divide(sums, counts, out=means, where=counts > 0, casting='unsafe')
+    return means
+
+
+def build_cf_matrix(progress=None, store=None):
+    """Build collaborative filtering matrix; progress('cf', done, total) counts ratings read
+
+    Writes into `store` (a staged version) when given, otherwise publishes a new artifact version.
+    """
+    app = create_app(preload_recommender=False)
     
     with app.app_context():
-        # Get all users and books
-        users = User.query.all()
-        books = Book.query.all()
+        # Ids only - no ORM objects are materialized
+        user_ids = _read_ids(User)
+        item_ids = _read_ids(Book)
         
-        if not users or not books:
+        if len(user_ids) == 0 or len(item_ids) == 0:
             print("Not enough data for CF matrix. Need users and books.")
             return
         
-        # Create mappings
-        user_index = {user.id: idx for idx, user in enumerate(users)}
-        item_index = {book.id: idx for idx, book in enumerate(books)}
+        # Every logged change up to here is in the ratings read below; later ones are replayed on top
+        watermark = delta_watermark()
+        
+        # Sparse user-item matrix streamed from the ratings table; ratings are 1-5 so int8 is enough
+        matrix = _stream_sparse(
+            app, (Rating.user_id, Rating.book_id, Rating.rating), user_ids, item_ids, np.int8,
+            progress=(lambda done, total: progress('cf', done, total)) if progress else None
+        )
+        
+        with staged_version(store) as store:
+            shape = store.write_csr('cf_csr', matrix)
+            # Column-major copy for per-item access, plus per-item mean ratings
+            matrix_csc = matrix.tocsc()
+            store.write_csc('cf_csc', matrix_csc)
+            store.write_array('cf_item_means', _column_means(matrix_csc))
+            store.write_array('cf_user_ids', user_ids)
+            store.write_array('cf_item_ids', item_ids)
+        
+            print(f"Built CF matrix: {matrix.shape}, {matrix.nnz} ratings")
+            print(f"Users: {len(user_ids)}, Books: {len(item_ids)}")
+        
+            # Item-item neighbourhoods for item-based CF
+            similarity = build_item_similarity(matrix, neighbors=Config.CF_NEIGHBORS, method=Config.CF_SIMILARITY)
+            sim_shape = store.write_csr('item_sim', similarity)
+            print(f"Built item similarity: {similarity.nnz} pairs ({Config.CF_SIMILARITY}, top {Config.CF_NEIGHBORS})")
         
-        # Build user-item matrix
-        matrix = np.zeros((len(users), len(books)))
+            store.update_manifest('cf', {
+                'shape': shape,
+                'nnz': int(matrix.nnz),
+                'delta_watermark': watermark,
+                # ALS factors record this, so factors of another build are never paired with it
+                'version': store.version,
+                'similarity': {
+                    'shape': sim_shape,
+                    'method': Config.CF_SIMILARITY,
+                    'neighbors': Config.CF_NEIGHBORS,
+                },
+            })
+
+
+def train_als_model(progress=None, store=None):
+    """Factorize ratings and like/dislike feedback with ALS; progress('als', done, total) counts iterations
+
+    Reads the CF matrix from and writes into `store` (a staged version) when given, otherwise
+    trains on the current version and publishes a new one.
+    """
+    if store is None:
+        with staged_version() as store:
+            return train_als_model(progress, store)
+    cf_meta = store.read_manifest().get('cf')
+    if not cf_meta:
+        print("CF matrix not found, skipping ALS.")
+        remove_als(store)
+        return
+    
+    app = create_app(preload_recommender=False)
+    
+    with app.app_context():
+        ratings = store.read_csr('cf_csr', cf_meta['shape'])
+        user_ids = store.read_array('cf_user_ids')
+        item_ids = store.read_array('cf_item_ids')
         
-        ratings = Rating.query.all()
-        for rating in ratings:
-            if rating.user_id in user_index and rating.book_id in item_index:
-                user_idx = user_index[rating.user_id]
-                item_idx = item_index[rating.book_id]
-                matrix[user_idx, item_idx] = rating.rating
+        # Likes count as +1, dislikes as -1
+        feedback = _stream_sparse(
+            app, (Feedback.user_id, Feedback.book_id, Feedback.is_like), user_ids, item_ids, np.int8,
+            transform=lambda is_like: np.where(is_like > 0, 1, -1)
+        )
         
-        # Save CF matrix
-        cf_data = {
-            'matrix': matrix,
-            'user_index': user_index,
-            'item_index': item_index
-        }
+        preference, confidence = build_preferences(
+            ratings, feedback, implicit=Config.ALS_IMPLICIT, alpha=Config.ALS_ALPHA
+        )
+        if preference.nnz == 0:
+            print("No ratings or feedback, skipping ALS.")
+            remove_als(store)
+            return
+        
+        mode = 'implicit' if Config.ALS_IMPLICIT else 'explicit'
+        print(f"Training {mode} ALS: {Config.ALS_FACTORS} factors, {Config.ALS_ITERATIONS} iterations, "
+              f"{preference.nnz} interactions...")
+        user_factors, item_factors = train_als(
+            preference, confidence,
+            factors=Config.ALS_FACTORS,
+            iterations=Config.ALS_ITERATIONS,
+            regularization=Config.ALS_REGULARIZATION,
+            implicit=Config.ALS_IMPLICIT,
+            threads=Config.ALS_THREADS or None,
+            callback=lambda i, n: _report_iteration(i, n, progress)
+        )
+        # Rows line up with cf_user_ids / cf_item_ids
+        store.write_array('als_user_factors', user_factors)
+        store.write_array('als_item_factors', item_factors)
+        print(f"Saved ALS factors: users {user_factors.shape}, items {item_factors.shape}")
         
-        with open(Config.CF_MATRIX_PATH, 'wb') as f:
-            pickle.dump(cf_data, f)
+        # Large catalogs score the CF component through an ANN index over item factors
+        index_path = store.path(ALS_INDEX_FILE)
+        index_path.unlink(missing_ok=True)
+        index_kind = None
+        if len(item_ids) >= Config.ALS_ANN_MIN_ITEMS and vector_index.faiss_available():
+            index = vector_index.build_index(item_factors, Config.ALS_INDEX_TYPE, normalize=False)
+            index.save(index_path)
+            index_kind = index.kind
+            print(f"Saved {index.kind} index over item factors")
         
-        print(f"Built CF matrix: {matrix.shape}")
-        print(f"Users: {len(users)}, Books: {len(books)}")
+        store.update_manifest('als', {
+            'factors': Config.ALS_FACTORS,
+            'iterations': Config.ALS_ITERATIONS,
+            'implicit': Config.ALS_IMPLICIT,
+            'regularization': Config.ALS_REGULARIZATION,
+            'alpha': Config.ALS_ALPHA,
+            'item_index': index_kind,
+            'cf_version': cf_meta.get('version'),
+        })
+
+
+def remove_als(store):
+    """Drop ALS factors carried over from the previous version; they don't match a rebuilt CF matrix"""
+    if 'als' not in store.read_manifest() and not store.has('als_item_factors'):
+        return
+    store.remove('als_user_factors', 'als_item_factors')
+    store.path(ALS_INDEX_FILE).unlink(missing_ok=True)
+    store.update_manifest('als', None)
+    print("Removed ALS factors of the previous version")
+
+
+def _report_iteration(iteration, iterations, progress):
+    print(f"ALS iteration {iteration}/{iterations}")
+    if progress is not None:
+        progress('als', iteration, iterations)
 
 
-def retrain():
-    """Main retrain function"""
+def retrain(full=False, progress=None):
+    """Main retrain function; returns True on success
+
+    full=True re-encodes every book instead of only changed ones. `progress(stage, done, total)`
+    receives stage counters (see recommender.jobs.JobProgress); JobCancelled raised from it
+    stops the retrain, or once the new version is published skips the steps left. Every step
+    writes into one staged artifact version that is published only when all of them succeed,
+    so serving workers never mix artifacts of two retrains.
+    """
     print("Starting model retraining...")
+    # Book writes keep mood tags current; a full pass picks up lexicon changes
+    published_steps = [('Precomputing user recommendations', precompute_user_recommendations),
+                       ('Tagging book moods', lambda store, progress: tag_book_moods(progress=progress))]
+    if not _stage_and_publish(full, progress, embeddings=True, published_steps=published_steps):
+        return False
+    print("Model retraining completed successfully!")
+    return True
+
+
+def compact(progress=None):
+    """Fold the rating delta log into a new CF matrix (and ALS factors); returns True on success
+
+    Cheaper than retrain(): book embeddings are carried over from the current version
+    unchanged. Meant to run periodically (e.g. from cron) so the overlay each worker keeps
+    over the artifacts stays small.
+    """
+    app = create_app(preload_recommender=False)
+    with app.app_context():
+        if job_runner.active_job() is not None:
+            # Its retrain rebuilds the CF matrix anyway, and two publishers would race
+            print("A retrain job is active, skipping compaction.")
+            return True
     
-    # Step 1: Rebuild embeddings
-    print("\nStep 1: Building embeddings...")
+    print("Compacting rating deltas...")
+    published_steps = [('Precomputing user recommendations', precompute_user_recommendations)]
+    if not _stage_and_publish(False, progress, embeddings=False, published_steps=published_steps):
+        return False
+    print("Compaction completed successfully!")
+    return True
+
+
+def _stage_and_publish(full, progress, embeddings, published_steps=()):
+    """Run the build steps into a staged version, publish it and compact the delta log it includes
+
+    `published_steps` are (title, step(store, progress)) pairs run once the version is live.
+    Their errors are printed, and a cancel only skips the ones left: the retrain still
+    succeeds, since its version is already being served.
+    """
+    store = ArtifactStore.stage()
+    print(f"Staging artifact version {store.version}")
+    steps = []
     try:
-        from recommender.build_embeddings import build_embeddings
-        build_embeddings()
-    except Exception as e:
-        print(f"Error building embeddings: {e}")
+        ok = _run_steps(full, progress, store, steps, embeddings=embeddings)
+    except BaseException:
+        store.discard()
+        raise
+    if not ok:
+        store.discard()
+        return False
+    
+    store.publish()
+    print(f"\nPublished artifact version {store.version}")
+    compact_delta_log(store)
+    
+    for title, step in published_steps:
+        _print_step(steps, title)
+        try:
+            step(store, progress=progress)
+        except JobCancelled:
+            print(f"Cancelled after publishing version {store.version}, skipping the remaining steps")
+            break
+        except Exception as e:
+            print(f"Error {title[0].lower() + title[1:]}: {e}")
+    return True
+
+
+def _print_step(steps, title):
+    steps.append(title)
+    print(f"\nStep {len(steps)}: {title}...")
+
+
+def compact_delta_log(store):
+    """Delete the rating deltas the published version's CF matrix was built with"""
+    cf_meta = store.read_manifest().get('cf')
+    if not cf_meta or 'delta_watermark' not in cf_meta:
         return
+    app = create_app(preload_recommender=False)
+    with app.app_context():
+        deleted = compact_deltas(cf_meta['delta_watermark'])
+    print(f"Compacted {deleted} rating deltas into version {store.version}")
+
+
+def precompute_user_recommendations(store, progress=None):
+    """Write the precomputed recommendation lists of all active users for a published version"""
+    from recommender.hybrid_recommender import HybridRecommender
+    from recommender.precompute import precompute_recommendations
+    
+    app = create_app(preload_recommender=False)
+    with app.app_context():
+        recommender = HybridRecommender()
+        recommender.load_artifacts(ArtifactStore.current(version=store.version))
+        count = precompute_recommendations(recommender, progress=progress)
+    print(f"Precomputed recommendations for {count} users")
+
+
+def tag_book_moods(progress=None):
+    """Re-tag every book with the moods of the search lexicon"""
+    from search.moods import tag_all_books
     
-    # Step 2: Build CF matrix
-    print("\nStep 2: Building collaborative filtering matrix...")
+    app = create_app(preload_recommender=False)
+    with app.app_context():
+        count = tag_all_books(progress=progress)
+    print(f"Tagged moods of {count} books")
+
+
+def _run_steps(full, progress, store, steps, embeddings=True):
+    """Build every artifact into `store`; returns False when a step failed"""
+    # Rebuild embeddings (compaction keeps the current ones)
+    if embeddings:
+        _print_step(steps, 'Building embeddings')
+        try:
+            from recommender.build_embeddings import build_embeddings
+            build_embeddings(full=full, progress=progress, store=store)
+        except JobCancelled:
+            raise
+        except Exception as e:
+            print(f"Error building embeddings: {e}")
+            return False
+    
+    _print_step(steps, 'Building collaborative filtering matrix')
     try:
-        build_cf_matrix()
+        build_cf_matrix(progress=progress, store=store)
+    except JobCancelled:
+        raise
     except Exception as e:
         print(f"Error building CF matrix: {e}")
-        return
+        return False
     
-    print("\nModel retraining completed successfully!")
+    # Matrix factorization
+    if Config.CF_MODEL == 'als':
+        _print_step(steps, 'Training ALS model')
+        try:
+            train_als_model(progress=progress, store=store)
+        except JobCancelled:
+            raise
+        except Exception as e:
+            print(f"Error training ALS model: {e}")
+            return False
+    else:
+        remove_als(store)
+    return True
 
 
 if __name__ == '__main__':
-    retrain()
+    full = '--full' in sys.argv
+    progress = None
+    if '--job' in sys.argv:
+        # Launched by the admin job runner: report progress to the job row
+        job_id = int(sys.argv[sys.argv.index('--job') + 1])
+        progress = JobProgress(create_app(preload_recommender=False), job_id)
+    try:
+        ok = compact(progress) if '--compact' in sys.argv else retrain(full=full, progress=progress)
+    except JobCancelled as e:
+        print(e)
+        sys.exit(2)
+    sys.exit(0 if ok else 1)
 
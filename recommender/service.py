@@ -0,0 +1,131 @@
+"""
+Resident recommender service - loads artifacts once per worker process and shares them across requests
+
+Every RECOMMENDER_RELOAD_INTERVAL seconds a request checks the published artifact
+version. When a retrain has published a new one, it is loaded on a background thread
+and swapped in once ready; requests keep using the previous version until then.
+Between retrains, requests also start a background sync of new rows of the rating delta
+log into the loaded CF model every CF_DELTA_INTERVAL seconds (see recommender.online).
+"""
+import logging
+import threading
+import time
+from flask import current_app, has_app_context
+from config import Config
+from recommender.artifacts import ArtifactStore, current_version
+from response_cache import response_cache
+
+logger = logging.getLogger(__name__)
+
+
+class RecommenderService:
+    """Owns the long-lived HybridRecommender for this process"""
+
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        self._recommender = None
+        self.load_seconds = None
+        self.resident_bytes = 0
+        self.mapped_bytes = 0
+        self.version = None
+        self._last_check = time.monotonic()
+        self._reloading = False
+        self._failed_version = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app, preload=True):
+        """Register the service on the app and optionally load artifacts eagerly"""
+        app.extensions['recommender'] = self
+        if preload and app.config.get('RECOMMENDER_PRELOAD', True):
+            try:
+                self.get()
+            except Exception as e:
+                # Routes fall back to top-rated books until artifacts load
+                logger.error(f"Recommender preload failed: {e}")
+
+    def load(self, version=None):
+        """Load a fresh recommender (the published version unless given) and swap it in"""
+        from recommender.hybrid_recommender import HybridRecommender
+
+        start = time.perf_counter()
+        recommender = HybridRecommender()
+        recommender.load_artifacts(ArtifactStore.current(version=version))
+        self.load_seconds = time.perf_counter() - start
+        self.resident_bytes = recommender.memory_usage()
+        self.mapped_bytes = recommender.mapped_usage()
+
+        # Single reference assignment - readers see either the old or the new instance
+        self._recommender = recommender
+        previous, self.version = self.version, recommender.version
+        if previous is not None and previous != self.version:
+            # Results scored by the previous model are keyed on its version and can go
+            response_cache.invalidate('model')
+        logger.info(
+            f"Recommender version {self.version} loaded in {self.load_seconds:.2f}s, "
+            f"resident size {self.resident_bytes / (1024 * 1024):.1f} MiB, "
+            f"memory-mapped {self.mapped_bytes / (1024 * 1024):.1f} MiB"
+        )
+        return recommender
+
+    def get(self):
+        """Return the resident recommender, loading it on first use"""
+        recommender = self._recommender
+        if recommender is None:
+            with self._lock:
+                if self._recommender is None:
+                    self.load()
+                recommender = self._recommender
+        else:
+            self._check_for_update()
+        if recommender.online is not None and has_app_context():
+            recommender.online.poll()
+        return recommender
+
+    def _check_for_update(self):
+        """Start a background reload when a newer artifact version has been published"""
+        interval = Config.RECOMMENDER_RELOAD_INTERVAL
+        now = time.monotonic()
+        if interval <= 0 or now - self._last_check < interval:
+            return
+        self._last_check = now
+        version = current_version()
+        if version is None or version in (self.version, self._failed_version):
+            return
+        with self._lock:
+            if self._reloading:
+                return
+            self._reloading = True
+        threading.Thread(target=self._reload, args=(version,), name='recommender-reload', daemon=True).start()
+
+    def _reload(self, version):
+        try:
+            self.load(version)
+        except Exception as e:
+            # Keep serving the loaded version; don't retry this one on every check
+            self._failed_version = version
+            logger.error(f"Loading artifact version {version} failed: {e}")
+        finally:
+            self._reloading = False
+
+    def stats(self):
+        """Load time and resident size of the current recommender"""
+        return {
+            'loaded': self._recommender is not None,
+            'version': self.version,
+            'load_seconds': self.load_seconds,
+            'resident_bytes': self.resident_bytes,
+            'mapped_bytes': self.mapped_bytes,
+            'online': self._recommender.online.stats() if self._recommender and self._recommender.online else None,
+            'taste_profiles': self._recommender.taste.stats() if self._recommender and self._recommender.taste else None,
+        }
+
+
+# One service per process; every app created in this process shares it
+recommender_service = RecommenderService()
+
+
+def get_recommender():
+    """Return the resident recommender for the current app"""
+    service = current_app.extensions.get('recommender', recommender_service)
+    return service.get()
@@ -0,0 +1,152 @@
+"""
+Per-user taste vectors for personalized content-based recommendations
+
+A user's taste vector is the weighted mean of the embeddings of the books they rated,
+liked or disliked. A rating weighs (stars - 2.5), so 4-5 stars pull towards a book and
+1-2 stars push away from it. A like counts as 5 stars and a dislike as 1 star where the
+user hasn't rated the book, as in ALS. The vector is the CBF query when recommendations
+are asked for a user alone.
+
+Vectors are built from the database on first use and kept in a per-worker LRU of
+TASTE_CACHE_SIZE users. Rows of the rating delta log (see recommender.online) update
+cached vectors in O(d) each: the book's old weight is swapped for its new one in the
+running sum.
+"""
+import threading
+from collections import OrderedDict
+import numpy as np
+from config import Config
+from extensions import db
+from models.rating_model import Feedback, Rating
+
+# Star rating that neither pulls nor pushes
+_NEUTRAL = 2.5
+
+# Users per IN (...) query when building profiles
+_USER_CHUNK = 500
+
+
+def interaction_weight(rating=None, is_like=None):
+    """Weight of one book in a taste vector; a rating wins over a like/dislike"""
+    if rating is None:
+        if is_like is None:
+            return 0.0
+        rating = 5 if is_like else 1
+    return float(rating) - _NEUTRAL
+
+
+class TasteProfile:
+    """Running weighted sum of the embeddings of one user's books"""
+
+    __slots__ = ('total', 'weight', 'books')
+
+    def __init__(self, dim):
+        self.total = np.zeros(dim, dtype=np.float32)
+        self.weight = 0.0  # sum of |weights|
+        self.books = {}  # embedding position -> (rating, is_like)
+
+    def update(self, embeddings, position, kind, value):
+        """Set the user's rating or like/dislike of the book at `position`; O(d)"""
+        old = self.books.get(position)
+        rating, is_like = old if old is not None else (None, None)
+        if kind == 'rating':
+            rating = value
+        else:
+            is_like = value
+        old_weight = interaction_weight(*old) if old is not None else 0.0
+        new_weight = interaction_weight(rating, is_like)
+        self.books[position] = (rating, is_like)
+        if new_weight != old_weight:
+            self.total += (new_weight - old_weight) * np.asarray(embeddings[position], dtype=np.float32)
+            self.weight += abs(new_weight) - abs(old_weight)
+
+    def vector(self):
+        """The weighted mean embedding, None while there is nothing to go on"""
+        if self.weight <= 0 or not np.any(self.total):
+            return None
+        return self.total / self.weight
+
+    def positions(self):
+        """Embedding positions of the books the user rated or gave feedback on"""
+        return np.fromiter(self.books, dtype=np.int64, count=len(self.books))
+
+
+class TasteProfiles:
+    """LRU of taste profiles over the recommender's loaded embeddings"""
+
+    def __init__(self, recommender, max_users=None):
+        self.recommender = recommender
+        self.max_users = max_users or Config.TASTE_CACHE_SIZE
+        self._profiles = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id):
+        """The user's profile, built from their ratings and feedback on a miss"""
+        return self.get_many([user_id])[user_id]
+
+    def get_many(self, user_ids):
+        """user_id -> profile for each of user_ids, with one query per table for all misses"""
+        found, missing = {}, []
+        with self._lock:
+            for user_id in user_ids:
+                profile = self._profiles.get(user_id)
+                if profile is None:
+                    missing.append(user_id)
+                else:
+                    self._profiles.move_to_end(user_id)
+                    found[user_id] = profile
+        self.hits += len(found)
+        self.misses += len(missing)
+        if not missing:
+            return found
+
+        # Deltas applied while the profiles are read could miss them; don't cache those then
+        online = self.recommender.online
+        seen = online.last_id if online is not None else None
+        built = {}
+        for start in range(0, len(missing), _USER_CHUNK):
+            built.update(self._build(missing[start:start + _USER_CHUNK]))
+        found.update(built)
+        if online is None or online.last_id == seen:
+            with self._lock:
+                for user_id, profile in built.items():
+                    self._profiles[user_id] = profile
+                while len(self._profiles) > self.max_users:
+                    self._profiles.popitem(last=False)
+        return found
+
+    def _build(self, user_ids):
+        rec = self.recommender
+        profiles = {user_id: TasteProfile(rec.embeddings.shape[1]) for user_id in user_ids}
+        rows = [('feedback', r) for r in db.session.query(Feedback.user_id, Feedback.book_id, Feedback.is_like).filter(
+            Feedback.user_id.in_(user_ids)
+        )] + [('rating', r) for r in db.session.query(Rating.user_id, Rating.book_id, Rating.rating).filter(
+            Rating.user_id.in_(user_ids)
+        )]
+        for kind, (user_id, book_id, value) in rows:
+            position = rec.books_index.get(book_id)
+            if position is not None:
+                profiles[user_id].update(rec.embeddings, position, kind, value)
+        return profiles
+
+    def apply(self, user_id, book_id, kind, value):
+        """Fold one rating delta into the user's profile if it is cached"""
+        rec = self.recommender
+        position = rec.books_index.get(book_id)
+        if position is None:
+            return
+        with self._lock:
+            profile = self._profiles.get(user_id)
+            if profile is not None:
+                profile.update(rec.embeddings, position, kind, value)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'users': len(self._profiles),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
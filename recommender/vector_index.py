@@ -0,0 +1,210 @@
+"""
+Vector index layer - exact and approximate nearest-neighbour search over book embeddings
+
+All indexes use inner product on L2-normalized vectors, i.e. cosine similarity.
+"""
+import os
+import numpy as np
+from config import Config
+
+try:
+    import faiss
+except ImportError:  # faiss-cpu is optional; callers fall back to brute force
+    faiss = None
+
+
+def _as_queries(vectors):
+    """Queries as a contiguous float32 (m, d) array"""
+    return np.ascontiguousarray(np.atleast_2d(vectors), dtype=np.float32)
+
+
+def l2_normalize(vectors):
+    """L2-normalized float32 copy of the vectors"""
+    vectors = np.array(np.atleast_2d(vectors), dtype=np.float32, copy=True, order='C')
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    vectors /= norms
+    return vectors
+
+
+class VectorIndex:
+    """Base wrapper around a FAISS inner-product index"""
+
+    kind = None
+
+    def __init__(self, index):
+        self.index = index
+
+    @property
+    def ntotal(self):
+        return self.index.ntotal
+
+    @property
+    def dim(self):
+        return self.index.d
+
+    @property
+    def nbytes(self):
+        """Approximate resident size of the stored vectors"""
+        return self.ntotal * self.dim * 4
+
+    def configure(self, **params):
+        """Apply search-time parameters (no-op for exact search)"""
+
+    def search(self, queries, k):
+        """Return (scores, positions) arrays of shape (m, k); missing slots have position -1"""
+        k = min(k, self.ntotal)
+        if k <= 0:
+            m = len(np.atleast_2d(queries))
+            return np.empty((m, 0), dtype=np.float32), np.empty((m, 0), dtype=np.int64)
+        return self.index.search(_as_queries(queries), k)
+
+    def add(self, vectors):
+        """Append (normalized) vectors; they take the next positions"""
+        self.index.add(_as_queries(vectors))
+
+    def refill(self, vectors):
+        """Replace all stored vectors, keeping any trained state (IVF centroids, PQ codebooks)"""
+        self.index.reset()
+        self.add(vectors)
+
+    def save(self, path):
+        """Write atomically: the old file may be hard-linked into a published artifact version"""
+        tmp = f'{path}.tmp'
+        faiss.write_index(self.index, tmp)
+        os.replace(tmp, path)
+
+
+class FlatIndex(VectorIndex):
+    """Exact inner-product search"""
+
+    kind = 'flat'
+
+    @classmethod
+    def build(cls, vectors, **params):
+        index = faiss.IndexFlatIP(vectors.shape[1])
+        index.add(vectors)
+        return cls(index)
+
+
+class IVFIndex(VectorIndex):
+    """Inverted-file index; nprobe trades recall for latency"""
+
+    kind = 'ivf'
+
+    @classmethod
+    def build(cls, vectors, nlist=None, nprobe=None, **params):
+        n, dim = vectors.shape
+        nlist = nlist or Config.VECTOR_INDEX_NLIST
+        # FAISS wants ~39 training points per centroid
+        nlist = max(1, min(nlist, n // 39 or 1))
+        quantizer = faiss.IndexFlatIP(dim)
+        index = faiss.IndexIVFFlat(quantizer, dim, nlist, faiss.METRIC_INNER_PRODUCT)
+        index.train(vectors)
+        index.add(vectors)
+        wrapped = cls(index)
+        wrapped.quantizer = quantizer  # keep the Python reference alive
+        wrapped.configure(nprobe=nprobe)
+        return wrapped
+
+    def configure(self, nprobe=None, **params):
+        nprobe = nprobe or Config.VECTOR_INDEX_NPROBE
+        self.index.nprobe = max(1, min(nprobe, self.index.nlist))
+
+
+class HNSWIndex(VectorIndex):
+    """Hierarchical navigable small-world graph; efSearch trades recall for latency"""
+
+    kind = 'hnsw'
+
+    @classmethod
+    def build(cls, vectors, m=None, ef_construction=None, ef_search=None, **params):
+        index = faiss.IndexHNSWFlat(vectors.shape[1], m or Config.VECTOR_INDEX_HNSW_M,
+                                    faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = ef_construction or Config.VECTOR_INDEX_EF_CONSTRUCTION
+        index.add(vectors)
+        wrapped = cls(index)
+        wrapped.configure(ef_search=ef_search)
+        return wrapped
+
+    @property
+    def nbytes(self):
+        # Vectors plus roughly 2*M neighbour links per node on the base layer
+        return super().nbytes + self.ntotal * self.index.hnsw.nb_neighbors(0) * 4
+
+    def configure(self, ef_search=None, **params):
+        self.index.hnsw.efSearch = ef_search or Config.VECTOR_INDEX_EF_SEARCH
+
+
+class PQIndex(VectorIndex):
+    """Product-quantized codes scanned exhaustively; m sub-quantizers of nbits each per vector"""
+
+    kind = 'pq'
+
+    @classmethod
+    def build(cls, vectors, m=None, nbits=None, **params):
+        n, dim = vectors.shape
+        m = min(m or Config.EMBEDDING_PQ_M, dim)
+        while dim % m:
+            m -= 1
+        # Each sub-quantizer needs at least 2**nbits training points
+        nbits = nbits or Config.EMBEDDING_PQ_BITS
+        nbits = max(1, min(nbits, int(np.log2(max(n, 2)))))
+        index = faiss.IndexPQ(dim, m, nbits, faiss.METRIC_INNER_PRODUCT)
+        index.train(vectors)
+        index.add(vectors)
+        return cls(index)
+
+    @property
+    def nbytes(self):
+        pq = self.index.pq
+        return self.ntotal * self.index.code_size + pq.M * pq.ksub * pq.dsub * 4
+
+
+INDEX_TYPES = {cls.kind: cls for cls in (FlatIndex, IVFIndex, HNSWIndex, PQIndex)}
+
+
+def faiss_available():
+    return faiss is not None
+
+
+def build_index(embeddings, kind=None, normalize=True, **params):
+    """Build a vector index of the given kind over (normalized) embeddings
+
+    Pass normalize=False for raw inner-product search, e.g. over factor vectors.
+    """
+    if faiss is None:
+        raise RuntimeError("faiss-cpu is not installed")
+    kind = kind or Config.VECTOR_INDEX_TYPE
+    if kind not in INDEX_TYPES:
+        raise ValueError(f"Unknown vector index type: {kind}")
+    vectors = l2_normalize(embeddings) if normalize else np.ascontiguousarray(embeddings, dtype=np.float32)
+    return INDEX_TYPES[kind].build(vectors, **params)
+
+
+def load_index(path, mmap=True, **params):
+    """Load a persisted index and apply search-time parameters
+
+    mmap=False reads a writable copy, for indexes that are updated and saved again.
+    """
+    if faiss is None:
+        raise RuntimeError("faiss-cpu is not installed")
+    index = None
+    if mmap:
+        try:
+            # Map the index file instead of reading it into the heap where FAISS supports it
+            index = faiss.read_index(str(path), faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+        except RuntimeError:
+            pass
+    if index is None:
+        index = faiss.read_index(str(path))
+    if isinstance(index, faiss.IndexHNSW):
+        wrapped = HNSWIndex(index)
+    elif isinstance(index, faiss.IndexIVF):
+        wrapped = IVFIndex(index)
+    elif isinstance(index, faiss.IndexPQ):
+        wrapped = PQIndex(index)
+    else:
+        wrapped = FlatIndex(index)
+    wrapped.configure(**params)
+    return wrapped
@@ -0,0 +1,298 @@
+"""
+Response cache for search and recommendation endpoints
+
+Entries are JSON-serializable results keyed on the endpoint and its normalized query
+parameters. Every entry is tagged with what it depends on, so writes invalidate exactly
+the entries they affect:
+- book:<id>  the entry shows that book (edit, delete, new rating)
+- catalog    which books match depends on book text (add, edit, CSV import)
+- ratings    a list cut off by rating order, which any new rating can reshuffle
+- model      scored by the recommender (new artifact version)
+
+The 'memory' backend is a per-process LRU with a TTL. The 'sqlite' backend is one file
+shared by every worker on the host, so an invalidation in one worker reaches all of them.
+"""
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+_MISS = object()
+
+
+def normalize_param(value):
+    """Cache-key form of a query parameter (searches are case-insensitive)"""
+    return str(value).strip().lower()
+
+
+def book_tags(books):
+    """book:<id> tags for a list of book dicts"""
+    return [f"book:{book['id']}" for book in books]
+
+
+def list_tags(books, limit=None):
+    """Tags for books matched from the catalog; `limit` marks a list cut off by rating order"""
+    tags = ['catalog'] + book_tags(books)
+    if limit is not None and len(books) >= limit:
+        # A book outside the list can be rated into it
+        tags.append('ratings')
+    return tags
+
+
+class MemoryBackend:
+    """Per-process LRU of entries with an expiry time and a tag -> keys index"""
+
+    name = 'memory'
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (expires, value, tags)
+        self._keys_by_tag = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _drop(self, key):
+        _, _, tags = self._entries.pop(key)
+        for tag in tags:
+            keys = self._keys_by_tag[tag]
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_tag[tag]
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return _MISS
+            if entry[0] < time.monotonic():
+                self._drop(key)
+                return _MISS
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value, tags, ttl):
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            tags = frozenset(tags)
+            self._entries[key] = (time.monotonic() + ttl, value, tags)
+            for tag in tags:
+                self._keys_by_tag[tag].add(key)
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+
+    def invalidate(self, tags):
+        with self._lock:
+            keys = set().union(*(self._keys_by_tag.get(tag, ()) for tag in tags))
+            for key in keys:
+                self._drop(key)
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._keys_by_tag.clear()
+
+
+class SQLiteBackend:
+    """Entries in a SQLite file shared by all worker processes on a host"""
+
+    name = 'sqlite'
+
+    # Expired entries and overflow are pruned every this many writes
+    _PRUNE_EVERY = 100
+
+    def __init__(self, path, max_entries):
+        self.path = Path(path)
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._writes = 0
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._connection().executescript("""
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL NOT NULL);
+            CREATE TABLE IF NOT EXISTS entry_tags (
+                tag TEXT NOT NULL, key TEXT NOT NULL REFERENCES entries(key) ON DELETE CASCADE,
+                PRIMARY KEY (tag, key));
+            CREATE INDEX IF NOT EXISTS ix_entry_tags_key ON entry_tags(key);
+            CREATE INDEX IF NOT EXISTS ix_entries_expires ON entries(expires);
+        """)
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            # Autocommit; writes take an explicit transaction
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute('PRAGMA foreign_keys=ON')
+            self._local.connection = connection
+        return connection
+
+    def __len__(self):
+        return self._connection().execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+
+    def get(self, key):
+        row = self._connection().execute(
+            'SELECT value FROM entries WHERE key = ? AND expires >= ?', (key, time.time())
+        ).fetchone()
+        return _MISS if row is None else json.loads(row[0])
+
+    def set(self, key, value, tags, ttl):
+        connection = self._connection()
+        with connection:
+            connection.execute('BEGIN IMMEDIATE')
+            # Deleting the old row cascades to its tags
+            connection.execute('DELETE FROM entries WHERE key = ?', (key,))
+            connection.execute('INSERT INTO entries (key, value, expires) VALUES (?, ?, ?)',
+                               (key, json.dumps(value, separators=(',', ':')), time.time() + ttl))
+            connection.executemany('INSERT OR IGNORE INTO entry_tags (tag, key) VALUES (?, ?)',
+                                   [(tag, key) for tag in set(tags)])
+        self._writes += 1
+        if self._writes % self._PRUNE_EVERY == 0:
+            self._prune()
+
+    def _prune(self):
+        connection = self._connection()
+        with connection:
+            connection.execute('BEGIN IMMEDIATE')
+            connection.execute('DELETE FROM entries WHERE expires < ?', (time.time(),))
+            # Then the entries closest to expiry, above the size limit
+            connection.execute(
+                'DELETE FROM entries WHERE key IN (SELECT key FROM entries ORDER BY expires '
+                'LIMIT max(0, (SELECT COUNT(*) FROM entries) - ?))', (self.max_entries,)
+            )
+
+    def invalidate(self, tags):
+        tags = list(tags)
+        dropped = 0
+        connection = self._connection()
+        with connection:
+            connection.execute('BEGIN IMMEDIATE')
+            # Chunked to stay under SQLite's bound-parameter limit (e.g. after a large CSV import)
+            for start in range(0, len(tags), 500):
+                chunk = tags[start:start + 500]
+                placeholders = ','.join('?' * len(chunk))
+                dropped += connection.execute(
+                    f'DELETE FROM entries WHERE key IN (SELECT key FROM entry_tags WHERE tag IN ({placeholders}))',
+                    chunk
+                ).rowcount
+        return dropped
+
+    def clear(self):
+        connection = self._connection()
+        with connection:
+            connection.execute('BEGIN IMMEDIATE')
+            connection.execute('DELETE FROM entries')
+
+
+class ResponseCache:
+    """Tagged cache of endpoint results with per-endpoint hit counters"""
+
+    def __init__(self, app=None):
+        self.backend = None
+        self.ttl = 0
+        self._counters = defaultdict(lambda: {'hits': 0, 'misses': 0})
+        self.invalidations = 0
+        self.invalidated_entries = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        kind = app.config.get('RESPONSE_CACHE_BACKEND', 'memory')
+        size = app.config.get('RESPONSE_CACHE_SIZE', 2048)
+        self.ttl = app.config.get('RESPONSE_CACHE_TTL', 300)
+        if kind == 'memory':
+            self.backend = MemoryBackend(size)
+        elif kind == 'sqlite':
+            self.backend = SQLiteBackend(app.config['RESPONSE_CACHE_PATH'], size)
+        elif kind == 'none':
+            self.backend = None
+        else:
+            raise ValueError(f"Unknown response cache backend: {kind}")
+        app.extensions['response_cache'] = self
+
+    @staticmethod
+    def make_key(endpoint, params):
+        """Stable key for an endpoint and its normalized parameters"""
+        normalized = sorted((name, normalize_param(value)) for name, value in params.items())
+        raw = json.dumps([endpoint, normalized], separators=(',', ':'))
+        return f"{endpoint}:{hashlib.blake2b(raw.encode('utf-8'), digest_size=16).hexdigest()}"
+
+    def get_or_set(self, endpoint, params, compute):
+        """Cached result for endpoint/params; on a miss `compute()` returns (value, tags)
+
+        tags=None returns the value without caching it (e.g. a partial result).
+        """
+        if self.backend is None:
+            return compute()[0]
+        key = self.make_key(endpoint, params)
+        counters = self._counters[endpoint]
+        try:
+            value = self.backend.get(key)
+        except sqlite3.Error as e:
+            logger.warning(f"Response cache read failed: {e}")
+            value = _MISS
+        if value is not _MISS:
+            counters['hits'] += 1
+            return value
+
+        counters['misses'] += 1
+        value, tags = compute()
+        if tags is None:
+            return value
+        try:
+            self.backend.set(key, value, tags, self.ttl)
+        except sqlite3.Error as e:
+            logger.warning(f"Response cache write failed: {e}")
+        return value
+
+    def invalidate(self, *tags):
+        """Drop every entry carrying any of the tags; call after the write has committed"""
+        if self.backend is None or not tags:
+            return 0
+        try:
+            dropped = self.backend.invalidate(tags)
+        except sqlite3.Error as e:
+            logger.warning(f"Response cache invalidation failed: {e}")
+            return 0
+        self.invalidations += 1
+        self.invalidated_entries += dropped
+        return dropped
+
+    def clear(self):
+        if self.backend is not None:
+            self.backend.clear()
+
+    def stats(self):
+        """Hit rate per endpoint and overall, for monitoring (counters are per process)"""
+        endpoints = {}
+        hits = misses = 0
+        for endpoint, counters in sorted(self._counters.items()):
+            lookups = counters['hits'] + counters['misses']
+            endpoints[endpoint] = dict(counters, hit_rate=counters['hits'] / lookups if lookups else 0.0)
+            hits += counters['hits']
+            misses += counters['misses']
+        return {
+            'backend': self.backend.name if self.backend is not None else 'none',
+            'entries': len(self.backend) if self.backend is not None else 0,
+            'ttl_seconds': self.ttl,
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': hits / (hits + misses) if hits + misses else 0.0,
+            'invalidations': self.invalidations,
+            'invalidated_entries': self.invalidated_entries,
+            'endpoints': endpoints,
+        }
+
+
+# One cache per process, registered on the app in create_app
+response_cache = ResponseCache()
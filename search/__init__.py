@@ -0,0 +1,9 @@
+# Search package
+from .fts import BookSearch, book_search
+from .genres import GenreIndex, genre_index
+from .hybrid import hybrid_search, reciprocal_rank_fusion
+from .moods import MOOD_LEXICON, MoodIndex, mood_index, moods_in
+from .typeahead import TypeaheadIndex, typeahead_index
+
+__all__ = ['BookSearch', 'book_search', 'GenreIndex', 'genre_index', 'hybrid_search', 'reciprocal_rank_fusion',
+           'MOOD_LEXICON', 'MoodIndex', 'mood_index', 'moods_in', 'TypeaheadIndex', 'typeahead_index']
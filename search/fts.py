@@ -0,0 +1,248 @@
+"""
+Full-text book search on an SQLite FTS5 index
+
+books_fts is an external-content FTS5 table over the title, author, genres and
+description columns of books, kept in sync by triggers. Every write path (admin forms,
+CSV and Goodreads imports, seeding) therefore updates it without extra code. A search
+is one index lookup joined to books by rowid, so its cost follows the number of matches
+instead of the size of the catalog.
+
+Matches are ranked by bm25 (title hits weigh most), scaled up by a damped rating
+popularity: avg_rating / 5 x ratings_count / (ratings_count + 50). Each word of a query
+matches as a prefix ("harr pott" finds "Harry Potter"). When FTS5 is unavailable (or
+the database isn't SQLite) searches fall back to LIKE '%term%' scans.
+
+Searches can also name moods (see search.moods): books tagged with any of them match
+too, looked up in the book_moods index. Genre filters go through the book_genres
+junction (see search.genres); with genre_mode='all' only the rarest genre does, and the
+worker's genre bitmaps keep the matches that have the others too.
+"""
+import logging
+import re
+from sqlalchemy import column, literal_column, or_, select, table, text
+from sqlalchemy.exc import OperationalError
+from config import Config
+from extensions import db
+from models.book_model import Book
+from models.mood_model import BookMood
+from search.genres import genre_filter, genre_index, genre_key
+
+logger = logging.getLogger(__name__)
+
+FTS_TABLE = 'books_fts'
+
+# Indexed columns and their bm25 weights, in table order
+FTS_COLUMNS = (('title', 10.0), ('author', 5.0), ('genres', 2.0), ('description', 1.0))
+
+# Ratings count at which popularity reaches half its weight
+_POPULARITY_DAMPING = 50.0
+
+# Ids checked against the genre bitmaps at a time by an all-genres search
+_INTERSECT_BATCH = 1000
+
+_SCHEMA = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        title, author, genres, description,
+        content='books', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3')""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON books BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, title, author, genres, description)
+        VALUES (new.id, new.title, new.author, new.genres, new.description);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON books BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, author, genres, description)
+        VALUES ('delete', old.id, old.title, old.author, old.genres, old.description);
+    END""",
+    # Rating stat updates don't touch the index
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF title, author, genres, description ON books BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, author, genres, description)
+        VALUES ('delete', old.id, old.title, old.author, old.genres, old.description);
+        INSERT INTO {FTS_TABLE}(rowid, title, author, genres, description)
+        VALUES (new.id, new.title, new.author, new.genres, new.description);
+    END""",
+]
+
+_TOKEN = re.compile(r'\w+')
+
+_fts = table(FTS_TABLE, column('rowid'))
+
+
+def term_query(term):
+    """FTS5 expression matching every word of `term` as a prefix, None if it has no words"""
+    tokens = _TOKEN.findall(term.lower())
+    if not tokens:
+        return None
+    # Tokens are word characters only, so quoting them is enough to escape FTS5 syntax
+    return ' AND '.join(f'"{token}"*' for token in tokens)
+
+
+def match_expression(q, description=False):
+    """FTS5 MATCH string for a query, None when nothing in it is searchable
+
+    Every word of `q` must match in title, author or genres, plus description with
+    description=True.
+    """
+    expression = term_query(q)
+    if expression is None:
+        return None
+    columns = '{title author genres description}' if description else '{title author genres}'
+    return f"{columns} : ({expression})"
+
+
+class BookSearch:
+    """Book search over the FTS5 index, with the LIKE scan as fallback"""
+
+    def __init__(self, app=None):
+        self.enabled = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Create the index and its triggers if missing (filling it from books); call after create_all"""
+        app.extensions['book_search'] = self
+        self.enabled = False
+        if not app.config.get('SEARCH_FTS', True):
+            return
+        with app.app_context():
+            if db.engine.dialect.name != 'sqlite':
+                logger.info("Full-text search needs SQLite, using LIKE search")
+                return
+            try:
+                self._ensure_index()
+            except OperationalError as e:
+                # e.g. an SQLite build without FTS5
+                logger.warning(f"Full-text index unavailable, using LIKE search: {e}")
+                return
+        self.enabled = True
+
+    def _ensure_index(self):
+        with db.engine.begin() as connection:
+            exists = connection.execute(
+                text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"), {'name': FTS_TABLE}
+            ).first()
+            for statement in _SCHEMA:
+                connection.execute(text(statement))
+            if not exists:
+                connection.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"))
+                logger.info(f"Built full-text index {FTS_TABLE}")
+
+    def rebuild(self):
+        """Re-index every book, e.g. after books were changed with triggers disabled"""
+        db.session.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"))
+        db.session.commit()
+
+    def optimize(self):
+        """Merge the index's segments into one, e.g. after a large import"""
+        db.session.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('optimize')"))
+        db.session.commit()
+
+    def search(self, q='', moods=(), genres=(), genre_mode='any', description=False, order='relevance', limit=50):
+        """Books matching a search, as a list of Book objects
+
+        A book matches `q` (see match_expression) or is tagged with any of `moods` (see
+        search.moods), and has any of `genres` (all of them with genre_mode='all'; see
+        search.genres). `order` is 'relevance' (bm25 blended with popularity), 'rating' or
+        'recent'; mood matches have no bm25, so a search with moods or without a query is
+        ordered by rating.
+        """
+        query, rest = self._query(q, moods, genres, genre_mode, description, order)
+        if query is None:
+            return []
+        if rest:
+            return self.load(self._intersect(query, rest, limit))
+        return query.limit(limit).all()
+
+    def search_with_facets(self, q='', moods=(), genres=(), genre_mode='any', description=False, order='relevance',
+                           limit=50, facet_limit=20):
+        """(books, facets) for a search as in search(); facets are [(genre, count)] over all matches
+
+        The ids of all matches are read in order once; the first `limit` are loaded as books
+        and the genre bitmaps count all of them.
+        """
+        ids = self.search_ids(q, moods, genres, genre_mode, description, order)
+        return self.load(ids[:limit]), genre_index.facets(ids, facet_limit)
+
+    def search_ids(self, q='', moods=(), genres=(), genre_mode='any', description=False, order='relevance', limit=None):
+        """Ids of the books search() would return, in order; all matches when limit is None"""
+        query, rest = self._query(q, moods, genres, genre_mode, description, order)
+        if query is None:
+            return []
+        if rest:
+            return self._intersect(query, rest, limit)
+        query = query.with_entities(Book.id)
+        if limit is not None:
+            query = query.limit(limit)
+        return [book_id for book_id, in query]
+
+    @staticmethod
+    def load(book_ids):
+        """Books for a list of ids, in the same order (ids of deleted books are skipped)"""
+        books = {book.id: book for book in Book.query.filter(Book.id.in_(book_ids))} if book_ids else {}
+        return [books[book_id] for book_id in book_ids if book_id in books]
+
+    @staticmethod
+    def _intersect(query, genres, limit):
+        """Ids of the books of `query`, in order, that have all of `genres` in the genre bitmaps"""
+        found, batch = [], []
+        for book_id, in query.with_entities(Book.id).yield_per(_INTERSECT_BATCH):
+            batch.append(book_id)
+            if len(batch) == _INTERSECT_BATCH:
+                found += genre_index.select(batch, genres, 'all')
+                batch = []
+                if limit is not None and len(found) >= limit:
+                    break
+        found += genre_index.select(batch, genres, 'all')
+        return found[:limit] if limit is not None else found
+
+    def _query(self, q, moods, genres, genre_mode, description, order):
+        """(ordered query of the matching books, genres left to the bitmaps); None for an empty search"""
+        q, moods, genres = q.strip(), sorted(set(moods)), [g for g in genres if g.strip()]
+        if not (q or moods or genres):
+            return None, []
+        if order == 'relevance' and (moods or not q):
+            order = 'rating'
+
+        match = match_expression(q, description) if order == 'relevance' and self.enabled else None
+        if match is not None:
+            # Joined by rowid so bm25 can rank the matches
+            query = Book.query.join(_fts, _fts.c.rowid == Book.id).filter(
+                literal_column(FTS_TABLE).op('MATCH')(match)
+            )
+        else:
+            query = Book.query
+            matches = []
+            if q:
+                matches.append(self._text_filter(q, description))
+            if moods:
+                matches.append(Book.id.in_(select(BookMood.book_id).where(BookMood.mood.in_(moods))))
+            if matches:
+                query = query.filter(or_(*matches))
+        rest = []
+        if genres and genre_mode == 'all' and len({genre_key(g) for g in genres}) > 1:
+            # One index range instead of an intersection of several in SQL
+            first = genre_index.rarest(genres)
+            rest = [g for g in genres if genre_key(g) != genre_key(first)]
+            query = query.filter(genre_filter([first]))
+        elif genres:
+            query = query.filter(genre_filter(genres, genre_mode))
+
+        if match is not None:
+            # bm25 is negative (lower is better), so scaling it up ranks popular books higher
+            popularity = Book.avg_rating / 5.0 * Book.ratings_count / (Book.ratings_count + _POPULARITY_DAMPING)
+            rank = literal_column(f"bm25({FTS_TABLE}, {', '.join(str(w) for _, w in FTS_COLUMNS)})")
+            return query.order_by(rank * (1.0 + Config.SEARCH_POPULARITY_WEIGHT * popularity), Book.id), rest
+        if order == 'recent':
+            return query.order_by(Book.created_at.desc()), rest
+        return query.order_by(Book.avg_rating.desc(), Book.ratings_count.desc()), rest
+
+    def _text_filter(self, q, description):
+        match = match_expression(q, description) if self.enabled else None
+        if match is not None:
+            return Book.id.in_(select(_fts.c.rowid).where(literal_column(FTS_TABLE).op('MATCH')(match)))
+        # LIKE '%q%' fallback (a full table scan)
+        columns = [Book.title, Book.author, Book.genres] + ([Book.description] if description else [])
+        return or_(*(c.ilike(f'%{q}%') for c in columns))
+
+
+# One instance per process, set up in create_app after the tables exist
+book_search = BookSearch()
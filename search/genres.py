@@ -0,0 +1,259 @@
+"""
+Normalized book genres and facet bitmaps
+
+Book.genres stays the semicolon-separated string shown to users. Each genre in it is
+also a row of the genres table, and book_genres joins it to the book. Genres are matched
+by key (lowercase, single spaces), so a "fiction" filter matches "Fiction" but not
+"Science Fiction". Like mood tags (see search.moods), the junction rows are written by
+a session hook for every book a flush inserts or whose genres it changes, so every
+import path and the admin forms maintain them.
+
+Each worker also keeps a bitmap of books per genre. Facet counts of a search are then one
+AND and popcount per genre over the result set, with no query beyond the search itself.
+A search for books with all of several genres (see search.fts) joins book_genres for the
+rarest of them only, and intersects the matches with the bitmaps of the others.
+The bitmaps are loaded on first use and reloaded on a background thread every
+GENRE_INDEX_REFRESH seconds (and after the worker's own book writes); requests keep using
+the previous bitmaps until the new ones are ready, as with the typeahead index.
+"""
+import logging
+import threading
+import time
+from itertools import chain
+import numpy as np
+from sqlalchemy import and_, delete, event, insert, inspect, select
+from config import Config
+from extensions import db
+from models.book_model import Book
+from models.genre_model import BookGenre, Genre
+
+logger = logging.getLogger(__name__)
+
+# Books read per query when indexing the catalog
+_INDEX_CHUNK = 2000
+
+
+def genre_key(name):
+    """Normalized form genres are matched by"""
+    return ' '.join(name.lower().split())
+
+
+def split_genres(genres):
+    """key -> name for each genre of a semicolon-separated string, in order"""
+    found = {}
+    for name in (genres or '').split(';'):
+        name = ' '.join(name.split())
+        if name:
+            found.setdefault(genre_key(name), name[:100])
+    return found
+
+
+def genre_filter(genres, mode='any'):
+    """SQL condition for books with any (or all, with mode='all') of `genres`"""
+    keys = sorted({genre_key(g) for g in genres if g.strip()})
+
+    def books_of(keys):
+        return Book.id.in_(select(BookGenre.book_id).join(Genre, Genre.id == BookGenre.genre_id).where(Genre.key.in_(keys)))
+
+    if mode == 'all':
+        # One index range per genre, intersected
+        return and_(*(books_of([key]) for key in keys))
+    return books_of(keys)
+
+
+def _genre_ids(session, genres):
+    """key -> genre id for a key -> name mapping, creating missing genres"""
+    keys = list(genres)
+    ids = dict(session.execute(select(Genre.key, Genre.id).where(Genre.key.in_(keys))).all())
+    missing = [{'key': key, 'name': genres[key]} for key in keys if key not in ids]
+    if missing:
+        # Another worker may create the same genre meanwhile
+        session.execute(insert(Genre).prefix_with('OR IGNORE', dialect='sqlite'), missing)
+        ids.update(session.execute(
+            select(Genre.key, Genre.id).where(Genre.key.in_([g['key'] for g in missing]))
+        ).all())
+    return ids
+
+
+def _link(session, books):
+    """Replace the book_genres rows of (book_id, genres string) pairs"""
+    books = [(book_id, split_genres(genres)) for book_id, genres in books]
+    session.execute(delete(BookGenre).where(BookGenre.book_id.in_([book_id for book_id, _ in books])))
+    names = {}
+    for _, genres in books:
+        for key, name in genres.items():
+            names.setdefault(key, name)
+    if not names:
+        return
+    ids = _genre_ids(session, names)
+    links = [{'genre_id': ids[key], 'book_id': book_id} for book_id, genres in books for key in genres]
+    session.execute(insert(BookGenre), links)
+
+
+def index_all_genres():
+    """Rebuild book_genres for every book, in chunks of one transaction each; returns the number of books
+
+    Must be called inside an app context.
+    """
+    last_id, done = 0, 0
+    while True:
+        rows = db.session.execute(
+            select(Book.id, Book.genres).where(Book.id > last_id).order_by(Book.id).limit(_INDEX_CHUNK)
+        ).all()
+        if not rows:
+            db.session.execute(delete(BookGenre).where(BookGenre.book_id > last_id))
+            db.session.commit()
+            return done
+        # Rows of deleted books in the chunk's id range go too
+        db.session.execute(delete(BookGenre).where(BookGenre.book_id > last_id, BookGenre.book_id <= rows[-1].id))
+        _link(db.session, rows)
+        db.session.commit()
+        last_id, done = rows[-1].id, done + len(rows)
+
+
+def _index_flushed_books(session, flush_context):
+    """Re-link the books a flush inserted or changed the genres of"""
+    books = [(obj.id, obj.genres) for obj in session.new if isinstance(obj, Book)]
+    for obj in session.dirty:
+        if isinstance(obj, Book) and obj not in session.deleted and inspect(obj).attrs.genres.history.has_changes():
+            books.append((obj.id, obj.genres))
+    if books:
+        _link(session, books)
+        genre_index.stale = True
+
+
+def _bitmap(positions, size):
+    """Python int with the bits at `positions` set"""
+    positions = np.asarray(positions, dtype=np.int64)
+    packed = np.zeros((size + 7) // 8, dtype=np.uint8)
+    np.bitwise_or.at(packed, positions >> 3, (1 << (positions & 7)).astype(np.uint8))
+    return int.from_bytes(packed.tobytes(), 'little')
+
+
+class _Bitmaps:
+    """One loaded set of bitmaps; never changed after construction, so readers need no lock"""
+
+    def __init__(self, book_ids, names, keys, bitmaps):
+        self.book_ids = book_ids  # bit i of a bitmap is book_ids[i]
+        self.names = names  # genre id -> name
+        self.keys = keys  # genre key -> id
+        self.bitmaps = bitmaps  # genre id -> int
+        self.loaded_at = time.monotonic()
+
+
+class GenreIndex:
+    """Per-worker bitmaps of the books of each genre, for facet counts"""
+
+    def __init__(self, app=None):
+        self.app = None
+        self.stale = True
+        self._snapshot = None
+        self._lock = threading.Lock()
+        self._loading = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Install the session hook and index the catalog if it was never indexed; call after create_all"""
+        self.app = app
+        app.extensions['genre_index'] = self
+        if not event.contains(db.session, 'after_flush', _index_flushed_books):
+            event.listen(db.session, 'after_flush', _index_flushed_books)
+        with app.app_context():
+            if db.session.query(BookGenre.book_id).first() is None and db.session.query(Book.id).first() is not None:
+                count = index_all_genres()
+                logger.info(f"Indexed genres of {count} books")
+        self.stale = True
+
+    def load(self):
+        """Read the bitmaps from book_genres; must be called inside an app context"""
+        self.stale = False
+        rows = db.session.execute(select(BookGenre.genre_id, BookGenre.book_id).order_by(BookGenre.genre_id))
+        pairs = np.fromiter(chain.from_iterable(rows), dtype=np.int64).reshape(-1, 2)
+        genres = db.session.execute(select(Genre.id, Genre.name, Genre.key)).all()
+        book_ids = np.unique(pairs[:, 1])
+        positions = np.searchsorted(book_ids, pairs[:, 1])
+        starts = np.flatnonzero(np.r_[True, pairs[1:, 0] != pairs[:-1, 0]]) if len(pairs) else []
+        ends = np.r_[starts[1:], len(pairs)] if len(pairs) else []
+        bitmaps = {int(pairs[s, 0]): _bitmap(positions[s:e], len(book_ids)) for s, e in zip(starts, ends)}
+        snapshot = _Bitmaps(book_ids, {genre_id: name for genre_id, name, _ in genres},
+                            {key: genre_id for genre_id, _, key in genres}, bitmaps)
+        # Single reference assignment - readers see either the old or the new bitmaps
+        self._snapshot = snapshot
+        return snapshot
+
+    def _current(self):
+        """The bitmaps to serve, loading the first ones in place and later ones in the background"""
+        snapshot = self._snapshot
+        if snapshot is None:
+            with self._lock:
+                if self._snapshot is None:
+                    self.load()
+                return self._snapshot
+        if self.stale or time.monotonic() - snapshot.loaded_at >= Config.GENRE_INDEX_REFRESH:
+            self._reload_in_background()
+        return snapshot
+
+    def _reload_in_background(self):
+        with self._lock:
+            if self._loading or self.app is None:
+                return
+            self._loading = True
+        threading.Thread(target=self._reload, name='genre-index-reload', daemon=True).start()
+
+    def _reload(self):
+        try:
+            with self.app.app_context():
+                self.load()
+        except Exception as e:
+            logger.error(f"Reloading the genre bitmaps failed: {e}")
+        finally:
+            self._loading = False
+
+    def select(self, book_ids, genres, mode='any'):
+        """The ids of `book_ids` with any (or all, with mode='all') of `genres`, in order"""
+        snapshot = self._current()
+        indexed, bitmaps = snapshot.book_ids, snapshot.bitmaps
+        wanted = [bitmaps.get(snapshot.keys.get(genre_key(g)), 0) for g in genres if g.strip()]
+        if not wanted:
+            return list(book_ids)
+        book_ids = list(book_ids)
+        if not len(indexed) or not book_ids:
+            return []
+        combined = wanted[0]
+        for bitmap in wanted[1:]:
+            combined = combined & bitmap if mode == 'all' else combined | bitmap
+        bits = np.unpackbits(np.frombuffer(combined.to_bytes((len(indexed) + 7) // 8, 'little'), dtype=np.uint8),
+                             bitorder='little').astype(bool)
+        ids = np.asarray(book_ids, dtype=np.int64)
+        positions = np.minimum(np.searchsorted(indexed, ids), len(indexed) - 1)
+        keep = (indexed[positions] == ids) & bits[positions]
+        return [book_id for book_id, kept in zip(book_ids, keep.tolist()) if kept]
+
+    def rarest(self, genres):
+        """The one of `genres` with the fewest books (unknown genres have none)"""
+        snapshot = self._current()
+        return min(genres, key=lambda g: snapshot.bitmaps.get(snapshot.keys.get(genre_key(g)), 0).bit_count())
+
+    def facets(self, book_ids=None, limit=20):
+        """[(genre, count)] over `book_ids` (the whole catalog when None), most common first"""
+        snapshot = self._current()
+        indexed, names, bitmaps = snapshot.book_ids, snapshot.names, snapshot.bitmaps
+        if book_ids is None:
+            counts = ((genre_id, bitmap.bit_count()) for genre_id, bitmap in bitmaps.items())
+        else:
+            if not len(indexed):
+                return []
+            book_ids = np.asarray(book_ids, dtype=np.int64)
+            positions = np.searchsorted(indexed, book_ids)
+            positions[positions >= len(indexed)] = 0
+            # Books without genres aren't in the bitmaps
+            matched = _bitmap(positions[indexed[positions] == book_ids], len(indexed))
+            counts = ((genre_id, (bitmap & matched).bit_count()) for genre_id, bitmap in bitmaps.items())
+        counts = sorted(((names.get(genre_id, ''), count) for genre_id, count in counts if count),
+                        key=lambda item: (-item[1], item[0]))
+        return counts[:limit]
+
+
+# One instance per process, set up in create_app after the tables exist
+genre_index = GenreIndex()
@@ -0,0 +1,102 @@
+"""
+Hybrid lexical + semantic book search
+
+/api/search?mode=hybrid runs two candidate generators at once on a shared thread pool:
+- lexical: the full-text search (bm25 blended with popularity, see search.fts)
+- semantic: the query embedding against the book embeddings of the resident recommender
+Each returns up to HYBRID_CANDIDATES ranked book ids. The two rankings are merged with
+reciprocal rank fusion: a book scores sum(1 / (HYBRID_RRF_K + rank)) over the rankings
+it appears in, so bm25 and cosine scores never have to be put on one scale. Only the
+final page is loaded from the database.
+
+Each generator has a time budget counted from the start of the search
+(HYBRID_LEXICAL_BUDGET_MS, HYBRID_SEMANTIC_BUDGET_MS). One that misses it is left out of
+the fusion, and its thread finishes in the background, so a slow stage costs results
+rather than latency. A generator that fails or isn't available (no embeddings yet) is
+left out the same way.
+"""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from flask import current_app
+from config import Config
+from search.fts import book_search
+from search.genres import genre_index
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=Config.HYBRID_SEARCH_THREADS,
+                                               thread_name_prefix='hybrid-search')
+    return _executor
+
+
+def reciprocal_rank_fusion(rankings, k=None, limit=None):
+    """[(book_id, score)] fused from lists of ranked ids, best first"""
+    k = Config.HYBRID_RRF_K if k is None else k
+    scores = {}
+    for ranking in rankings:
+        for rank, book_id in enumerate(ranking, start=1):
+            scores[book_id] = scores.get(book_id, 0.0) + 1.0 / (k + rank)
+    # Ties keep the order books were first seen in (lexical first)
+    fused = sorted(scores.items(), key=lambda item: -item[1])
+    return fused[:limit] if limit is not None else fused
+
+
+def _lexical(app, q, genres, genre_mode, n):
+    with app.app_context():
+        return book_search.search_ids(q, genres=genres, genre_mode=genre_mode, description=True, limit=n)
+
+
+def _semantic(recommender, q, n):
+    from recommender.encoder import get_query_encoder
+    book_ids, _ = recommender.score_by_text(get_query_encoder().encode(q), top_k=n)
+    return [int(book_id) for book_id in book_ids]
+
+
+def hybrid_search(q, recommender=None, genres=(), genre_mode='any', limit=50):
+    """(books, scores, stages) for a query; must be called inside an app context
+
+    `recommender` is the resident HybridRecommender (None skips the semantic stage).
+    stages maps 'lexical' and 'semantic' to 'ok', 'timeout', 'error' or 'unavailable'.
+    """
+    n = max(Config.HYBRID_CANDIDATES, limit)
+    executor = _get_executor()
+    start = time.monotonic()
+    futures = {'lexical': executor.submit(_lexical, current_app._get_current_object(), q, genres, genre_mode, n)}
+    if recommender is not None and recommender.embeddings is not None:
+        futures['semantic'] = executor.submit(_semantic, recommender, q, n)
+    budgets = {'lexical': Config.HYBRID_LEXICAL_BUDGET_MS, 'semantic': Config.HYBRID_SEMANTIC_BUDGET_MS}
+
+    rankings, stages = [], {'lexical': 'unavailable', 'semantic': 'unavailable'}
+    for stage, future in futures.items():
+        remaining = start + budgets[stage] / 1000.0 - time.monotonic()
+        try:
+            ranking = future.result(timeout=max(remaining, 0.0))
+        except FutureTimeout:
+            stages[stage] = 'timeout'
+            logger.info(f"Hybrid search skipped the {stage} stage: over its {budgets[stage]:.0f} ms budget")
+            continue
+        except Exception as e:
+            stages[stage] = 'error'
+            logger.warning(f"Hybrid search {stage} stage failed: {e}")
+            continue
+        if stage == 'semantic' and genres:
+            # The embeddings know nothing of genres; filter with the genre bitmaps
+            ranking = genre_index.select(ranking, genres, genre_mode)
+        stages[stage] = 'ok'
+        rankings.append(ranking)
+
+    fused = reciprocal_rank_fusion(rankings, limit=limit)
+    books = book_search.load([book_id for book_id, _ in fused])
+    scores = dict(fused)
+    return books, [scores[book.id] for book in books], stages
@@ -0,0 +1,168 @@
+"""
+Mood lexicon and the book_moods index
+
+A search that mentions a mood ("something cozy", "a thrilling page-turner") also finds
+books whose text uses any word of that mood. Words are matched as substrings of the
+lowercased text, so "warm" also finds "warmth". The lexicon is compiled once into one
+trie-shaped regex that finds every lexicon word in a string in a single pass.
+
+Books are tagged with their moods (from title, author, genres and description) when
+they are written: a session hook re-tags every book a flush inserts or whose text it
+changes, so admin forms, CSV and Goodreads imports and seeding need no extra code. A
+full retrain re-tags the whole catalog, picking up lexicon changes. A mood search is
+then an index range scan of book_moods instead of LIKE scans of every book.
+"""
+import logging
+import re
+from collections import defaultdict
+from sqlalchemy import delete, event, func, insert, inspect, select
+from extensions import db
+from models.book_model import Book
+from models.mood_model import BookMood
+
+logger = logging.getLogger(__name__)
+
+# mood -> words that signal it; the mood's name counts as one of them
+MOOD_LEXICON = {
+    'cozy': ['cozy', 'comfort', 'heartwarming', 'warm', 'gentle', 'wholesome', 'feel-good'],
+    'thrilling': ['thrilling', 'suspense', 'fast-paced', 'tense', 'gripping', 'page-turner'],
+    'thought-provoking': ['thought', 'philosophy', 'reflective', 'introspective', 'provocative', 'contemplative'],
+    'light & funny': ['humor', 'funny', 'witty', 'lighthearted', 'comedy', 'hilarious', 'satirical'],
+    'sad': ['sad', 'melancholic', 'melancholy', 'grief', 'poignant', 'somber', 'tragic', 'heartbreaking', 'tear-jerker'],
+    'happy': ['happy', 'joyful', 'cheerful', 'uplifting', 'feel-good'],
+    'hopeful': ['hopeful', 'optimistic', 'inspiring', 'encouraging', 'uplifting'],
+    'adventurous': ['adventurous', 'exciting', 'exploration', 'quest', 'voyage'],
+    'romantic': ['romantic', 'love', 'heartfelt', 'passionate'],
+    'calm': ['calm', 'relaxing', 'soothing', 'tranquil', 'peaceful', 'serene'],
+    'anxious': ['anxious', 'nervous', 'uneasy', 'tense', 'worry'],
+    'angry': ['angry', 'rage', 'furious', 'vengeful', 'wrath'],
+    'dark': ['dark', 'gritty', 'bleak', 'noir', 'grim'],
+    'inspiring': ['inspiring', 'motivational', 'uplifting', 'encouraging', 'empowering'],
+    'nostalgic': ['nostalgic', 'nostalgia', 'wistful', 'sentimental'],
+}
+
+# Book columns a mood word is looked for in
+MOOD_COLUMNS = ('title', 'author', 'genres', 'description')
+
+# Books read per query when re-tagging the catalog
+_TAG_CHUNK = 2000
+
+
+def _trie_pattern(words):
+    """Regex matching the longest of `words` that starts at the current position"""
+    trie = {}
+    for word in words:
+        node = trie
+        for ch in word:
+            node = node.setdefault(ch, {})
+        node[''] = {}
+
+    def build(node):
+        branches = [re.escape(ch) + build(child) for ch, child in sorted(node.items()) if ch]
+        if not branches:
+            return ''
+        body = branches[0] if len(branches) == 1 else f"(?:{'|'.join(branches)})"
+        # Greedy, so a word that continues into a longer one matches the longer one
+        return f'(?:{body})?' if '' in node else body
+
+    return build(trie)
+
+
+def _compile(lexicon):
+    moods_by_word = defaultdict(set)
+    for mood, words in lexicon.items():
+        for word in [mood, *words]:
+            moods_by_word[word].add(mood)
+    # Only the longest word starting at a position is reported, so it carries the moods of
+    # the shorter words it starts with ("warmth" hits "warm")
+    folded = {
+        word: frozenset().union(*(moods for prefix, moods in moods_by_word.items() if word.startswith(prefix)))
+        for word in moods_by_word
+    }
+    # A lookahead matches without consuming, so overlapping words are all found
+    return re.compile(f'(?=({_trie_pattern(folded)}))'), folded
+
+
+_MATCHER, _MOODS_BY_WORD = _compile(MOOD_LEXICON)
+
+
+def moods_in(text):
+    """Set of moods whose words occur in `text` (case-insensitive)"""
+    if not text:
+        return set()
+    return {mood for match in _MATCHER.finditer(text.lower()) for mood in _MOODS_BY_WORD[match.group(1)]}
+
+
+def book_moods(book):
+    """Moods a book is tagged with; `book` is a Book or a row with the MOOD_COLUMNS"""
+    # Columns are matched separately, so no word spans two of them
+    return moods_in('\n'.join(getattr(book, name) or '' for name in MOOD_COLUMNS))
+
+
+def tag_all_books(progress=None):
+    """Re-tag every book, in chunks of one transaction each; returns the number of books
+
+    Must be called inside an app context. `progress(stage, done, total)` receives 'moods'
+    counters as in retrain.
+    """
+    total = db.session.query(func.count(Book.id)).scalar() or 0
+    columns = [getattr(Book, name) for name in MOOD_COLUMNS]
+    last_id, done = 0, 0
+    while True:
+        rows = db.session.execute(
+            select(Book.id, *columns).where(Book.id > last_id).order_by(Book.id).limit(_TAG_CHUNK)
+        ).all()
+        high = rows[-1].id if rows else None
+        # Tags of this id range (including deleted books) are replaced as a whole
+        stale = BookMood.book_id > last_id
+        if high is not None:
+            stale = stale & (BookMood.book_id <= high)
+        db.session.execute(delete(BookMood).where(stale))
+        tags = [{'mood': mood, 'book_id': row.id} for row in rows for mood in book_moods(row)]
+        if tags:
+            db.session.execute(insert(BookMood), tags)
+        db.session.commit()
+        if high is None:
+            break
+        last_id, done = high, done + len(rows)
+        if progress is not None:
+            progress('moods', done, total)
+    return done
+
+
+def _tag_flushed_books(session, flush_context):
+    """Re-tag the books a flush inserted or changed the text of"""
+    books = [obj for obj in session.new if isinstance(obj, Book)]
+    for obj in session.dirty:
+        if isinstance(obj, Book) and obj not in session.deleted:
+            state = inspect(obj)
+            if any(state.attrs[name].history.has_changes() for name in MOOD_COLUMNS):
+                books.append(obj)
+    if not books:
+        return
+    session.execute(delete(BookMood).where(BookMood.book_id.in_([book.id for book in books])))
+    tags = [{'mood': mood, 'book_id': book.id} for book in books for mood in book_moods(book)]
+    if tags:
+        session.execute(insert(BookMood), tags)
+
+
+class MoodIndex:
+    """Keeps book_moods in step with books"""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Install the session hook and tag the catalog if it was never tagged; call after create_all"""
+        app.extensions['mood_index'] = self
+        if not event.contains(db.session, 'after_flush', _tag_flushed_books):
+            event.listen(db.session, 'after_flush', _tag_flushed_books)
+        with app.app_context():
+            if db.session.query(BookMood.book_id).first() is None and db.session.query(Book.id).first() is not None:
+                count = tag_all_books()
+                logger.info(f"Tagged moods of {count} books")
+
+
+# One instance per process, set up in create_app after the tables exist
+mood_index = MoodIndex()
@@ -0,0 +1,232 @@
+"""
+In-memory typeahead over book titles and authors
+
+Titles and authors are normalized (lowercase, accents stripped, punctuation folded to
+spaces). Every word-start suffix of each becomes a key: "the hunger games" gives "the
+hunger games", "hunger games" and "games". A typed prefix then matches anywhere a word
+starts, across words ("hunger ga"). The keys sit in one sorted list, and a prefix is a
+contiguous range of it found with two binary searches. Within the range, books rank by
+ratings_count (fixed when the index is built). Completions of prefixes with long ranges
+are precomputed, so no keystroke sorts more than a few hundred keys.
+
+Each worker builds the index on first use. It rebuilds in the background, serving the
+old index meanwhile, when:
+- the worker wrote new or renamed books (e.g. an import)
+- a retrain published a new model version
+- TYPEAHEAD_REFRESH seconds have passed (for other workers' writes)
+"""
+import logging
+import re
+import threading
+import time
+import unicodedata
+from bisect import bisect_left
+from itertools import chain
+import numpy as np
+from sqlalchemy import event, inspect, select
+from config import Config
+from extensions import db
+from models.book_model import Book
+
+logger = logging.getLogger(__name__)
+
+# Characters of a key kept; longer prefixes are cut to this before the lookup
+_KEY_LENGTH = 48
+
+# Prefixes with more keys than this get their completions precomputed
+_PRECOMPUTE_RANGE = 256
+
+# Larger ranges are narrowed with argpartition before sorting
+_SORT_LIMIT = 2048
+
+_NON_WORD = re.compile(r'[\W_]+')
+
+
+def normalize(text):
+    """Lowercase, accent-free form of `text` with single spaces between words"""
+    text = (text or '').lower()
+    if not text.isascii():
+        text = ''.join(ch for ch in unicodedata.normalize('NFKD', text) if not unicodedata.combining(ch))
+    return _NON_WORD.sub(' ', text).strip()
+
+
+def _suffixes(text):
+    """Keys of a normalized text: the suffixes starting at each of its words"""
+    keys = [text[:_KEY_LENGTH]]
+    space = text.find(' ')
+    while space >= 0:
+        keys.append(text[space + 1:space + 1 + _KEY_LENGTH])
+        space = text.find(' ', space + 1)
+    return keys
+
+
+class _Snapshot:
+    """One built index; never changed after construction, so readers need no lock"""
+
+    def __init__(self, book_ids, titles, authors, ranks, keys, entries, version):
+        self.book_ids = book_ids  # book position -> id
+        self.titles = titles
+        self.authors = authors
+        self.keys = keys  # sorted
+        self.entries = entries  # key index -> book position
+        self.entry_ranks = ranks[entries]  # key index -> book rank (0 = most ratings)
+        self.version = version
+        self.built_at = time.monotonic()
+        self.top = {}  # short prefix -> precomputed book positions
+
+    def range(self, prefix):
+        lo = bisect_left(self.keys, prefix)
+        hi = bisect_left(self.keys, prefix + '\uffff', lo)
+        return lo, hi
+
+    def best(self, lo, hi, limit):
+        """Positions of the `limit` highest-ranked distinct books among keys lo:hi"""
+        ranks = self.entry_ranks[lo:hi]
+        take = min(len(ranks), _SORT_LIMIT)
+        while True:
+            if take < len(ranks):
+                order = np.argpartition(ranks, take - 1)[:take]
+                order = order[np.argsort(ranks[order], kind='stable')]
+            else:
+                order = np.argsort(ranks, kind='stable')
+            # A book can hold several keys in the range (title and author words)
+            found = list(dict.fromkeys(self.entries[lo + order].tolist()))
+            if len(found) >= limit or take >= len(ranks):
+                return found[:limit]
+            take = min(len(ranks), take * 4)
+
+
+class TypeaheadIndex:
+    """Prefix completions of book titles and authors, per worker"""
+
+    def __init__(self, app=None):
+        self.app = None
+        self.stale = True
+        self._snapshot = None
+        self._lock = threading.Lock()
+        self._building = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.extensions['typeahead_index'] = self
+        if not event.contains(db.session, 'after_flush', _mark_renamed_books):
+            event.listen(db.session, 'after_flush', _mark_renamed_books)
+
+    def build(self):
+        """Build a new snapshot from the books table; must be called inside an app context"""
+        started = time.perf_counter()
+        self.stale = False
+        version = _model_version()
+        rows = db.session.execute(
+            select(Book.id, Book.title, Book.author, Book.ratings_count).order_by(Book.id)
+        ).all()
+        book_ids = np.fromiter((row.id for row in rows), dtype=np.int64, count=len(rows))
+        counts = np.fromiter((row.ratings_count or 0 for row in rows), dtype=np.int64, count=len(rows))
+        ranks = np.empty(len(rows), dtype=np.int32)
+        ranks[np.argsort(-counts, kind='stable')] = np.arange(len(rows), dtype=np.int32)
+
+        pairs = []
+        for position, row in enumerate(rows):
+            for key in set(_suffixes(normalize(row.title)) + _suffixes(normalize(row.author))):
+                if key:
+                    pairs.append((key, position))
+        pairs.sort()
+        keys = [key for key, _ in pairs]
+        entries = np.fromiter((position for _, position in pairs), dtype=np.int32, count=len(pairs))
+        snapshot = _Snapshot(book_ids, [row.title for row in rows], [row.author for row in rows],
+                             ranks, keys, entries, version)
+
+        # Prefixes with long ranges are answered from a table, so a lookup never sorts more
+        # than _PRECOMPUTE_RANGE keys. Ranges of one length don't overlap, so the table holds
+        # at most len(keys) / _PRECOMPUTE_RANGE prefixes per length.
+        pending = [('', 0, len(keys))]
+        while pending:
+            prefix, lo, hi = pending.pop()
+            if prefix:
+                snapshot.top[prefix] = snapshot.best(lo, hi, Config.TYPEAHEAD_LIMIT)
+            depth = len(prefix)
+            if depth < _KEY_LENGTH:
+                # Keys equal to the prefix sort first; each next character opens a child range
+                start = bisect_left(keys, prefix + '\x00', lo, hi) if prefix else lo
+                while start < hi:
+                    child = keys[start][:depth + 1]
+                    end = bisect_left(keys, child + '\uffff', start, hi)
+                    if end - start > _PRECOMPUTE_RANGE:
+                        pending.append((child, start, end))
+                    start = end
+
+        self._snapshot = snapshot
+        logger.info(f"Typeahead index built: {len(rows)} books, {len(keys)} keys "
+                    f"in {time.perf_counter() - started:.2f}s")
+        return snapshot
+
+    def complete(self, text, limit=None):
+        """Up to `limit` books (id, title, author) whose title or author has a word starting with `text`"""
+        limit = min(limit or Config.TYPEAHEAD_LIMIT, Config.TYPEAHEAD_LIMIT)
+        prefix = normalize(text)[:_KEY_LENGTH]
+        snapshot = self._current()
+        if not prefix or snapshot is None:
+            return []
+        positions = snapshot.top.get(prefix)
+        if positions is None:
+            lo, hi = snapshot.range(prefix)
+            positions = snapshot.best(lo, hi, limit) if hi > lo else []
+        return [
+            {'id': int(snapshot.book_ids[p]), 'title': snapshot.titles[p], 'author': snapshot.authors[p]}
+            for p in positions[:limit]
+        ]
+
+    def _current(self):
+        """The snapshot to serve, building the first one in place and later ones in the background"""
+        snapshot = self._snapshot
+        if snapshot is None:
+            with self._lock:
+                if self._snapshot is None:
+                    self.build()
+                return self._snapshot
+        if self.stale or snapshot.version != _model_version() or \
+                time.monotonic() - snapshot.built_at >= Config.TYPEAHEAD_REFRESH:
+            self._rebuild_in_background()
+        return snapshot
+
+    def _rebuild_in_background(self):
+        with self._lock:
+            if self._building or self.app is None:
+                return
+            self._building = True
+        threading.Thread(target=self._rebuild, name='typeahead-rebuild', daemon=True).start()
+
+    def _rebuild(self):
+        try:
+            with self.app.app_context():
+                self.build()
+        except Exception as e:
+            logger.error(f"Rebuilding the typeahead index failed: {e}")
+        finally:
+            self._building = False
+
+
+def _model_version():
+    """Artifact version the resident recommender serves; a retrain changes it"""
+    from recommender.service import recommender_service
+    return recommender_service.version
+
+
+def _mark_renamed_books(session, flush_context):
+    """Flag the index for a rebuild when a flush adds, deletes or renames books"""
+    for obj in chain(session.new, session.deleted):
+        if isinstance(obj, Book):
+            typeahead_index.stale = True
+            return
+    for obj in session.dirty:
+        if isinstance(obj, Book):
+            state = inspect(obj)
+            if state.attrs.title.history.has_changes() or state.attrs.author.history.has_changes():
+                typeahead_index.stale = True
+                return
+
+
+# One instance per process, set up in create_app
+typeahead_index = TypeaheadIndex()
@@ -19,7 +19,7 @@ def seed_books():
     project_dir = Path(__file__).parent
     os.chdir(project_dir)
     
-    app = create_app()
+    app = create_app(preload_recommender=False)
     
     with app.app_context():
         # Check if books exist
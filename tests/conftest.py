@@ -0,0 +1,101 @@
+"""
+Shared pytest setup: the repository root on sys.path and an app fixture on a scratch database
+"""
+import sys
+from pathlib import Path
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    """Flask app on a fresh SQLite file with every table created, inside an app context
+
+    Config points at the same database and at an empty artifact directory, so code that
+    calls create_app() itself (builds, retrains) and background readers share them.
+    """
+    from flask import Flask
+    from config import Config
+    from extensions import db
+    # Every model, as in create_app, so relationships resolve and create_all sees all tables
+    from models import book_model, genre_model, job_model, mood_model, rating_model, recommendation_model, tag_model, user_model  # noqa: F401
+
+    uri = f"sqlite:///{(tmp_path / 'test.db').as_posix()}"
+    monkeypatch.setattr(Config, 'SQLALCHEMY_DATABASE_URI', uri)
+    monkeypatch.setattr(Config, 'ARTIFACTS_DIR', tmp_path / 'artifacts')
+    monkeypatch.setattr(Config, 'RETRAIN_LOG_DIR', tmp_path / 'logs')
+
+    app = Flask(__name__)
+    app.config.update(SQLALCHEMY_DATABASE_URI=uri, SQLALCHEMY_TRACK_MODIFICATIONS=False, SEARCH_FTS=True)
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+        db.engine.dispose()
+
+
+@pytest.fixture
+def publish_embeddings(app):
+    """Callable that publishes an artifact version of unit-length book embeddings; returns its store"""
+    import numpy as np
+    from recommender.artifacts import ArtifactStore
+    from recommender.vector_index import l2_normalize
+
+    def publish(book_ids, embeddings):
+        embeddings = l2_normalize(embeddings)
+        store = ArtifactStore.stage()
+        store.write_array('embeddings', embeddings)
+        store.write_array('book_ids', np.asarray(book_ids, dtype=np.int64))
+        store.update_manifest('embeddings', {'count': len(embeddings), 'dim': embeddings.shape[1], 'dtype': 'float32',
+                                             'normalized': True, 'quantization': 'none', 'vector_index': None})
+        store.publish()
+        return store
+    return publish
+
+
+@pytest.fixture
+def library(app):
+    """30 books, 6 users with 8 ratings each and a few likes/dislikes, in the app's database
+
+    Returns a namespace with `ratings` and `feedback` as {(user_id, book_id): value}.
+    """
+    from types import SimpleNamespace
+    import numpy as np
+    from extensions import db
+    from models.book_model import Book
+    from models.rating_model import Feedback, Rating
+    from models.user_model import User
+
+    rng = np.random.default_rng(7)
+    db.session.add_all(Book(id=i, title=f'Book {i}', author=f'Author {i % 7}', avg_rating=1 + (i * 37 % 40) / 10,
+                            ratings_count=i * 10) for i in range(1, 31))
+    db.session.add_all(User(id=i, username=f'user{i}', email=f'user{i}@example.com', password_hash='x')
+                       for i in range(1, 7))
+    ratings, feedback = {}, {}
+    for user_id in range(1, 7):
+        books = rng.choice(np.arange(1, 31), size=10, replace=False)
+        for book_id in books[:8]:
+            ratings[(user_id, int(book_id))] = int(rng.integers(1, 6))
+        for book_id in books[8:]:
+            feedback[(user_id, int(book_id))] = int(rng.integers(0, 2))
+    db.session.add_all(Rating(user_id=u, book_id=b, rating=r) for (u, b), r in ratings.items())
+    db.session.add_all(Feedback(user_id=u, book_id=b, is_like=v) for (u, b), v in feedback.items())
+    db.session.commit()
+    return SimpleNamespace(book_ids=np.arange(1, 31), user_ids=np.arange(1, 7), ratings=ratings, feedback=feedback)
+
+
+@pytest.fixture
+def trained(library, publish_embeddings):
+    """HybridRecommender loaded from a published version with the library's embeddings and CF matrix"""
+    import numpy as np
+    from recommender.hybrid_recommender import HybridRecommender
+    from recommender.retrain_model import build_cf_matrix
+
+    publish_embeddings(library.book_ids, np.random.default_rng(4).normal(size=(len(library.book_ids), 8)))
+    build_cf_matrix()
+    recommender = HybridRecommender()
+    recommender.load_artifacts()
+    return recommender
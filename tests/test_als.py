@@ -0,0 +1,65 @@
+"""
+ALS: preference/confidence matrices, training and fold-in
+"""
+import numpy as np
+from scipy import sparse
+from recommender.als import build_preferences, fold_in, train_als
+
+
+def _matrices():
+    # users x items: user 0 rated items 0 and 1, liked item 2; user 1 rated item 0 and disliked it
+    ratings = sparse.csr_matrix(np.array([[5, 2, 0, 0], [3, 0, 0, 0]], dtype=np.float32))
+    feedback = sparse.csr_matrix(np.array([[0, 0, 1, 0], [-1, 0, 0, 1]], dtype=np.float32))
+    return ratings, feedback
+
+
+def test_explicit_preferences_fill_feedback_as_stars():
+    preference, confidence = build_preferences(*_matrices(), implicit=False)
+    # A like counts as 5 stars, a dislike as 1; a rating wins over feedback on the same book
+    assert np.array_equal(preference.toarray(), [[5, 2, 5, 0], [3, 0, 0, 5]])
+    assert np.array_equal(confidence.toarray(), (preference.toarray() != 0).astype(np.float32))
+
+
+def test_implicit_preferences_and_confidence():
+    preference, confidence = build_preferences(*_matrices(), implicit=True, alpha=10.0)
+    stars = np.array([[5, 2, 5, 0], [3, 0, 0, 5]], dtype=np.float32)
+    observed = stars != 0
+    # Every observed cell is stored, negative preferences included
+    assert np.array_equal(preference.toarray() != 0, observed & (stars >= 3))
+    assert preference.nnz == confidence.nnz == observed.sum()
+    assert np.allclose(confidence.toarray()[observed], 1 + 10.0 * np.abs(stars[observed] - 3) / 2)
+    assert np.array_equal(preference.indices, confidence.indices)
+
+
+def test_explicit_als_reconstructs_low_rank_ratings():
+    rng = np.random.default_rng(0)
+    truth = rng.random((40, 2)) @ rng.random((2, 30)) * 2 + 1
+    preference, confidence = build_preferences(sparse.csr_matrix(truth), sparse.csr_matrix(truth.shape),
+                                               implicit=False)
+    user_factors, item_factors = train_als(preference, confidence, factors=4, iterations=15,
+                                           regularization=0.001, implicit=False, threads=2)
+    assert user_factors.shape == (40, 4) and item_factors.shape == (30, 4)
+    assert np.abs(user_factors @ item_factors.T - truth).max() < 0.05
+
+
+def test_fold_in_solves_the_normal_equations():
+    rng = np.random.default_rng(1)
+    item_factors = rng.standard_normal((6, 3)).astype(np.float32)
+    ratings = sparse.csr_matrix(np.array([[4, 0, 1, 0, 5, 0]], dtype=np.float32))
+    regularization = 0.1
+
+    preference, confidence = build_preferences(ratings, sparse.csr_matrix(ratings.shape), implicit=False)
+    vector = fold_in(item_factors, preference, confidence, regularization=regularization, implicit=False)[0]
+    Y = item_factors[[0, 2, 4]]
+    expected = np.linalg.solve(Y.T @ Y + regularization * 3 * np.eye(3), Y.T @ np.array([4, 1, 5]))
+    assert np.allclose(vector, expected, atol=1e-4)
+
+    preference, confidence = build_preferences(ratings, sparse.csr_matrix(ratings.shape), implicit=True, alpha=2.0)
+    vector = fold_in(item_factors, preference, confidence, regularization=regularization, implicit=True)[0]
+    c = np.ones(6)
+    c[[0, 2, 4]] = confidence.data
+    p = np.zeros(6)
+    p[[0, 2, 4]] = preference.data
+    Yc = item_factors.T * c
+    expected = np.linalg.solve(Yc @ item_factors + regularization * np.eye(3), Yc @ p)
+    assert np.allclose(vector, expected, atol=1e-4)
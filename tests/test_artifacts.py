@@ -0,0 +1,173 @@
+"""
+Artifact store: id lookups, memory-mapped arrays, sparse matrices, the manifest and published versions
+"""
+import os
+import numpy as np
+import pytest
+from scipy import sparse
+from recommender.artifacts import (ArtifactStore, IdIndex, current_version, list_versions, private_nbytes,
+                                  prune_versions, staged_version)
+from recommender.hybrid_recommender import HybridRecommender
+
+
+def test_id_index_lookups():
+    index = IdIndex(np.array([3, 8, 15, 42], dtype=np.int64))
+    assert len(index) == 4
+    assert index[15] == 2
+    assert 8 in index and 9 not in index and 100 not in index
+    assert index.get(1) is None and index.get(42) == 3
+    with pytest.raises(KeyError):
+        index[5]
+    assert list(index.positions([42, 5, 3, 100, 8])) == [3, 0, 1]
+    assert len(IdIndex(np.empty(0, dtype=np.int64)).positions([1])) == 0
+
+
+def test_arrays_are_memory_mapped(tmp_path):
+    store = ArtifactStore(tmp_path)
+    array = np.arange(12, dtype=np.float32).reshape(3, 4)
+    store.write_array('values', array)
+    assert store.has('values') and store.dirty
+    assert not list(tmp_path.glob('*.tmp'))
+
+    mapped = store.read_array('values')
+    assert isinstance(mapped, np.memmap)
+    assert not mapped.flags.writeable
+    assert np.array_equal(mapped, array)
+    assert private_nbytes(mapped) == 0
+    loaded = store.read_array('values', mmap=False)
+    assert not isinstance(loaded, np.memmap)
+    assert private_nbytes(loaded) == array.nbytes
+
+    store.remove('values')
+    assert not store.has('values')
+
+
+def test_create_array_commits_in_place(tmp_path):
+    store = ArtifactStore(tmp_path)
+    array = store.create_array('rows', (3, 2), np.float32)
+    array[:] = np.arange(6).reshape(3, 2)
+    assert not store.has('rows')
+    store.commit_array('rows', array)
+    assert np.array_equal(store.read_array('rows'), np.arange(6).reshape(3, 2))
+
+
+def test_create_array_keeps_the_rows_written(tmp_path):
+    store = ArtifactStore(tmp_path)
+    array = store.create_array('rows', (5, 2), np.float32)
+    array[:3] = np.arange(6).reshape(3, 2)
+    store.commit_array('rows', array, rows=3)
+    assert np.array_equal(store.read_array('rows'), np.arange(6).reshape(3, 2))
+    assert not list(tmp_path.glob('*.tmp'))
+
+
+def test_sparse_round_trip(tmp_path):
+    store = ArtifactStore(tmp_path)
+    matrix = sparse.random(20, 15, density=0.2, format='csr', dtype=np.float32, random_state=1)
+    shape = store.write_csr('m_csr', matrix)
+    assert shape == [20, 15]
+    store.write_csc('m_csc', matrix)
+    csr = store.read_csr('m_csr', shape)
+    csc = store.read_csc('m_csc', shape)
+    assert sparse.isspmatrix_csr(csr) and sparse.isspmatrix_csc(csc)
+    assert private_nbytes(csr.data) == 0
+    assert np.array_equal(csr.toarray(), matrix.toarray())
+    assert np.array_equal(csc.toarray(), matrix.toarray())
+
+
+def test_manifest_sections(tmp_path):
+    store = ArtifactStore(tmp_path)
+    assert store.read_manifest() == {'format': 1}
+    store.update_manifest('cf', {'shape': [2, 3]})
+    store.update_manifest('als', {'factors': 4})
+    assert store.read_manifest() == {'format': 1, 'cf': {'shape': [2, 3]}, 'als': {'factors': 4}}
+    store.update_manifest('als', None)
+    assert store.read_manifest() == {'format': 1, 'cf': {'shape': [2, 3]}}
+    # A fresh reader sees the same manifest
+    assert ArtifactStore(tmp_path).read_manifest() == store.read_manifest()
+
+
+def test_recommender_maps_artifacts(app, publish_embeddings):
+    rng = np.random.default_rng(0)
+    publish_embeddings([5, 9, 12, 20], rng.normal(size=(4, 8)))
+
+    recommender = HybridRecommender()
+    recommender.load_artifacts()
+    assert recommender.embeddings.shape == (4, 8)
+    assert recommender.books_index[12] == 2
+    assert recommender.memory_usage() == 0
+    assert recommender.mapped_usage() == recommender.embeddings.nbytes + recommender.book_ids.nbytes
+
+
+def _publish(base, **arrays):
+    store = ArtifactStore.stage(base)
+    for name, array in arrays.items():
+        store.write_array(name, array)
+    store.publish()
+    return store
+
+
+def test_stage_links_the_current_version(tmp_path):
+    first = _publish(tmp_path, embeddings=np.ones(4), book_ids=np.arange(4))
+    assert current_version(tmp_path) == first.version
+
+    staged = ArtifactStore.stage(tmp_path)
+    assert staged.staged and not staged.dirty
+    for name in ('embeddings', 'book_ids'):
+        assert os.stat(staged.path(f'{name}.npy')).st_ino == os.stat(first.path(f'{name}.npy')).st_ino
+    # Not visible to readers until published
+    assert current_version(tmp_path) == first.version
+    assert list_versions(tmp_path) == [first.version]
+
+    staged.write_array('embeddings', np.zeros(4))
+    staged.publish()
+    assert current_version(tmp_path) == staged.version
+    assert np.array_equal(ArtifactStore.current(tmp_path).read_array('embeddings'), np.zeros(4))
+    # Replaced files leave the published version (and its readers' mappings) untouched
+    assert np.array_equal(first.read_array('embeddings'), np.ones(4))
+    assert np.array_equal(ArtifactStore.current(tmp_path).read_array('book_ids'), np.arange(4))
+
+
+def test_publish_only_staged_versions(tmp_path):
+    with pytest.raises(RuntimeError):
+        ArtifactStore(tmp_path).publish()
+    staged = ArtifactStore.stage(tmp_path)
+    staged.discard()
+    assert not staged.root.exists()
+    assert current_version(tmp_path) is None
+
+
+def test_publish_prunes_old_versions(tmp_path):
+    versions = [_publish(tmp_path, values=np.full(2, i)).version for i in range(4)]
+    assert list_versions(tmp_path) == versions[-3:]
+    ArtifactStore.stage(tmp_path).publish(keep=1)
+    assert list_versions(tmp_path) == [current_version(tmp_path)]
+
+
+def test_prune_removes_abandoned_staging(tmp_path):
+    abandoned = ArtifactStore.stage(tmp_path)
+    fresh = ArtifactStore.stage(tmp_path)
+    old = abandoned.root.stat().st_mtime - 2 * 24 * 3600
+    os.utime(abandoned.root, (old, old))
+    prune_versions(tmp_path)
+    assert not abandoned.root.exists() and fresh.root.exists()
+
+
+def test_staged_version_publishes_only_changes(app):
+    with staged_version() as store:
+        pass
+    assert current_version() is None and not store.root.exists()
+
+    with pytest.raises(ValueError):
+        with staged_version() as store:
+            store.write_array('values', np.arange(3))
+            raise ValueError('build failed')
+    assert current_version() is None and not store.root.exists()
+
+    with staged_version() as store:
+        store.write_array('values', np.arange(3))
+    assert current_version() == store.version
+
+    given = ArtifactStore.stage()
+    with staged_version(given) as store:
+        store.write_array('values', np.arange(4))
+    assert store is given and store.staged
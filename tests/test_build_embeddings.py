@@ -0,0 +1,116 @@
+"""
+Embedding build: incremental re-encoding of new and changed books
+"""
+import functools
+import numpy as np
+import pytest
+from sqlalchemy import func
+from config import Config
+from extensions import db
+from models.book_model import Book
+from recommender import build_embeddings
+from recommender.artifacts import ArtifactStore, current_version, staged_version
+from recommender.encoding import BatchEncoder
+
+
+class TextHashModel:
+    """Stand-in for a SentenceTransformer: a fixed vector per text, recording what it encodes"""
+
+    def __init__(self):
+        self.encoded = []
+
+    @staticmethod
+    def vector(text):
+        return np.random.default_rng(build_embeddings.content_hash(text)).normal(size=8).astype(np.float32)
+
+    def encode(self, texts, batch_size=32, show_progress_bar=False):
+        self.encoded += texts
+        return np.stack([self.vector(text) for text in texts])
+
+
+@pytest.fixture
+def model(app, monkeypatch):
+    monkeypatch.setattr(Config, 'EMBEDDING_QUANTIZATION', 'none')
+    monkeypatch.setattr(Config, 'VECTOR_INDEX_TYPE', 'none')
+    monkeypatch.setattr(Config, 'RETRAIN_CHUNK_SIZE', 4)
+    model = TextHashModel()
+    monkeypatch.setattr(build_embeddings, 'BatchEncoder', functools.partial(BatchEncoder, model=model, workers=1))
+    db.session.add_all(Book(id=i, title=f'Book {i}', author=f'Author {i}', description=f'About {i}')
+                       for i in range(1, 11))
+    db.session.commit()
+    return model
+
+
+def _build(app, full=False):
+    count, max_id = db.session.query(func.count(Book.id), func.max(Book.id)).one()
+    db.session.rollback()
+    with staged_version() as store:
+        build_embeddings._write_embeddings(app, store, count, max_id, full, None)
+
+
+def _texts():
+    return {book.id: build_embeddings.book_text(book) for book in Book.query.order_by(Book.id)}
+
+
+def _check_published():
+    store = ArtifactStore.current()
+    texts = _texts()
+    assert list(store.read_array('book_ids')) == list(texts)
+    expected = np.stack([TextHashModel.vector(text) for text in texts.values()])
+    expected /= np.linalg.norm(expected, axis=1, keepdims=True)
+    assert np.allclose(store.read_array('embeddings'), expected, atol=1e-6)
+    assert store.read_manifest()['embeddings']['count'] == len(texts)
+
+
+def test_first_build_encodes_every_book(app, model):
+    _build(app)
+    assert sorted(model.encoded) == sorted(_texts().values())
+    _check_published()
+
+
+def test_rebuild_encodes_only_changed_books(app, model):
+    _build(app)
+    model.encoded = []
+    db.session.get(Book, 3).description = 'A new description'
+    db.session.delete(db.session.get(Book, 5))
+    db.session.add(Book(id=11, title='Book 11', author='Author 11'))
+    db.session.commit()
+
+    _build(app)
+    texts = _texts()
+    assert sorted(model.encoded) == sorted([texts[3], texts[11]])
+    _check_published()
+
+
+def test_unchanged_rebuild_publishes_nothing(app, model):
+    _build(app)
+    version = current_version()
+    model.encoded = []
+    _build(app)
+    assert model.encoded == []
+    assert current_version() == version
+
+
+def test_full_rebuild_encodes_every_book(app, model):
+    _build(app)
+    model.encoded = []
+    _build(app, full=True)
+    assert sorted(model.encoded) == sorted(_texts().values())
+    _check_published()
+
+
+def test_new_books_are_appended_to_the_index(app, model, monkeypatch):
+    pytest.importorskip('faiss')
+    from recommender import vector_index
+    monkeypatch.setattr(Config, 'VECTOR_INDEX_TYPE', 'flat')
+    _build(app)
+    db.session.add_all(Book(id=i, title=f'Book {i}', author=f'Author {i}') for i in (11, 12))
+    db.session.commit()
+    _build(app)
+
+    store = ArtifactStore.current()
+    embeddings = store.read_array('embeddings')
+    index = vector_index.load_index(store.path(build_embeddings.VECTOR_INDEX_FILE))
+    assert index.ntotal == len(embeddings) == 12
+    _, positions = index.search(embeddings[-2:], 1)
+    assert list(positions[:, 0]) == [10, 11]
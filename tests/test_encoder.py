@@ -0,0 +1,70 @@
+"""
+Query encoder: normalized cache keys, LRU eviction and batched misses
+"""
+import numpy as np
+import pytest
+from recommender.encoder import QueryEncoder, normalize_query
+
+
+class CountingModel:
+    """Stands in for the SentenceTransformer: a fixed vector per text, and a log of each forward pass"""
+
+    def __init__(self):
+        self.calls = []
+
+    def encode(self, texts, **kwargs):
+        self.calls.append(list(texts))
+        return np.array([[len(text), sum(map(ord, text)) % 97, 1.0] for text in texts], dtype=np.float32)
+
+
+@pytest.fixture
+def encoder():
+    encoder = QueryEncoder(model_name='test', cache_size=2)
+    encoder._model = CountingModel()
+    return encoder
+
+
+def test_normalize_query():
+    assert normalize_query('  Space   OPERA\n') == 'space opera'
+    assert normalize_query(42) == '42'
+
+
+def test_encode_caches_by_normalized_query(encoder):
+    first = encoder.encode('Space Opera')
+    again = encoder.encode('  space   opera ')
+    assert again is first
+    assert not first.flags.writeable
+    assert encoder.model.calls == [['space opera']]
+    assert encoder.stats()['hits'] == 1 and encoder.stats()['misses'] == 1
+
+
+def test_lru_eviction(encoder):
+    encoder.encode('a')
+    encoder.encode('b')
+    encoder.encode('a')  # 'b' is now least recently used
+    encoder.encode('c')
+    stats = encoder.stats()
+    assert stats['size'] == 2 and stats['evictions'] == 1
+    encoder.encode('a')
+    encoder.encode('b')
+    assert encoder.model.calls == [['a'], ['b'], ['c'], ['b']]
+
+
+def test_encode_batch_shares_one_forward_pass_for_misses(encoder):
+    cached = encoder.encode('dune')
+    vectors = encoder.encode_batch(['Dune', 'hobbit', 'HOBBIT', 'emma'])
+    assert vectors.shape == (4, 3) and vectors.dtype == np.float32
+    assert np.array_equal(vectors[0], cached)
+    assert np.array_equal(vectors[1], vectors[2])
+    # Duplicates and cached queries are not encoded again
+    assert encoder.model.calls == [['dune'], ['hobbit', 'emma']]
+    assert np.array_equal(encoder.encode_batch(['emma'])[0], encoder.model.encode(['emma'])[0])
+
+
+def test_cache_disabled():
+    encoder = QueryEncoder(model_name='test', cache_size=0)
+    encoder._model = CountingModel()
+    encoder.encode('x')
+    encoder.encode('x')
+    assert len(encoder.model.calls) == 2 and encoder.stats()['size'] == 0
+    assert encoder.encode_batch([]).shape == (0, 0)
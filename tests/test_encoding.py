@@ -0,0 +1,61 @@
+"""
+Encoding pipeline: token-budget batching and order-preserving batch encoding
+"""
+import numpy as np
+from recommender import encoding
+from recommender.encoding import BatchEncoder, encode_texts, estimate_tokens, token_batches
+
+
+class LengthModel:
+    """Stand-in for a SentenceTransformer: embeds a text as (len, 1), recording batch sizes"""
+
+    def __init__(self):
+        self.batches = []
+
+    def encode(self, texts, batch_size=32, show_progress_bar=False):
+        self.batches.append(len(texts))
+        return np.array([[len(text), 1.0] for text in texts])
+
+
+def test_estimate_tokens():
+    assert estimate_tokens('') == 2
+    assert estimate_tokens('x' * 40) == 12
+    assert estimate_tokens('x' * 10000, max_tokens=256) == 256
+
+
+def test_token_batches_respect_the_budget():
+    texts = ['x' * n for n in np.random.default_rng(0).integers(0, 1200, size=300)]
+    batches = token_batches(texts, token_budget=1024)
+    assert sorted(np.concatenate(batches)) == list(range(len(texts)))
+    lengths = [estimate_tokens(text) for text in texts]
+    padded = [lengths[batch[0]] * len(batch) for batch in batches]
+    assert all(tokens <= 1024 for tokens in padded)
+    # Longest first, each batch padded to its first text
+    assert all(lengths[batch[0]] == max(lengths[i] for i in batch) for batch in batches)
+    assert [lengths[batch[0]] for batch in batches] == sorted((lengths[batch[0]] for batch in batches), reverse=True)
+
+
+def test_token_batches_cap_the_batch_size():
+    batches = token_batches([''] * 1000, token_budget=10 ** 6)
+    assert [len(batch) for batch in batches] == [encoding.MAX_BATCH_SIZE] * 3 + [1000 - 3 * encoding.MAX_BATCH_SIZE]
+    # A text longer than the budget still gets a batch of its own
+    assert [list(batch) for batch in token_batches(['x' * 2000], token_budget=10)] == [[0]]
+
+
+def test_batch_encoder_keeps_input_order():
+    model = LengthModel()
+    texts = ['a' * n for n in (5, 300, 40, 900, 1, 120)]
+    with BatchEncoder(model=model, workers=1, token_budget=300) as encoder:
+        embeddings = encoder.encode(texts)
+    assert len(model.batches) > 1
+    expected = np.array([[len(text), 1.0] for text in texts])
+    expected /= np.linalg.norm(expected, axis=1, keepdims=True)
+    assert embeddings.dtype == np.float32
+    assert np.allclose(embeddings, expected)
+    assert encoder.encoded == len(texts) and encoder.batches == len(model.batches)
+
+
+def test_encode_texts():
+    embeddings = encode_texts(['one', 'three'], model=LengthModel(), workers=1)
+    assert np.allclose(np.linalg.norm(embeddings, axis=1), 1.0)
+    assert encode_texts([], model=LengthModel(), workers=1).shape == (0, 0)
@@ -0,0 +1,76 @@
+"""
+Full-text search: FTS5 expressions, ranking and the LIKE fallback
+"""
+import pytest
+from extensions import db
+from models.book_model import Book
+from search.fts import BookSearch, match_expression, term_query
+
+
+def test_term_query_prefix_matches_every_word():
+    assert term_query('Harry  Pott') == '"harry"* AND "pott"*'
+    assert term_query('  ') is None
+    assert term_query('"; DROP') == '"drop"*'
+
+
+def test_match_expression_columns():
+    assert match_expression('dune') == '{title author genres} : ("dune"*)'
+    assert match_expression('dune', description=True) == '{title author genres description} : ("dune"*)'
+    assert match_expression('!!') is None
+
+
+@pytest.fixture
+def search(app):
+    search = BookSearch(app)
+    if not search.enabled:
+        pytest.skip('SQLite without FTS5')
+    db.session.add_all([
+        Book(id=1, title='Harry Potter and the Chamber of Secrets', author='J.K. Rowling', avg_rating=4.4,
+             ratings_count=5000, genres='Fantasy'),
+        Book(id=2, title='Dune', author='Frank Herbert', avg_rating=4.3, ratings_count=4000,
+             genres='Science Fiction', description='A desert planet and a boy called Paul'),
+        Book(id=3, title='The Desert', author='Someone', avg_rating=3.0, ratings_count=10),
+        Book(id=4, title='Potter Studies', author='A. Critic', avg_rating=2.0, ratings_count=1,
+             description='Essays about Harry'),
+    ])
+    db.session.commit()
+    return search
+
+
+def test_prefix_words_match_in_any_column(search):
+    assert [book.id for book in search.search('harr pott')] == [1]
+    assert [book.id for book in search.search('herbert')] == [2]
+    assert search.search('') == []
+
+
+def test_description_only_with_flag(search):
+    assert [book.id for book in search.search('desert')] == [3]
+    assert {book.id for book in search.search('desert', description=True)} == {2, 3}
+
+
+def test_title_hits_outrank_description_hits(search):
+    assert [book.id for book in search.search('harry', description=True)] == [1, 4]
+    assert [book.id for book in search.search('potter', description=True)][0] == 1
+
+
+def test_triggers_keep_the_index_current(search):
+    book = db.session.get(Book, 3)
+    book.title = 'The Oasis'
+    db.session.commit()
+    assert search.search('desert') == []
+    assert [b.id for b in search.search('oasis')] == [3]
+    db.session.delete(book)
+    db.session.commit()
+    assert search.search('oasis') == []
+
+
+def test_like_fallback_finds_the_same_books(search):
+    expected = {book.id for book in search.search('dune')}
+    search.enabled = False
+    assert {book.id for book in search.search('dune')} == expected
+
+
+def test_search_ids_follow_search_order(search):
+    books = search.search('harry', description=True)
+    assert search.search_ids('harry', description=True) == [book.id for book in books]
+    assert [book.id for book in BookSearch.load([4, 99, 1])] == [4, 1]
@@ -0,0 +1,120 @@
+"""
+Genres: key normalization, the book_genres junction and facet bitmaps
+"""
+from collections import Counter
+import pytest
+from sqlalchemy import event
+from extensions import db
+from models.book_model import Book
+from models.genre_model import BookGenre, Genre
+from search.genres import (GenreIndex, _bitmap, _index_flushed_books, genre_filter, genre_key, index_all_genres,
+                           split_genres)
+
+GENRES = {
+    1: 'Fiction; Science Fiction',
+    2: 'fiction;  Fantasy ',
+    3: 'Science  Fiction',
+    4: None,
+    5: 'Fantasy; Young Adult; fantasy',
+}
+
+
+def test_genre_key():
+    assert genre_key('  Science   FICTION ') == 'science fiction'
+
+
+def test_split_genres():
+    assert split_genres('Fiction; science  fiction;;FICTION ; ') == {'fiction': 'Fiction', 'science fiction': 'science fiction'}
+    assert split_genres(None) == {} and split_genres(' ; ') == {}
+
+
+def test_bitmap():
+    assert _bitmap([0, 3, 9], 10) == 0b1000001001
+    assert _bitmap([], 0) == 0
+
+
+@pytest.fixture
+def catalog(app):
+    db.session.add_all(Book(id=book_id, title=f'Book {book_id}', author='A', genres=genres)
+                       for book_id, genres in GENRES.items())
+    db.session.commit()
+    assert index_all_genres() == len(GENRES)
+    return app
+
+
+def _expected(book_ids, keys, mode='any'):
+    match = all if mode == 'all' else any
+    return [b for b in book_ids if match(key in split_genres(GENRES[b]) for key in keys)]
+
+
+def test_index_all_genres_links_each_genre_once(catalog):
+    names = {genre.key: genre.name for genre in Genre.query}
+    assert names == {'fiction': 'Fiction', 'science fiction': 'Science Fiction', 'fantasy': 'Fantasy',
+                     'young adult': 'Young Adult'}
+    links = Counter(link.book_id for link in BookGenre.query)
+    assert links == {1: 2, 2: 2, 3: 1, 5: 2}
+
+
+@pytest.mark.parametrize('genres, mode', [
+    (['fiction'], 'any'),
+    (['Fiction', 'fantasy'], 'any'),
+    (['fiction', 'FANTASY'], 'all'),
+    (['science fiction', 'young adult'], 'all'),
+    (['poetry'], 'any'),
+])
+def test_filter_and_select_match_whole_genres(catalog, genres, mode):
+    keys = [genre_key(g) for g in genres]
+    expected = _expected(sorted(GENRES), keys, mode)
+    found = [book.id for book in Book.query.filter(genre_filter(genres, mode)).order_by(Book.id)]
+    assert found == expected
+
+    index = GenreIndex()
+    index.load()
+    assert index.select([5, 4, 3, 2, 1, 99], genres, mode) == _expected([5, 4, 3, 2, 1], keys, mode)
+
+
+def test_facets_count_genres_over_results(catalog):
+    index = GenreIndex()
+    index.load()
+    assert index.facets() == [('Fantasy', 2), ('Fiction', 2), ('Science Fiction', 2), ('Young Adult', 1)]
+    # Unknown ids and books without genres are ignored
+    assert index.facets([1, 3, 4, 99]) == [('Science Fiction', 2), ('Fiction', 1)]
+    assert index.facets([2, 5], limit=1) == [('Fantasy', 2)]
+    assert index.facets([]) == []
+
+
+def test_flush_hook_relinks_changed_books(catalog):
+    event.listen(db.session, 'after_flush', _index_flushed_books)
+    try:
+        db.session.get(Book, 1).genres = 'Poetry'
+        db.session.add(Book(id=6, title='Book 6', author='A', genres='Fiction'))
+        db.session.commit()
+    finally:
+        event.remove(db.session, 'after_flush', _index_flushed_books)
+    index = GenreIndex()
+    index.load()
+    assert index.facets([1, 6]) == [('Fiction', 1), ('Poetry', 1)]
+    assert [book.id for book in Book.query.filter(genre_filter(['fiction'])).order_by(Book.id)] == [2, 6]
+
+
+def test_rarest_genre(catalog):
+    index = GenreIndex()
+    index.load()
+    assert index.rarest(['Fiction', 'young adult']) == 'young adult'
+    assert index.rarest(['fiction', 'poetry']) == 'poetry'
+
+
+@pytest.mark.parametrize('genres', [['fiction', 'science fiction'], ['Fantasy', 'fiction'], ['fantasy', 'poetry']])
+def test_all_genres_search_intersects_bitmaps(catalog, monkeypatch, genres):
+    from search import fts
+    from search.fts import BookSearch
+    index = GenreIndex()
+    index.load()
+    monkeypatch.setattr(fts, 'genre_index', index)
+    monkeypatch.setattr(fts, '_INTERSECT_BATCH', 2)
+    search = BookSearch()
+    search.enabled = False
+    expected = _expected(sorted(GENRES), [genre_key(g) for g in genres], 'all')
+    assert sorted(search.search_ids(genres=genres, genre_mode='all')) == expected
+    assert sorted(book.id for book in search.search(genres=genres, genre_mode='all')) == expected
+    assert len(search.search_ids(genres=genres, genre_mode='all', limit=1)) == min(len(expected), 1)
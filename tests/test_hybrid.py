@@ -0,0 +1,73 @@
+"""
+Hybrid search: reciprocal rank fusion and per-stage budgets
+"""
+import time
+from types import SimpleNamespace
+import pytest
+from config import Config
+from extensions import db
+from models.book_model import Book
+from search import hybrid
+from search.hybrid import hybrid_search, reciprocal_rank_fusion
+
+
+def test_rrf_scores():
+    fused = dict(reciprocal_rank_fusion([[1, 2, 3], [3, 1]], k=60))
+    assert fused[1] == pytest.approx(1 / 61 + 1 / 62)
+    assert fused[2] == pytest.approx(1 / 62)
+    assert fused[3] == pytest.approx(1 / 63 + 1 / 61)
+
+
+def test_rrf_order_and_ties():
+    # 1 and 3 appear in both lists; 2 and 4 tie and keep first-seen order
+    fused = reciprocal_rank_fusion([[1, 2, 3], [3, 4, 1]], k=60)
+    assert [book_id for book_id, _ in fused] == [1, 3, 2, 4]
+    assert [book_id for book_id, _ in reciprocal_rank_fusion([[1, 2, 3], [3, 4, 1]], k=60, limit=2)] == [1, 3]
+
+
+def test_rrf_edge_cases():
+    assert reciprocal_rank_fusion([]) == []
+    assert reciprocal_rank_fusion([[], [5]], k=0) == [(5, 1.0)]
+    assert [book_id for book_id, _ in reciprocal_rank_fusion([[7, 8]])] == [7, 8]
+
+
+@pytest.fixture
+def books(app):
+    db.session.add_all(Book(id=i, title=f'Book {i}', author='A') for i in range(1, 6))
+    db.session.commit()
+    return app
+
+
+def _stages(monkeypatch, lexical, semantic, semantic_delay=0.0):
+    monkeypatch.setattr(hybrid, '_lexical', lambda app, q, genres, genre_mode, n: lexical)
+
+    def slow_semantic(recommender, q, n):
+        time.sleep(semantic_delay)
+        return semantic
+    monkeypatch.setattr(hybrid, '_semantic', slow_semantic)
+    return SimpleNamespace(embeddings=object())
+
+
+def test_hybrid_search_fuses_both_stages(books, monkeypatch):
+    recommender = _stages(monkeypatch, lexical=[1, 2, 3], semantic=[4, 3])
+    found, scores, stages = hybrid_search('q', recommender, limit=3)
+    assert stages == {'lexical': 'ok', 'semantic': 'ok'}
+    assert [book.id for book in found] == [3, 1, 4]
+    assert scores == sorted(scores, reverse=True)
+
+
+def test_hybrid_search_skips_a_stage_over_budget(books, monkeypatch):
+    monkeypatch.setattr(Config, 'HYBRID_SEMANTIC_BUDGET_MS', 50)
+    recommender = _stages(monkeypatch, lexical=[2, 1], semantic=[5], semantic_delay=0.5)
+    started = time.monotonic()
+    found, _, stages = hybrid_search('q', recommender)
+    assert time.monotonic() - started < 0.4
+    assert stages == {'lexical': 'ok', 'semantic': 'timeout'}
+    assert [book.id for book in found] == [2, 1]
+
+
+def test_hybrid_search_without_embeddings(books, monkeypatch):
+    _stages(monkeypatch, lexical=[4], semantic=[5])
+    found, _, stages = hybrid_search('q', recommender=None)
+    assert stages == {'lexical': 'ok', 'semantic': 'unavailable'}
+    assert [book.id for book in found] == [4]
@@ -0,0 +1,186 @@
+"""
+HybridRecommender: top-k selection, embedding scoring, result hydration and batch scoring
+"""
+import numpy as np
+import pytest
+from sqlalchemy import event
+from config import Config
+from extensions import db
+from models.book_model import Book
+from recommender.artifacts import IdIndex
+from recommender.hybrid_recommender import (HybridRecommender, _mask_rows, prepare_embeddings, top_k_indices,
+                                            top_k_rows)
+
+
+def _full_sort(scores, k, exclude=()):
+    order = [i for i in np.argsort(-scores, kind='stable') if i not in set(exclude)]
+    return np.array(order[:k], dtype=np.int64)
+
+
+@pytest.mark.parametrize('k', [1, 5, 50, 200])
+def test_top_k_indices_matches_a_full_sort(k):
+    scores = np.random.default_rng(k).random(100).astype(np.float32)
+    top, top_scores = top_k_indices(scores.copy(), k)
+    assert np.array_equal(top, _full_sort(scores, k))
+    assert np.array_equal(top_scores, scores[top])
+
+
+def test_top_k_indices_excludes():
+    scores = np.random.default_rng(1).random(20).astype(np.float32)
+    exclude = np.array([int(np.argmax(scores)), 3, 3])
+    top, _ = top_k_indices(scores.copy(), 19, exclude)
+    assert np.array_equal(top, _full_sort(scores, 19, exclude))
+    assert len(top) == 18
+    assert len(top_k_indices(scores.copy(), 0)[0]) == 0
+
+
+def test_prepare_embeddings_normalizes_rows():
+    prepared = prepare_embeddings(np.array([[3.0, 4.0], [1.0, 0.0]]))
+    assert prepared.dtype == np.float32 and prepared.flags['C_CONTIGUOUS']
+    assert np.allclose(np.linalg.norm(prepared, axis=1), 1.0)
+    unit = np.eye(2, dtype=np.float32)
+    assert prepare_embeddings(unit) is unit
+
+
+@pytest.fixture
+def recommender():
+    rng = np.random.default_rng(2)
+    recommender = HybridRecommender()
+    recommender.embeddings = prepare_embeddings(rng.normal(size=(50, 8)))
+    recommender.book_ids = np.arange(1, 51, dtype=np.int64) * 10
+    recommender.books_index = IdIndex(recommender.book_ids)
+    return recommender
+
+
+def test_score_by_text_ranks_by_cosine(recommender):
+    query = np.random.default_rng(3).normal(size=8) * 7  # any length
+    ids, scores = recommender.score_by_text(query, top_k=5, exclude_ids=[10, 999])
+    cosine = recommender.embeddings @ (query / np.linalg.norm(query))
+    expected = _full_sort(cosine, 5, exclude=[0])
+    assert np.array_equal(ids, recommender.book_ids[expected])
+    assert np.allclose(scores, cosine[expected], atol=1e-6)
+
+
+def test_score_similar_books(recommender):
+    ids, scores = recommender.score_similar_books(30, top_k=4)
+    cosine = recommender.embeddings @ recommender.embeddings[2]
+    assert np.array_equal(ids, recommender.book_ids[_full_sort(cosine, 4, exclude=[2])])
+    assert len(recommender.score_similar_books(12345)[0]) == 0
+    assert len(HybridRecommender().score_by_text(np.ones(8))[0]) == 0
+
+
+@pytest.fixture
+def books(app):
+    db.session.add_all(Book(id=i, title=f'Book {i}', author=f'Author {i}', genres='Fiction' if i % 2 else None)
+                       for i in range(1, 8))
+    db.session.commit()
+    return app
+
+
+def _count_selects():
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT'):
+            statements.append(statement)
+    event.listen(db.engine, 'before_cursor_execute', record)
+    return statements, lambda: event.remove(db.engine, 'before_cursor_execute', record)
+
+
+def test_hydrate_keeps_rank_order_in_one_query(books):
+    statements, stop = _count_selects()
+    try:
+        results = HybridRecommender().hydrate(np.array([5, 99, 2, 7]), np.array([0.9, 0.8, 0.5, 0.1], dtype=np.float32))
+    finally:
+        stop()
+    assert len(statements) == 1
+    # Unknown ids are skipped
+    assert [(r['id'], r['title'], r['author'], r['genres']) for r in results] == [
+        (5, 'Book 5', 'Author 5', 'Fiction'), (2, 'Book 2', 'Author 2', ''), (7, 'Book 7', 'Author 7', 'Fiction')]
+    assert [r['score'] for r in results] == pytest.approx([0.9, 0.5, 0.1])
+    assert all(type(r['score']) is float for r in results)
+    assert HybridRecommender().hydrate([], []) == []
+
+
+@pytest.mark.parametrize('k', [1, 7, 40])
+def test_top_k_rows_matches_a_full_sort(k):
+    scores = np.random.default_rng(k).random((6, 30)).astype(np.float32)
+    excludes = [np.array([], dtype=np.int64), np.array([0, 5]), np.arange(25), np.array([29])] * 2
+    expected = [_full_sort(row, k, exclude) for row, exclude in zip(scores, excludes)]
+    _mask_rows(scores, excludes[:6])
+    for (top, top_scores), row, want in zip(top_k_rows(scores, k), scores, expected):
+        # Excluded (-inf) entries are dropped, so rows can come back short
+        assert np.array_equal(top, want)
+        assert np.array_equal(top_scores, row[top])
+
+
+class MatrixEncoder:
+    """Stand-in query encoder: a fixed vector per query"""
+
+    def __init__(self, dim):
+        self.dim = dim
+
+    def encode_batch(self, queries):
+        return np.stack([np.random.default_rng(len(q)).normal(size=self.dim) for q in queries])
+
+
+@pytest.fixture(params=['means', 'item_knn', 'als'])
+def loaded(request, library, publish_embeddings, monkeypatch):
+    """Recommender over the library's embeddings and CF artifacts, scoring CF with each model"""
+    from recommender.retrain_model import build_cf_matrix, train_als_model
+    monkeypatch.setattr(Config, 'RECOMMEND_BATCH_CHUNK', 4)
+    monkeypatch.setattr(Config, 'CF_MODEL', request.param)
+    monkeypatch.setattr(Config, 'ALS_FACTORS', 4)
+    monkeypatch.setattr(Config, 'ALS_ITERATIONS', 2)
+    publish_embeddings(library.book_ids, np.random.default_rng(4).normal(size=(len(library.book_ids), 8)))
+    build_cf_matrix()
+    if request.param == 'als':
+        train_als_model()
+    recommender = HybridRecommender()
+    recommender.load_artifacts()
+    if request.param == 'means':
+        recommender.item_similarity = None
+    return recommender
+
+
+def _assert_same(batch, singles):
+    assert len(batch) == len(singles)
+    for (batch_ids, batch_scores), (ids, scores) in zip(batch, singles):
+        assert np.array_equal(batch_ids, ids)
+        assert np.allclose(batch_scores, scores, atol=1e-5)
+
+
+def test_batch_scores_match_single_calls(loaded):
+    users = [1, 2, 3, 4, 5, 6, 99]
+    books = [3, 12345, 17, 30, 1]
+    _assert_same(loaded.score_collaborative_batch(users, top_k=5),
+                 [loaded.score_collaborative(user_id, top_k=5) for user_id in users])
+    _assert_same(loaded.score_by_taste_batch(users, top_k=5),
+                 [loaded.score_by_taste(user_id, top_k=5) for user_id in users])
+    _assert_same(loaded.score_similar_books_batch(books, top_k=5),
+                 [loaded.score_similar_books(book_id, top_k=5) for book_id in books])
+    _assert_same(loaded.score_hybrid_batch(users, top_k=5),
+                 [loaded.score_hybrid(user_id=user_id, top_k=5) for user_id in users])
+    queries = np.random.default_rng(5).normal(size=(6, 8))
+    _assert_same(loaded.score_by_text_batch(queries, top_k=5),
+                 [loaded.score_by_text(query, top_k=5) for query in queries])
+
+
+def _assert_same_recommendations(batch, single):
+    assert [r['id'] for r in batch] == [r['id'] for r in single]
+    assert [r['score'] for r in batch] == pytest.approx([r['score'] for r in single], abs=1e-5)
+
+
+def test_recommend_batch_matches_single_calls(loaded):
+    encoder = MatrixEncoder(8)
+    results = loaded.recommend_batch(user_ids=[2, 5, 2], book_ids=[7, 8], queries=['dragons', 'a quiet sea'],
+                                     top_k=4, encoder=encoder)
+    assert list(results['users']) == [2, 5]
+    for user_id, recommendations in results['users'].items():
+        _assert_same_recommendations(recommendations, loaded.recommend_hybrid(user_id=user_id, top_k=4))
+    for book_id, recommendations in results['books'].items():
+        _assert_same_recommendations(recommendations, loaded.recommend_similar_books(book_id, top_k=4))
+    for query, recommendations in results['queries'].items():
+        expected = loaded.recommend_by_text(encoder.encode_batch([query])[0], top_k=4)
+        _assert_same_recommendations(recommendations, expected)
+    assert results['books'][7][0]['title'] == f"Book {results['books'][7][0]['id']}"
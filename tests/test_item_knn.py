@@ -0,0 +1,103 @@
+"""
+Item-based CF: similarity matrix, per-user and batch scoring, top-k selection
+"""
+import numpy as np
+import pytest
+from scipy import sparse
+from recommender import item_knn
+from recommender.hybrid_recommender import top_k_indices
+
+
+def _ratings(n_users=30, n_items=20, density=0.3, seed=0):
+    rng = np.random.default_rng(seed)
+    dense = rng.integers(1, 6, size=(n_users, n_items)) * (rng.random((n_users, n_items)) < density)
+    return sparse.csr_matrix(dense.astype(np.float32))
+
+
+def _dense_similarity(matrix, adjusted):
+    """Reference item-item cosine without self-similarity or non-positive entries"""
+    X = matrix.toarray()
+    if adjusted:
+        mask = X != 0
+        counts = mask.sum(axis=1)
+        means = np.divide(X.sum(axis=1), counts, out=np.zeros(len(X)), where=counts > 0)
+        X = np.where(mask, X - means[:, None], 0.0)
+    norms = np.linalg.norm(X, axis=0)
+    norms[norms == 0] = 1.0
+    X = X / norms
+    sim = X.T @ X
+    np.fill_diagonal(sim, 0.0)
+    sim[sim <= 0] = 0.0
+    return sim
+
+
+@pytest.mark.parametrize('method', ['cosine', 'adjusted_cosine'])
+def test_similarity_matches_dense_reference(method):
+    ratings = _ratings()
+    similarity = item_knn.build_item_similarity(ratings, neighbors=ratings.shape[1], method=method)
+    expected = _dense_similarity(ratings, adjusted=method == 'adjusted_cosine')
+    assert np.allclose(similarity.toarray(), expected, atol=1e-5)
+
+
+def test_similarity_keeps_top_neighbours_per_item():
+    ratings = _ratings()
+    full = _dense_similarity(ratings, adjusted=True)
+    similarity = item_knn.build_item_similarity(ratings, neighbors=3).toarray()
+    for item in range(ratings.shape[1]):
+        kept = np.flatnonzero(similarity[item])
+        assert len(kept) == min(3, np.count_nonzero(full[item]))
+        # Nothing dropped scores higher than what was kept
+        dropped = np.setdiff1d(np.flatnonzero(full[item]), kept)
+        if len(dropped):
+            assert full[item, dropped].max() <= full[item, kept].min() + 1e-6
+
+
+def test_similarity_does_not_depend_on_block_size():
+    ratings = _ratings(n_items=25)
+    one_block = item_knn.build_item_similarity(ratings, neighbors=5, block_size=1024)
+    small_blocks = item_knn.build_item_similarity(ratings, neighbors=5, block_size=4)
+    assert np.allclose(one_block.toarray(), small_blocks.toarray(), atol=1e-6)
+
+
+def test_unknown_similarity_method():
+    with pytest.raises(ValueError):
+        item_knn.build_item_similarity(_ratings(), method='pearson')
+
+
+@pytest.mark.parametrize('adjusted', [True, False])
+def test_score_users_matches_score_user(adjusted):
+    ratings = _ratings(n_users=12, seed=1)
+    similarity = item_knn.build_item_similarity(_ratings(seed=2), neighbors=5)
+    # A user without ratings scores -inf everywhere
+    ratings = sparse.vstack([ratings, sparse.csr_matrix((1, ratings.shape[1]), dtype=np.float32)]).tocsr()
+
+    batch = item_knn.score_users(similarity, ratings, adjusted=adjusted)
+    for user in range(ratings.shape[0]):
+        lo, hi = ratings.indptr[user], ratings.indptr[user + 1]
+        single = item_knn.score_user(similarity, ratings.indices[lo:hi], ratings.data[lo:hi], adjusted=adjusted)
+        assert np.array_equal(np.isinf(single), np.isinf(batch[user]))
+        finite = np.isfinite(single)
+        assert np.allclose(single[finite], batch[user][finite], atol=1e-5)
+    assert np.isneginf(batch[-1]).all()
+
+
+def test_top_k_indices_is_sorted_descending():
+    scores = np.random.default_rng(3).random(100).astype(np.float32)
+    positions, top = top_k_indices(scores.copy(), 10)
+    expected = np.argsort(-scores)[:10]
+    assert list(positions) == list(expected)
+    assert np.array_equal(top, scores[expected])
+
+
+def test_top_k_indices_skips_excluded():
+    scores = np.arange(10, dtype=np.float32)
+    positions, _ = top_k_indices(scores.copy(), 3, exclude=np.array([9, 8]))
+    assert list(positions) == [7, 6, 5]
+
+
+def test_top_k_indices_caps_k():
+    scores = np.arange(5, dtype=np.float32)
+    positions, _ = top_k_indices(scores.copy(), 10, exclude=np.array([0, 1]))
+    assert list(positions) == [4, 3, 2]
+    positions, top = top_k_indices(np.empty(0, dtype=np.float32), 3)
+    assert len(positions) == 0 and len(top) == 0
@@ -0,0 +1,148 @@
+"""
+Retrain jobs: enqueue dedupe, cancel, stale-job expiry, progress reports and the runner
+"""
+import os
+from datetime import datetime, timedelta
+import pytest
+from config import Config
+from extensions import db
+from models.job_model import RetrainJob
+from recommender import jobs
+from recommender.jobs import JobCancelled, JobProgress, JobRunner
+
+
+@pytest.fixture
+def runner(app, monkeypatch):
+    """JobRunner that records worker starts and reloads instead of running them"""
+    runner = JobRunner()
+    runner.init_app(app)
+    runner.started = runner.reloaded = 0
+
+    def ensure_worker():
+        runner.started += 1
+
+    def reload_recommender():
+        runner.reloaded += 1
+    monkeypatch.setattr(runner, '_ensure_worker', ensure_worker)
+    monkeypatch.setattr(runner, '_reload_recommender', reload_recommender)
+    return runner
+
+
+def _age(job, **fields):
+    old = datetime.utcnow() - timedelta(seconds=Config.RETRAIN_JOB_STALE_SECONDS + 60)
+    for field in fields:
+        setattr(job, field, old)
+    db.session.commit()
+
+
+def test_enqueue_dedupes_active_jobs(runner):
+    job, created = runner.enqueue(full=True)
+    assert created and job.status == 'queued' and job.full
+    again, created = runner.enqueue()
+    assert not created and again.id == job.id
+    assert runner.started == 2
+    assert RetrainJob.query.count() == 1
+
+
+def test_cancel(runner):
+    job, _ = runner.enqueue()
+    assert runner.cancel(job.id).status == 'cancelled'
+    assert runner.active_job() is None
+
+    job, created = runner.enqueue()
+    assert created
+    job.status = 'running'
+    db.session.commit()
+    cancelled = runner.cancel(job.id)
+    assert cancelled.status == 'running' and cancelled.cancel_requested
+    assert runner.cancel(12345) is None
+
+
+def test_stale_running_job_is_stopped_and_failed(runner, monkeypatch):
+    stopped = []
+    monkeypatch.setattr(jobs, '_retrain_alive', lambda pid: True)
+    monkeypatch.setattr(jobs, '_stop', stopped.append)
+    job, _ = runner.enqueue()
+    job.status, job.pid = 'running', 4321
+    _age(job, heartbeat_at=True)
+
+    new, created = runner.enqueue()
+    assert created and new.id != job.id
+    assert stopped == [4321]
+    db.session.refresh(job)
+    assert job.status == 'failed' and job.finished_at is not None
+
+
+def test_running_job_with_heartbeats_is_kept(runner, monkeypatch):
+    monkeypatch.setattr(jobs, '_stop', pytest.fail)
+    job, _ = runner.enqueue()
+    job.status, job.heartbeat_at = 'running', datetime.utcnow()
+    db.session.commit()
+    again, created = runner.enqueue()
+    assert not created and again.id == job.id
+
+
+def test_orphaned_queued_job_is_failed(runner):
+    job, _ = runner.enqueue()
+    _age(job, created_at=True)
+    _, created = runner.enqueue()
+    assert created
+    db.session.refresh(job)
+    assert job.status == 'failed'
+
+
+def test_claim_next(runner):
+    assert runner._claim_next() is None
+    job, _ = runner.enqueue()
+    assert runner._claim_next() == job.id
+    db.session.refresh(job)
+    assert job.status == 'running' and job.heartbeat_at is not None
+    assert runner._claim_next() is None
+
+
+def test_retrain_alive_ignores_other_processes():
+    # This process is pytest, not a retrain, and a pid past pid_max is not running at all
+    assert not jobs._retrain_alive(os.getpid())
+    assert not jobs._retrain_alive(2 ** 22 + 1)
+
+
+def test_progress_is_written_to_the_job(app, runner, monkeypatch):
+    monkeypatch.setattr(Config, 'RETRAIN_PROGRESS_INTERVAL', 0)
+    job, _ = runner.enqueue()
+    progress = JobProgress(app, job.id)
+    progress('embeddings', 25, 100)
+    db.session.expire_all()
+    job = db.session.get(RetrainJob, job.id)
+    assert job.stage == 'embeddings' and job.heartbeat_at is not None
+    stage = job.progress['stages']['embeddings']
+    assert (stage['unit'], stage['done'], stage['total']) == ('books', 25, 100)
+    assert stage['eta_seconds'] is not None
+
+    runner.cancel(job.id)
+    with pytest.raises(JobCancelled):
+        progress('embeddings', 50)
+
+
+def _script(tmp_path, monkeypatch, code):
+    script = tmp_path / 'retrain_model.py'
+    script.write_text(code)
+    monkeypatch.setattr(jobs, 'RETRAIN_SCRIPT', script)
+    monkeypatch.setattr(jobs, '_POLL_SECONDS', 0.01)
+
+
+@pytest.mark.parametrize('code, status', [
+    ('import sys; assert sys.argv[1:] == ["--job", "1", "--full"]', 'succeeded'),
+    ('raise SystemExit("corrupt ratings")', 'failed'),
+])
+def test_execute_runs_the_retrain_script(tmp_path, monkeypatch, runner, code, status):
+    _script(tmp_path, monkeypatch, code)
+    job, _ = runner.enqueue(full=True)
+    runner._claim_next()
+    runner._execute(job.id)
+    db.session.expire_all()
+    job = db.session.get(RetrainJob, job.id)
+    assert job.status == status and job.pid is not None
+    assert runner.reloaded == (status == 'succeeded')
+    if status == 'failed':
+        assert 'corrupt ratings' in job.message
+    assert (Config.RETRAIN_LOG_DIR / f'retrain_{job.id}.log').exists()
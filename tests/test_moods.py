@@ -0,0 +1,69 @@
+"""
+Mood lexicon: the compiled trie regex, mood detection and book tagging
+"""
+import random
+import re
+from types import SimpleNamespace
+from extensions import db
+from models.book_model import Book
+from models.mood_model import BookMood
+from search.moods import MOOD_LEXICON, _trie_pattern, book_moods, moods_in, tag_all_books
+
+
+def _reference_moods(text):
+    """Moods by plain substring search, what the compiled matcher must agree with"""
+    text = text.lower()
+    return {mood for mood, words in MOOD_LEXICON.items() if any(word in text for word in [mood, *words])}
+
+
+def test_trie_pattern_prefers_the_longest_word():
+    pattern = re.compile(_trie_pattern(['warm', 'warmth', 'war']))
+    assert pattern.match('warmthy').group() == 'warmth'
+    assert pattern.match('warmer').group() == 'warm'
+    assert pattern.match('wary').group() == 'war'
+    assert pattern.match('wa') is None
+
+
+def test_trie_pattern_escapes_regex_characters():
+    pattern = re.compile(_trie_pattern(['light & funny', 'a.b']))
+    assert pattern.fullmatch('light & funny')
+    assert pattern.fullmatch('a.b') and not pattern.fullmatch('axb')
+
+
+def test_moods_in_examples():
+    assert moods_in('A COZY, heartwarming tale') == {'cozy'}
+    assert moods_in('the warmth of home') == {'cozy'}
+    assert moods_in('an uplifting story') == {'happy', 'hopeful', 'inspiring'}
+    assert moods_in('a feel-good page-turner') == {'cozy', 'happy', 'thrilling'}
+    assert moods_in('') == set() and moods_in(None) == set()
+    assert moods_in('a ledger of accounts') == set()
+
+
+def test_moods_in_matches_substring_reference():
+    rng = random.Random(0)
+    words = [word for mood, mood_words in MOOD_LEXICON.items() for word in [mood, *mood_words]]
+    for _ in range(500):
+        parts = [rng.choice(words + ['the', 'x', 'warmer', 'sadness', 'adventure']) for _ in range(rng.randint(0, 6))]
+        text = rng.choice(['', ' ', '-']).join(parts)
+        assert moods_in(text) == _reference_moods(text), text
+
+
+def test_book_moods_do_not_span_columns():
+    book = SimpleNamespace(title='Sa', author='d', genres=None, description='calm waters')
+    assert book_moods(book) == {'calm'}
+
+
+def test_tag_all_books(app):
+    db.session.add_all([
+        Book(id=1, title='Gone Girl', author='Gillian Flynn', description='A gripping, dark thriller'),
+        Book(id=2, title='The Hobbit', author='Tolkien', genres='Adventure; Fantasy', description='A quest'),
+        Book(id=3, title='Ledger', author='Anon'),
+    ])
+    db.session.add(BookMood(mood='sad', book_id=3))  # stale tag
+    db.session.commit()
+
+    seen = []
+    assert tag_all_books(progress=lambda stage, done, total: seen.append((stage, done, total))) == 3
+    tags = {(tag.book_id, tag.mood) for tag in BookMood.query}
+    assert tags == {(1, 'thrilling'), (1, 'dark'), (2, 'adventurous')}
+    assert seen[-1] == ('moods', 3, 3)
@@ -0,0 +1,115 @@
+"""
+Online CF: the rating delta overlay over the loaded artifacts, bounded syncs and compaction
+"""
+import numpy as np
+from config import Config
+from extensions import db
+from models.rating_model import Rating, RatingDelta
+from models.user_model import User
+from recommender.hybrid_recommender import HybridRecommender
+from recommender.online import compact_deltas, delta_watermark
+from recommender.retrain_model import build_cf_matrix, train_als_model
+
+
+def _rate(user_id, book_id, rating):
+    """Write a rating and its delta the way rate_book does"""
+    existing = Rating.query.filter_by(user_id=user_id, book_id=book_id).first()
+    if existing is not None:
+        existing.rating = rating
+    else:
+        db.session.add(Rating(user_id=user_id, book_id=book_id, rating=rating))
+    RatingDelta.record(user_id, book_id, 'rating', rating)
+    db.session.commit()
+
+
+def _item_means():
+    means = np.zeros(30)
+    for book_id in range(1, 31):
+        ratings = [r.rating for r in Rating.query.filter_by(book_id=book_id)]
+        means[book_id - 1] = np.mean(ratings) if ratings else 0.0
+    return means
+
+
+def test_sync_replaces_rows_and_moves_item_means(trained):
+    online = trained.online
+    rated = Rating.query.filter_by(user_id=2).first()
+    _rate(2, rated.book_id, 1 if rated.rating != 1 else 5)
+    _rate(2, 30, 5)
+    _rate(1, 30, 1)
+
+    assert online.sync() == 3
+    assert online.last_id == delta_watermark()
+    positions, ratings = online.row(2)
+    expected = {r.book_id: r.rating for r in Rating.query.filter_by(user_id=2)}
+    assert dict(zip(trained.item_ids[positions].tolist(), ratings.tolist())) == expected
+    assert np.allclose(trained.item_means, _item_means())
+    # Already applied rows are not read again
+    assert online.sync() == 0
+
+
+def test_users_new_since_the_retrain_get_cf_scores(trained):
+    db.session.add(User(id=7, username='user7', email='user7@example.com', password_hash='x'))
+    db.session.commit()
+    assert len(trained.score_collaborative(7)[0]) == 0
+    for book_id in (1, 2, 3):
+        _rate(7, book_id, 5)
+    trained.online.sync()
+    assert sorted(trained.rated_book_ids(7)) == [1, 2, 3]
+    book_ids, _ = trained.score_collaborative(7, top_k=5)
+    assert len(book_ids) and not set(book_ids.tolist()) & {1, 2, 3}
+
+
+def test_sync_limit(trained):
+    for book_id in (4, 5, 6):
+        _rate(5, book_id, 4)
+    assert trained.online.sync(limit=2) == 2
+    assert trained.online.sync(limit=2) == 1
+    assert trained.online.stats()['deltas_applied'] == 3
+
+
+def test_full_overlay_pauses_tailing(trained, monkeypatch):
+    monkeypatch.setattr(Config, 'CF_ONLINE_MAX_USERS', 1)
+    _rate(1, 4, 3)
+    _rate(2, 4, 3)
+    online = trained.online
+    assert online.sync(limit=1) == 1
+    assert online.sync() == 0
+    assert online.paused and online.stats()['users'] == 1
+    last_id = online.last_id
+    online.poll()
+    assert online.last_id == last_id
+
+
+def test_rebuilt_matrix_starts_after_its_watermark(trained):
+    _rate(3, 9, 2)
+    _rate(3, 10, 4)
+    build_cf_matrix()
+    rebuilt = HybridRecommender()
+    rebuilt.load_artifacts()
+    assert rebuilt.online.last_id == delta_watermark()
+    assert rebuilt.online.sync() == 0
+    assert compact_deltas(rebuilt.online.last_id) == 2
+    assert RatingDelta.query.count() == 0
+    # Compaction never lets ids be reused
+    _rate(3, 11, 5)
+    assert delta_watermark() > rebuilt.online.last_id
+    assert rebuilt.online.sync() == 1
+
+
+def test_als_users_are_folded_in_again(library, publish_embeddings, monkeypatch):
+    monkeypatch.setattr(Config, 'CF_MODEL', 'als')
+    monkeypatch.setattr(Config, 'ALS_FACTORS', 4)
+    monkeypatch.setattr(Config, 'ALS_ITERATIONS', 2)
+    publish_embeddings(library.book_ids, np.random.default_rng(4).normal(size=(30, 8)))
+    build_cf_matrix()
+    train_als_model()
+    recommender = HybridRecommender()
+    recommender.load_artifacts()
+    before = np.array(recommender.user_factors[recommender.user_index[4]])
+
+    _rate(4, 20, 5)
+    recommender.online.sync()
+    after = recommender.online.user_factors[4]
+    assert after.shape == before.shape and not np.allclose(after, before)
+    book_ids, _ = recommender.score_collaborative(4, top_k=5)
+    assert 20 not in book_ids.tolist()
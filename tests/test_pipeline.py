@@ -0,0 +1,83 @@
+"""
+Retrain pipeline stages: prefetching, background writes and streamed sparse reads
+"""
+import threading
+import numpy as np
+import pytest
+from extensions import db
+from models.rating_model import Rating
+from recommender.pipeline import BackgroundWriter, prefetch, stream_rows
+from recommender.retrain_model import _stream_sparse
+
+
+def test_prefetch_keeps_order():
+    assert list(prefetch(iter(range(100)), maxsize=3)) == list(range(100))
+
+
+def test_prefetch_reraises_producer_errors():
+    def produce():
+        yield 1
+        raise ValueError('bad row')
+
+    items = prefetch(produce())
+    assert next(items) == 1
+    with pytest.raises(ValueError, match='bad row'):
+        next(items)
+
+
+def test_prefetch_stops_the_producer_when_abandoned():
+    closed = threading.Event()
+
+    def produce():
+        try:
+            for i in range(10 ** 6):
+                yield i
+        finally:
+            closed.set()
+
+    items = prefetch(produce(), maxsize=2)
+    assert next(items) == 0
+    items.close()
+    assert closed.is_set()
+
+
+def test_background_writer_keeps_order():
+    written = []
+    with BackgroundWriter(written.append, maxsize=2) as writer:
+        for i in range(50):
+            writer.submit(i)
+    assert written == list(range(50))
+
+
+def test_background_writer_reraises_write_errors():
+    def write(item):
+        if item == 3:
+            raise OSError('disk full')
+
+    writer = BackgroundWriter(write, maxsize=1)
+    with pytest.raises(OSError, match='disk full'):
+        for i in range(100):
+            writer.submit(i)
+        writer.close()
+
+
+def test_stream_rows_in_chunks(library, app):
+    chunks = list(stream_rows(app, db.select(Rating.id).order_by(Rating.id), chunk_size=7))
+    assert all(len(chunk) == 7 for chunk in chunks[:-1])
+    assert [row.id for chunk in chunks for row in chunk] == sorted(r.id for r in Rating.query)
+
+
+def test_stream_sparse(library, app, monkeypatch):
+    monkeypatch.setattr('config.Config.RETRAIN_CHUNK_SIZE', 5)
+    user_ids = np.array([1, 2, 3, 4], dtype=np.int64)  # users 5 and 6 are dropped
+    item_ids = library.book_ids
+    reads = []
+    matrix = _stream_sparse(app, (Rating.user_id, Rating.book_id, Rating.rating), user_ids, item_ids,
+                            np.float32, transform=lambda v: v * 2, progress=lambda done, total: reads.append(done))
+    expected = np.zeros((len(user_ids), len(item_ids)), dtype=np.float32)
+    for (user_id, book_id), rating in library.ratings.items():
+        if user_id in user_ids:
+            expected[user_id - 1, book_id - 1] = rating * 2
+    assert matrix.dtype == np.float32
+    assert np.array_equal(matrix.toarray(), expected)
+    assert reads == list(range(5, len(library.ratings), 5)) + [len(library.ratings)]
@@ -0,0 +1,92 @@
+"""
+Precomputed recommendation lists: the batch precompute, cache hits, misses and invalidation
+"""
+import numpy as np
+import pytest
+from config import Config
+from extensions import db
+from models.rating_model import Favorite, Rating, RatingDelta
+from models.recommendation_model import UserRecommendation
+from models.user_model import User
+from recommender.precompute import active_user_ids, cached_recommendations, precompute_recommendations
+
+
+def _stored(user_id):
+    rows = UserRecommendation.query.filter_by(user_id=user_id).order_by(UserRecommendation.rank).all()
+    return [row.book_id for row in rows], [row.score for row in rows], {row.model_version for row in rows}
+
+
+def _no_scoring(*args, **kwargs):
+    raise AssertionError('scored instead of read from the table')
+
+
+def test_active_users(trained):
+    db.session.add(User(id=7, username='user7', email='user7@example.com', password_hash='x'))
+    db.session.add(User(id=8, username='user8', email='user8@example.com', password_hash='x'))
+    db.session.add(Favorite(user_id=7, book_id=3))
+    db.session.commit()
+    assert active_user_ids() == [1, 2, 3, 4, 5, 6, 7]
+
+
+def test_precompute_stores_the_hybrid_lists(trained, monkeypatch):
+    monkeypatch.setattr(Config, 'RECOMMEND_BATCH_CHUNK', 4)
+    db.session.add(UserRecommendation(user_id=50, rank=0, book_id=1, score=1.0, model_version='old'))
+    db.session.commit()
+    done = []
+    assert precompute_recommendations(trained, top_n=5, progress=lambda *args: done.append(args)) == 6
+    assert done == [('precompute', 4, 6), ('precompute', 6, 6)]
+    for user_id in range(1, 7):
+        book_ids, scores, versions = _stored(user_id)
+        expected_ids, expected_scores = trained.score_hybrid(user_id=user_id, top_k=5)
+        assert book_ids == list(expected_ids)
+        assert scores == pytest.approx(list(expected_scores), abs=1e-6)
+        assert versions == {trained.version}
+    # Lists of other versions are dropped
+    assert _stored(50)[0] == []
+
+
+def test_hit_reads_the_stored_list(trained, monkeypatch):
+    precompute_recommendations(trained, top_n=5)
+    expected_ids = _stored(2)[0]
+    monkeypatch.setattr(trained, 'score_hybrid', _no_scoring)
+    recommendations = cached_recommendations(trained, 2, top_k=3)
+    assert [r['id'] for r in recommendations] == expected_ids[:3]
+    assert recommendations[0]['title'] == f'Book {expected_ids[0]}'
+
+
+def test_rating_invalidates_and_the_miss_is_stored(trained, monkeypatch):
+    monkeypatch.setattr(Config, 'PRECOMPUTE_TOP_N', 5)
+    precompute_recommendations(trained, top_n=5)
+    # As rate_book does: the rating, its delta and the invalidation in one transaction
+    book_id = int(_stored(3)[0][0])
+    db.session.add(Rating(user_id=3, book_id=book_id, rating=5))
+    RatingDelta.record(3, book_id, 'rating', 5)
+    UserRecommendation.invalidate(3)
+    db.session.commit()
+    assert _stored(3)[0] == []
+
+    recommendations = cached_recommendations(trained, 3, top_k=5)
+    book_ids, _, versions = _stored(3)
+    # The miss applied the new rating first, so the rated book is not recommended again
+    assert book_id not in book_ids
+    assert [r['id'] for r in recommendations] == book_ids and versions == {trained.version}
+
+
+def test_lists_of_another_version_are_recomputed(trained, monkeypatch):
+    monkeypatch.setattr(Config, 'PRECOMPUTE_TOP_N', 5)
+    precompute_recommendations(trained, top_n=5)
+    trained.version = 'newer'
+    cached_recommendations(trained, 4, top_k=5)
+    assert _stored(4)[2] == {'newer'}
+
+
+def test_miss_behind_the_delta_log_is_not_stored(trained, monkeypatch):
+    # The bounded sync leaves the user's latest change unapplied
+    monkeypatch.setattr(trained.online, 'sync', lambda wait=True, limit=None: 0)
+    RatingDelta.record(4, 1, 'rating', 2)
+    db.session.commit()
+    recommendations = cached_recommendations(trained, 4, top_k=5)
+    assert len(recommendations) == 5
+    assert _stored(4)[0] == []
+    expected_ids, _ = trained.score_hybrid(user_id=4, top_k=Config.PRECOMPUTE_TOP_N)
+    assert np.array_equal([r['id'] for r in recommendations], expected_ids[:5])
@@ -0,0 +1,87 @@
+"""
+Quantized embeddings: approximate scores, exact re-ranking and measured recall
+"""
+import numpy as np
+import pytest
+from config import Config
+from recommender import quantization
+from recommender.artifacts import ArtifactStore, IdIndex
+from recommender.hybrid_recommender import HybridRecommender
+from recommender.vector_index import l2_normalize
+
+
+@pytest.fixture
+def embeddings():
+    return l2_normalize(np.random.default_rng(0).normal(size=(400, 32)))
+
+
+def _exact_top(embeddings, query_vec, k):
+    return np.argsort(-(embeddings @ query_vec), kind='stable')[:k]
+
+
+@pytest.mark.parametrize('kind, dtype, ratio, atol', [('float16', np.float16, 2, 1e-3), ('int8', np.int8, 4, 2e-2)])
+def test_quantized_scores_are_close(embeddings, kind, dtype, ratio, atol):
+    quantized = quantization.quantize(embeddings, kind)
+    assert quantized.codes.dtype == dtype
+    assert quantized.codes.nbytes * ratio == embeddings.nbytes
+    queries = embeddings[:5]
+    assert quantized.scores(queries).shape == (5, len(embeddings))
+    assert np.allclose(quantized.scores(queries), queries @ embeddings.T, atol=atol)
+    assert np.allclose(quantized.scores(queries[0]), quantized.scores(queries)[0])
+
+
+def test_unknown_quantization():
+    with pytest.raises(ValueError):
+        quantization.quantize(np.eye(2, dtype=np.float32), 'int4')
+
+
+def test_save_and_load(tmp_path, embeddings):
+    store = ArtifactStore(tmp_path)
+    quantization.quantize(embeddings, 'int8').save(store)
+    loaded = quantization.load_quantized(store, 'int8')
+    assert isinstance(loaded.codes, np.memmap)
+    assert np.allclose(loaded.scores(embeddings[0]), quantization.quantize(embeddings, 'int8').scores(embeddings[0]))
+    quantization.remove_quantized(store)
+    assert not store.has('embeddings_codes') and not store.has('embeddings_scale')
+
+
+def test_rerank_scores_candidates_exactly(embeddings):
+    query_vec = embeddings[7]
+    candidates = np.array([350, 7, 12, 200, 3])
+    positions, scores = quantization.rerank(embeddings, query_vec, candidates, 3)
+    exact = embeddings[candidates] @ query_vec
+    assert list(positions) == list(candidates[np.argsort(-exact)[:3]])
+    assert np.allclose(scores, np.sort(exact)[::-1][:3])
+    assert len(quantization.rerank(embeddings, query_vec, [], 3)[0]) == 0
+
+
+def test_measure_recall(embeddings):
+    exact = quantization.measure_recall(embeddings, lambda q, n: _exact_top(embeddings, q, n), k=5, sample=20)
+    assert exact['recall'] == 1.0 and exact['queries'] == 20
+    quantized = quantization.quantize(embeddings, 'int8')
+
+    def candidates(query_vec, n):
+        return np.argsort(-quantized.scores(query_vec))[:n]
+    measure = quantization.measure_recall(embeddings, candidates, k=5, rerank_candidates=30, sample=20)
+    assert 0.5 < measure['recall'] <= 1.0
+    assert measure['recall_reranked'] == 1.0
+
+
+@pytest.mark.parametrize('kind', ['float16', 'int8'])
+def test_recommender_reranks_to_the_exact_ranking(monkeypatch, embeddings, kind):
+    monkeypatch.setattr(Config, 'RERANK_CANDIDATES', 40)
+    recommender = HybridRecommender()
+    recommender.embeddings = embeddings
+    recommender.book_ids = np.arange(1000, 1000 + len(embeddings), dtype=np.int64)
+    recommender.books_index = IdIndex(recommender.book_ids)
+    recommender.quantization = kind
+    recommender.quantized = quantization.quantize(embeddings, kind)
+
+    queries = embeddings[:10] + 0.1
+    batch = recommender.score_by_text_batch(queries, top_k=10)
+    for query, (batch_ids, batch_scores) in zip(queries, batch):
+        book_ids, scores = recommender.score_by_text(query[None, :], top_k=10)
+        expected = _exact_top(embeddings, l2_normalize(query)[0], 10)
+        assert np.array_equal(book_ids, recommender.book_ids[expected])
+        assert np.array_equal(batch_ids, book_ids)
+        assert np.allclose(batch_scores, scores)
@@ -0,0 +1,104 @@
+"""
+Response cache: tagged entries and invalidation, for the memory and sqlite backends
+"""
+import pytest
+from flask import Flask
+from response_cache import ResponseCache
+
+
+def _cache(backend, tmp_path, size=100):
+    app = Flask(__name__)
+    app.config.update(RESPONSE_CACHE_BACKEND=backend, RESPONSE_CACHE_SIZE=size, RESPONSE_CACHE_TTL=60,
+                      RESPONSE_CACHE_PATH=str(tmp_path / 'response_cache.sqlite'))
+    return ResponseCache(app)
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def cache(request, tmp_path):
+    return _cache(request.param, tmp_path)
+
+
+class Compute:
+    """compute() for get_or_set that counts its calls"""
+
+    def __init__(self, value, tags):
+        self.value, self.tags, self.calls = value, tags, 0
+
+    def __call__(self):
+        self.calls += 1
+        return self.value, self.tags
+
+
+def test_second_lookup_is_a_hit(cache):
+    compute = Compute([{'id': 1}], ['book:1'])
+    assert cache.get_or_set('search', {'q': 'dune'}, compute) == [{'id': 1}]
+    assert cache.get_or_set('search', {'q': ' DUNE '}, compute) == [{'id': 1}]
+    assert compute.calls == 1
+    assert cache.stats()['endpoints']['search'] == {'hits': 1, 'misses': 1, 'hit_rate': 0.5}
+
+
+def test_invalidate_drops_only_tagged_entries(cache):
+    dune = Compute(['dune'], ['catalog', 'book:1'])
+    emma = Compute(['emma'], ['book:2'])
+    recs = Compute(['recs'], ['model'])
+    for q, compute in (('dune', dune), ('emma', emma), ('recs', recs)):
+        cache.get_or_set('search', {'q': q}, compute)
+
+    assert cache.invalidate('book:1', 'model') == 2
+    for q, compute in (('dune', dune), ('emma', emma), ('recs', recs)):
+        cache.get_or_set('search', {'q': q}, compute)
+    assert (dune.calls, emma.calls, recs.calls) == (2, 1, 2)
+    assert cache.invalidate('book:404') == 0
+
+
+def test_untagged_results_are_not_cached(cache):
+    compute = Compute(['partial'], None)
+    cache.get_or_set('hybrid', {'q': 'x'}, compute)
+    cache.get_or_set('hybrid', {'q': 'x'}, compute)
+    assert compute.calls == 2
+    assert cache.stats()['entries'] == 0
+
+
+def test_expired_entries_are_recomputed(cache):
+    cache.ttl = -1
+    compute = Compute(['old'], ['catalog'])
+    cache.get_or_set('search', {'q': 'x'}, compute)
+    cache.get_or_set('search', {'q': 'x'}, compute)
+    assert compute.calls == 2
+
+
+def test_memory_backend_evicts_least_recently_used(tmp_path):
+    cache = _cache('memory', tmp_path, size=2)
+    computes = {q: Compute([q], ['catalog']) for q in 'abc'}
+    for q in 'ab':
+        cache.get_or_set('search', {'q': q}, computes[q])
+    cache.get_or_set('search', {'q': 'a'}, computes['a'])  # 'b' is now least recently used
+    cache.get_or_set('search', {'q': 'c'}, computes['c'])
+    for q in 'acb':
+        cache.get_or_set('search', {'q': q}, computes[q])
+    assert {q: compute.calls for q, compute in computes.items()} == {'a': 1, 'b': 2, 'c': 1}
+
+
+def test_sqlite_invalidation_reaches_other_workers(tmp_path):
+    worker_a, worker_b = _cache('sqlite', tmp_path), _cache('sqlite', tmp_path)
+    compute = Compute(['dune'], ['book:1'])
+    worker_a.get_or_set('search', {'q': 'dune'}, compute)
+    worker_b.get_or_set('search', {'q': 'dune'}, compute)
+    assert compute.calls == 1
+
+    assert worker_b.invalidate('book:1') == 1
+    worker_a.get_or_set('search', {'q': 'dune'}, compute)
+    assert compute.calls == 2
+
+
+def test_disabled_cache_always_computes(tmp_path):
+    cache = _cache('none', tmp_path)
+    compute = Compute(['x'], ['catalog'])
+    cache.get_or_set('search', {}, compute)
+    cache.get_or_set('search', {}, compute)
+    assert compute.calls == 2 and cache.invalidate('catalog') == 0
+
+
+def test_unknown_backend(tmp_path):
+    with pytest.raises(ValueError):
+        _cache('redis', tmp_path)
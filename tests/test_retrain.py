@@ -0,0 +1,65 @@
+"""
+Retrain: the sparse CF matrix, its per-item statistics and the ALS factors trained on it
+"""
+import numpy as np
+from scipy import sparse
+from config import Config
+from extensions import db
+from models.rating_model import Rating
+from recommender.artifacts import ArtifactStore
+from recommender.hybrid_recommender import HybridRecommender
+from recommender.retrain_model import _column_means, build_cf_matrix, train_als_model
+
+
+def _dense(ratings, user_ids, book_ids):
+    matrix = np.zeros((len(user_ids), len(book_ids)), dtype=np.int8)
+    for (user_id, book_id), rating in ratings.items():
+        matrix[list(user_ids).index(user_id), list(book_ids).index(book_id)] = rating
+    return matrix
+
+
+def test_column_means_skip_empty_cells():
+    matrix = sparse.csc_matrix(np.array([[4, 0, 0], [2, 0, 5], [0, 0, 1]], dtype=np.int8))
+    assert np.allclose(_column_means(matrix), [3.0, 0.0, 3.0])
+
+
+def test_build_cf_matrix(library):
+    # Ratings of unknown users or books are dropped
+    db.session.add(Rating(user_id=99, book_id=1, rating=5))
+    db.session.commit()
+    build_cf_matrix()
+
+    store = ArtifactStore.current()
+    meta = store.read_manifest()['cf']
+    assert meta['nnz'] == len(library.ratings)
+    csr = store.read_csr('cf_csr', meta['shape'])
+    assert csr.dtype == np.int8
+    expected = _dense(library.ratings, library.user_ids, library.book_ids)
+    assert np.array_equal(csr.toarray(), expected)
+    assert np.array_equal(store.read_csc('cf_csc', meta['shape']).toarray(), expected)
+    assert np.array_equal(store.read_array('cf_user_ids'), library.user_ids)
+    assert np.array_equal(store.read_array('cf_item_ids'), library.book_ids)
+    counts = (expected != 0).sum(axis=0)
+    means = np.divide(expected.sum(axis=0), counts, out=np.zeros(len(counts)), where=counts > 0)
+    assert np.allclose(store.read_array('cf_item_means'), means)
+
+
+def test_als_factors_of_another_cf_build_are_ignored(library, monkeypatch):
+    monkeypatch.setattr(Config, 'CF_MODEL', 'als')
+    monkeypatch.setattr(Config, 'ALS_FACTORS', 4)
+    monkeypatch.setattr(Config, 'ALS_ITERATIONS', 2)
+    build_cf_matrix()
+    train_als_model()
+    recommender = HybridRecommender()
+    recommender.load_artifacts()
+    assert recommender.user_factors.shape == (6, 4)
+
+    # A CF matrix rebuilt on its own carries the previous version's factors over
+    build_cf_matrix()
+    store = ArtifactStore.current()
+    assert store.has('als_user_factors')
+    assert store.read_manifest()['als']['cf_version'] != store.read_manifest()['cf']['version']
+    recommender = HybridRecommender()
+    recommender.load_artifacts()
+    assert recommender.cf_matrix is not None
+    assert recommender.user_factors is None and recommender.item_factors is None
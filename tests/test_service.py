@@ -0,0 +1,60 @@
+"""
+Resident recommender service: one recommender per process, shared across requests
+"""
+import time
+import numpy as np
+import pytest
+from config import Config
+from recommender.service import RecommenderService, get_recommender
+
+
+@pytest.fixture
+def service(app, monkeypatch, publish_embeddings):
+    monkeypatch.setattr(Config, 'RECOMMENDER_RELOAD_INTERVAL', 0)
+    monkeypatch.setattr(Config, 'CF_DELTA_INTERVAL', 0)
+    publish_embeddings([1, 2, 3], np.eye(3, 4))
+    return RecommenderService()
+
+
+def test_get_loads_once_and_shares_the_recommender(app, service):
+    service.init_app(app, preload=False)
+    assert not service.stats()['loaded']
+    recommender = get_recommender()
+    assert recommender is service.get() is get_recommender()
+    assert recommender.embeddings.shape == (3, 4)
+    stats = service.stats()
+    assert stats['loaded'] and stats['version'] == recommender.version
+    assert stats['load_seconds'] is not None and stats['mapped_bytes'] > 0
+
+
+def test_init_app_preloads(app, service):
+    service.init_app(app)
+    assert service.stats()['loaded']
+    assert app.extensions['recommender'] is service
+
+
+def test_failed_preload_leaves_the_service_unloaded(app, service, monkeypatch):
+    def fail(version=None):
+        raise OSError('artifacts unreadable')
+    monkeypatch.setattr(service, 'load', fail)
+    service.init_app(app)
+    assert not service.stats()['loaded']
+
+
+def test_new_version_is_loaded_in_the_background(app, service, publish_embeddings, monkeypatch):
+    recommender = service.get()
+    version = service.version
+    published = publish_embeddings([1, 2, 3, 4], np.eye(4))
+    assert published.version != version
+
+    monkeypatch.setattr(Config, 'RECOMMENDER_RELOAD_INTERVAL', 0.001)
+    time.sleep(0.01)
+    # The request that notices the new version keeps the loaded one
+    assert service.get() is recommender
+    deadline = time.monotonic() + 5
+    while service.version != published.version and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert service.version == published.version
+    assert service.get().embeddings.shape == (4, 4)
+    # The previous version's arrays stay readable by requests still holding it
+    assert recommender.embeddings.shape == (3, 4)
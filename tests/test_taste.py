@@ -0,0 +1,94 @@
+"""
+Taste vectors: interaction weights, incremental profile updates and the per-worker LRU
+"""
+import numpy as np
+import pytest
+from extensions import db
+from models.rating_model import Feedback, Rating, RatingDelta
+from recommender.taste import TasteProfile, TasteProfiles, interaction_weight
+
+
+def test_interaction_weight():
+    assert interaction_weight(5) == 2.5
+    assert interaction_weight(1) == -1.5
+    assert interaction_weight(is_like=1) == 2.5
+    assert interaction_weight(is_like=0) == -1.5
+    # A rating wins over a like/dislike
+    assert interaction_weight(2, is_like=1) == -0.5
+    assert interaction_weight() == 0.0
+
+
+def _mean(embeddings, weights):
+    total = sum(weight * embeddings[position] for position, weight in weights.items())
+    return total / sum(abs(weight) for weight in weights.values())
+
+
+def test_profile_updates_match_a_rebuild():
+    embeddings = np.random.default_rng(0).normal(size=(5, 4)).astype(np.float32)
+    profile = TasteProfile(4)
+    assert profile.vector() is None
+    profile.update(embeddings, 0, 'rating', 5)
+    profile.update(embeddings, 1, 'feedback', 0)
+    profile.update(embeddings, 2, 'feedback', 1)
+    assert np.allclose(profile.vector(), _mean(embeddings, {0: 2.5, 1: -1.5, 2: 2.5}))
+
+    # Re-rating swaps the old weight out; a rating overrides the like
+    profile.update(embeddings, 0, 'rating', 2)
+    profile.update(embeddings, 2, 'rating', 4)
+    assert np.allclose(profile.vector(), _mean(embeddings, {0: -0.5, 1: -1.5, 2: 1.5}), atol=1e-6)
+    assert sorted(profile.positions()) == [0, 1, 2]
+
+
+@pytest.fixture
+def profiles(trained):
+    return trained.taste
+
+
+def _expected(trained, user_id, library):
+    weights = {}
+    for (u, book_id), is_like in library.feedback.items():
+        if u == user_id:
+            weights[trained.books_index[book_id]] = interaction_weight(is_like=is_like)
+    for (u, book_id), rating in library.ratings.items():
+        if u == user_id:
+            weights[trained.books_index[book_id]] = interaction_weight(rating)
+    return _mean(np.asarray(trained.embeddings), weights)
+
+
+def test_profiles_are_built_from_ratings_and_feedback(trained, profiles, library):
+    result = profiles.get_many([1, 2, 3])
+    for user_id in (1, 2, 3):
+        assert np.allclose(result[user_id].vector(), _expected(trained, user_id, library), atol=1e-5)
+    assert profiles.get(2) is result[2]
+    assert profiles.stats()['misses'] == 3 and profiles.stats()['hits'] == 1
+    assert profiles.get(99).vector() is None
+
+
+def test_profiles_are_evicted_least_recently_used(trained):
+    profiles = TasteProfiles(trained, max_users=2)
+    first = profiles.get(1)
+    profiles.get(2)
+    profiles.get(1)
+    profiles.get(3)
+    assert profiles.stats()['users'] == 2
+    assert profiles.get(1) is first
+    assert profiles.stats()['misses'] == 3
+
+
+def test_deltas_update_cached_profiles(trained, profiles, library):
+    profiles.get(4)
+    rated = next(book_id for (u, book_id) in library.ratings if u == 4)
+    Rating.query.filter_by(user_id=4, book_id=rated).first().rating = 1
+    RatingDelta.record(4, rated, 'rating', 1)
+    db.session.add(Feedback(user_id=4, book_id=29, is_like=1))
+    RatingDelta.record(4, 29, 'feedback', 1)
+    db.session.commit()
+    library.ratings[(4, rated)] = 1
+    library.feedback[(4, 29)] = 1
+
+    trained.online.sync()
+    assert np.allclose(profiles.get(4).vector(), _expected(trained, 4, library), atol=1e-5)
+    assert profiles.stats()['misses'] == 1
+    # The taste stage skips the books the user has interacted with
+    book_ids, _ = trained.score_by_taste(4, top_k=30)
+    assert rated not in book_ids.tolist() and 29 not in book_ids.tolist()
@@ -0,0 +1,76 @@
+"""
+Typeahead: key normalization and completion ranking
+"""
+import random
+import pytest
+from config import Config
+from extensions import db
+from models.book_model import Book
+from search.typeahead import _KEY_LENGTH, TypeaheadIndex, _suffixes, normalize
+
+
+def test_normalize():
+    assert normalize('The Hunger Games') == 'the hunger games'
+    assert normalize('  Les Misérables ') == 'les miserables'
+    assert normalize("Harry Potter & the Philosopher's Stone") == 'harry potter the philosopher s stone'
+    assert normalize('snake_case--title!') == 'snake case title'
+    assert normalize(None) == ''
+
+
+def test_suffixes():
+    assert _suffixes('the hunger games') == ['the hunger games', 'hunger games', 'games']
+    assert _suffixes('dune') == ['dune']
+    long = ' '.join(['word'] * 20)
+    assert all(len(key) <= _KEY_LENGTH for key in _suffixes(long))
+    assert _suffixes(long)[0] == long[:_KEY_LENGTH]
+
+
+def _index(app, books):
+    db.session.add_all(Book(id=i, title=title, author=author, ratings_count=count)
+                       for i, (title, author, count) in enumerate(books, start=1))
+    db.session.commit()
+    index = TypeaheadIndex()
+    index.build()
+    return index
+
+
+def test_complete_ranks_by_ratings_count(app):
+    index = _index(app, [
+        ('The Hunger Games', 'Suzanne Collins', 500),
+        ('Catching Fire', 'Suzanne Collins', 300),
+        ('Hungry Hearts', 'Anzia Yezierska', 900),
+        ('Games People Play', 'Eric Berne', 50),
+    ])
+    assert [hit['id'] for hit in index.complete('hung')] == [3, 1]
+    assert [hit['id'] for hit in index.complete('hunger ga')] == [1]
+    # Matches at any word start, in titles and authors
+    assert [hit['id'] for hit in index.complete('games')] == [1, 4]
+    assert [hit['id'] for hit in index.complete('collins')] == [1, 2]
+    assert index.complete('Húng')[0] == {'id': 3, 'title': 'Hungry Hearts', 'author': 'Anzia Yezierska'}
+    assert index.complete('ames') == []
+    assert index.complete('') == []
+
+
+def test_complete_returns_distinct_books_up_to_limit(app):
+    # Title and author both start with "s": one result per book
+    index = _index(app, [(f'Saga {i}', f'Smith {i}', i) for i in range(1, 6)])
+    assert [hit['id'] for hit in index.complete('s')] == [5, 4, 3, 2, 1]
+    assert [hit['id'] for hit in index.complete('s', limit=2)] == [5, 4]
+    assert len(index.complete('s', limit=Config.TYPEAHEAD_LIMIT + 5)) <= Config.TYPEAHEAD_LIMIT
+
+
+def test_precomputed_prefixes_match_brute_force(app):
+    rng = random.Random(7)
+    words = ['alpha', 'albatross', 'almanac', 'beta', 'alchemy']
+    books = [(f'{rng.choice(words)} {rng.choice(words)} {i}', f'author {rng.choice(words)}', rng.randrange(10000))
+             for i in range(400)]
+    index = _index(app, books)
+    assert index._snapshot.top  # 'a', 'al', ... have more than _PRECOMPUTE_RANGE keys
+
+    def brute_force(prefix):
+        hits = [(-count, i) for i, (title, author, count) in enumerate(books, start=1)
+                if any(key.startswith(prefix) for key in _suffixes(normalize(title)) + _suffixes(normalize(author)))]
+        return [i for _, i in sorted(hits)][:Config.TYPEAHEAD_LIMIT]
+
+    for prefix in ['a', 'al', 'alp', 'author', 'author al', 'b', '1']:
+        assert [hit['id'] for hit in index.complete(prefix)] == brute_force(prefix), prefix
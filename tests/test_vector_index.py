@@ -0,0 +1,81 @@
+"""
+Vector index: FAISS backends against brute-force cosine search
+"""
+import numpy as np
+import pytest
+from recommender import vector_index
+from recommender.artifacts import IdIndex
+from recommender.hybrid_recommender import HybridRecommender
+
+pytest.importorskip('faiss')
+
+
+@pytest.fixture
+def vectors():
+    return vector_index.l2_normalize(np.random.default_rng(0).normal(size=(600, 16)))
+
+
+def _brute_force(vectors, queries, k):
+    return np.argsort(-(queries @ vectors.T), axis=1, kind='stable')[:, :k]
+
+
+def test_l2_normalize():
+    normalized = vector_index.l2_normalize(np.array([[3.0, 4.0], [0.0, 0.0]]))
+    assert normalized.dtype == np.float32
+    assert np.allclose(normalized, [[0.6, 0.8], [0.0, 0.0]])
+
+
+@pytest.mark.parametrize('kind, params', [('flat', {}), ('ivf', {'nlist': 8, 'nprobe': 8})])
+def test_exact_backends_match_brute_force(vectors, kind, params):
+    index = vector_index.build_index(vectors, kind, **params)
+    queries = vectors[:20]
+    scores, positions = index.search(queries, 10)
+    assert np.array_equal(positions, _brute_force(vectors, queries, 10))
+    assert np.allclose(scores, np.take_along_axis(queries @ vectors.T, positions, axis=1), atol=1e-5)
+
+
+@pytest.mark.parametrize('kind', ['ivf', 'hnsw'])
+def test_approximate_backends_recall(vectors, kind):
+    index = vector_index.build_index(vectors, kind)
+    queries = vectors[:50]
+    _, positions = index.search(queries, 10)
+    exact = _brute_force(vectors, queries, 10)
+    recall = np.mean([len(np.intersect1d(found, truth)) / 10 for found, truth in zip(positions, exact)])
+    assert recall >= 0.8
+
+
+def test_search_bounds(vectors):
+    index = vector_index.build_index(vectors[:5], 'flat')
+    scores, positions = index.search(vectors[0], 10)
+    assert positions.shape == (1, 5)
+    assert index.search(vectors[:2], 0)[1].shape == (2, 0)
+    with pytest.raises(ValueError):
+        vector_index.build_index(vectors, 'annoy')
+
+
+@pytest.mark.parametrize('kind', ['flat', 'ivf', 'hnsw', 'pq'])
+def test_save_and_load(vectors, tmp_path, kind):
+    index = vector_index.build_index(vectors, kind)
+    path = tmp_path / 'vector.index'
+    index.save(path)
+    loaded = vector_index.load_index(path)
+    assert loaded.kind == kind and loaded.ntotal == len(vectors)
+    assert np.array_equal(loaded.search(vectors[:5], 5)[1], index.search(vectors[:5], 5)[1])
+
+
+def test_recommender_uses_the_index(vectors):
+    recommender = HybridRecommender()
+    recommender.embeddings = vectors
+    recommender.book_ids = np.arange(100, 100 + len(vectors), dtype=np.int64)
+    recommender.books_index = IdIndex(recommender.book_ids)
+    brute = recommender.score_by_text(vectors[3], top_k=8, exclude_ids=[103, 150])
+    similar = recommender.score_similar_books(104, top_k=8)
+
+    recommender.vector_index = vector_index.build_index(vectors, 'flat')
+    for (ids, scores), (expected_ids, expected_scores) in [
+        (recommender.score_by_text(vectors[3], top_k=8, exclude_ids=[103, 150]), brute),
+        (recommender.score_similar_books(104, top_k=8), similar),
+    ]:
+        assert np.array_equal(ids, expected_ids)
+        assert np.allclose(scores, expected_scores, atol=1e-5)
+    assert 103 not in brute[0] and 104 not in similar[0]
@@ -3,15 +3,34 @@ User-facing routes
 """
 from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify
 from flask_login import login_user, logout_user, login_required, current_user
+from config import Config
 from extensions import db
 from models.user_model import User
 from models.book_model import Book
-from models.rating_model import Rating, Favorite, Feedback
-from sqlalchemy import or_, func
+from models.rating_model import Rating, Favorite, Feedback, RatingDelta
+from models.recommendation_model import UserRecommendation
+from recommender.encoder import get_query_encoder
+from recommender.precompute import cached_recommendations
+from recommender.service import get_recommender
+from response_cache import book_tags, list_tags, response_cache
+from search import book_search, genre_index, hybrid_search, moods_in, typeahead_index
+from sqlalchemy import func
 
 user_bp = Blueprint('user', __name__, template_folder='../templates')
 
 
+def book_summary(book):
+    """Cacheable dict of the book fields shown in listings"""
+    return {
+        'id': book.id,
+        'title': book.title,
+        'author': book.author,
+        'genres': book.genres,
+        'avg_rating': book.avg_rating,
+        'ratings_count': book.ratings_count
+    }
+
+
 def update_book_rating_stats(book_id):
     """Recalculate average rating and count for a book"""
     book = Book.query.get_or_404(book_id)
@@ -30,21 +49,19 @@ def update_book_rating_stats(book_id):
 @user_bp.route('/')
 def index():
     """Homepage with search form and optional book list"""
-    books = None
     query = request.args.get('q', '').strip()
     
-    if query:
-        # Search across title, author, genres
-        search_filter = or_(
-            Book.title.ilike(f'%{query}%'),
-            Book.author.ilike(f'%{query}%'),
-            Book.genres.ilike(f'%{query}%')
-        )
-        books = Book.query.filter(search_filter).limit(50).all()
-    else:
+    def load():
+        if query:
+            # Search across title, author, genres
+            books = [book_summary(b) for b in book_search.search(query, limit=50)]
+            return books, list_tags(books)
         # Show top-rated books by default
-        books = Book.query.order_by(Book.avg_rating.desc(), Book.ratings_count.desc()).limit(20).all()
+        books = [book_summary(b) for b in
+                 Book.query.order_by(Book.avg_rating.desc(), Book.ratings_count.desc()).limit(20).all()]
+        return books, list_tags(books, limit=20)
     
+    books = response_cache.get_or_set('index', {'q': query}, load)
     return render_template('index.html', books=books, query=query)
 
 
@@ -131,29 +148,21 @@ def search():
     """Search books with optional genre filtering"""
     query = request.args.get('q', '').strip()
     genres_param = request.args.get('genres', '').strip()
+    genre_list = [g.strip() for g in genres_param.split(',') if g.strip()]
+    genre_mode = 'all' if request.args.get('genre_mode') == 'all' else 'any'
     
-    filters = []
-    if query:
-        filters.append(or_(
-            Book.title.ilike(f'%{query}%'),
-            Book.author.ilike(f'%{query}%'),
-            Book.genres.ilike(f'%{query}%')
-        ))
-    
-    genre_list = []
-    if genres_param:
-        genre_list = [g.strip() for g in genres_param.split(',') if g.strip()]
-        if genre_list:
-            genre_filters = [Book.genres.ilike(f'%{g}%') for g in genre_list]
-            filters.append(or_(*genre_filters))
-    
-    query_obj = Book.query
-    if filters:
-        for f in filters:
-            query_obj = query_obj.filter(f)
-    
-    books = query_obj.order_by(Book.avg_rating.desc(), Book.ratings_count.desc()).limit(50).all()
+    def load():
+        if query or genre_list:
+            books = [book_summary(b) for b in
+                     book_search.search(query, genres=genre_list, genre_mode=genre_mode, limit=50)]
+        else:
+            books = [book_summary(b) for b in
+                     Book.query.order_by(Book.avg_rating.desc(), Book.ratings_count.desc()).limit(50).all()]
+        return books, list_tags(books, limit=50)
     
+    # Genre order doesn't change the result
+    params = {'q': query, 'genres': ','.join(sorted(genre_list)), 'genre_mode': genre_mode}
+    books = response_cache.get_or_set('search', params, load)
     return render_template('index.html', books=books, query=query)
 
 @user_bp.route('/explore')
@@ -168,117 +177,86 @@ def explore():
 def api_search():
     q = request.args.get('q', '').strip()
     genres_param = request.args.get('genres', '').strip()
-    filters = []
-    if q:
-        t = q.lower()
-        mood_map = {
-            'cozy': ['cozy','comfort','heartwarming','warm','gentle','wholesome','feel-good'],
-            'thrilling': ['thrilling','suspense','fast-paced','tense','gripping','page-turner'],
-            'thought-provoking': ['thought','philosophy','reflective','introspective','provocative','contemplative'],
-            'light & funny': ['humor','funny','witty','lighthearted','comedy','hilarious','satirical'],
-            'sad': ['sad','melancholic','melancholy','grief','poignant','somber','tragic','heartbreaking','tear-jerker'],
-            'happy': ['happy','joyful','cheerful','uplifting','feel-good'],
-            'hopeful': ['hopeful','optimistic','inspiring','encouraging','uplifting'],
-            'adventurous': ['adventurous','exciting','exploration','quest','voyage'],
-            'romantic': ['romantic','love','heartfelt','passionate'],
-            'calm': ['calm','relaxing','soothing','tranquil','peaceful','serene'],
-            'anxious': ['anxious','nervous','uneasy','tense','worry'],
-            'angry': ['angry','rage','furious','vengeful','wrath'],
-            'dark': ['dark','gritty','bleak','noir','grim'],
-            'inspiring': ['inspiring','motivational','uplifting','encouraging','empowering'],
-            'nostalgic': ['nostalgic','nostalgia','wistful','sentimental']
-        }
-        terms = [q]
-        for k, v in mood_map.items():
-            if (k in t) or any(s in t for s in v):
-                terms.extend(v + [k])
-        if terms:
-            term_filters = []
-            for term in set(terms):
-                term_filters.append(or_(
-                    Book.title.ilike(f'%{term}%'),
-                    Book.author.ilike(f'%{term}%'),
-                    Book.genres.ilike(f'%{term}%'),
-                    Book.description.ilike(f'%{term}%')
-                ))
-            filters.append(or_(*term_filters))
-    genre_list = []
-    if genres_param:
-        genre_list = [g.strip() for g in genres_param.split(',') if g.strip()]
-        if genre_list:
-            genre_filters = [Book.genres.ilike(f'%{g}%') for g in genre_list]
-            filters.append(or_(*genre_filters))
-    query_obj = Book.query
-    if filters:
-        for f in filters:
-            query_obj = query_obj.filter(f)
-    books = query_obj.order_by(Book.avg_rating.desc(), Book.ratings_count.desc()).limit(50).all()
-    return jsonify([
-        {
-            'id': b.id,
-            'title': b.title,
-            'author': b.author,
-            'genres': b.genres,
-            'avg_rating': b.avg_rating,
-            'ratings_count': b.ratings_count
-        } for b in books
-    ])
+    genre_list = [g.strip() for g in genres_param.split(',') if g.strip()]
+    genre_mode = 'all' if request.args.get('genre_mode') == 'all' else 'any'
+    # facets=1 answers {'books': [...], 'facets': [{'genre', 'count'}, ...]} instead of the list
+    with_facets = request.args.get('facets', '').lower() in ('1', 'true')
+    if request.args.get('mode') == 'hybrid' and q:
+        return hybrid_api_search(q, genre_list, genre_mode)
+
+    def load():
+        facets = None
+        if q or genre_list:
+            # The query in any column including the description, or a mood it mentions
+            kwargs = dict(moods=moods_in(q), genres=genre_list, genre_mode=genre_mode, description=True, limit=50)
+            if with_facets:
+                found, facets = book_search.search_with_facets(q, **kwargs)
+            else:
+                found = book_search.search(q, **kwargs)
+        else:
+            found = Book.query.order_by(Book.avg_rating.desc(), Book.ratings_count.desc()).limit(50).all()
+            if with_facets:
+                facets = genre_index.facets()
+        books = [book_summary(b) for b in found]
+        if not with_facets:
+            return books, list_tags(books, limit=50)
+        facets = [{'genre': genre, 'count': count} for genre, count in facets]
+        return {'books': books, 'facets': facets}, list_tags(books, limit=50)
+    
+    params = {'q': q, 'genres': ','.join(sorted(genre_list)), 'genre_mode': genre_mode, 'facets': with_facets}
+    return jsonify(response_cache.get_or_set('api_search', params, load))
+
+@user_bp.route('/api/autocomplete')
+def api_autocomplete():
+    """Title and author completions for a partly typed query, most rated books first"""
+    q = request.args.get('q', '')
+    limit = request.args.get('limit', default=Config.TYPEAHEAD_LIMIT, type=int)
+    return jsonify(typeahead_index.complete(q, limit=limit))
+
+def hybrid_api_search(q, genre_list, genre_mode):
+    """Full-text and embedding candidates fused by rank (see search.hybrid)"""
+    try:
+        recommender = get_recommender()
+    except Exception:
+        recommender = None
+    
+    def load():
+        books, scores, stages = hybrid_search(q, recommender, genres=genre_list, genre_mode=genre_mode, limit=50)
+        results = [dict(book_summary(b), score=score) for b, score in zip(books, scores)]
+        # A result missing a stage isn't cached, so the next request tries it again
+        complete = all(status in ('ok', 'unavailable') for status in stages.values())
+        return results, (['model'] + list_tags(results, limit=50) if complete else None)
+    
+    params = {'q': q, 'genres': ','.join(sorted(genre_list)), 'genre_mode': genre_mode,
+              'version': (recommender.version or '') if recommender is not None else ''}
+    return jsonify(response_cache.get_or_set('api_search_hybrid', params, load))
 
 @user_bp.route('/api/recommendations')
 def api_recommendations():
     q = request.args.get('q', '').strip()
     try:
-        from recommender.hybrid_recommender import HybridRecommender
-        recommender = HybridRecommender()
-        recommender.load_artifacts()
-        if q:
-            from sentence_transformers import SentenceTransformer
-            model = SentenceTransformer('all-MiniLM-L6-v2')
-            query_emb = model.encode([q])[0]
-            recs = recommender.recommend_by_text(query_emb, top_k=12)
-        else:
+        recommender = get_recommender()
+        
+        def load():
             recs = []
-        if not recs:
-            recs = Book.query.order_by(Book.avg_rating.desc()).limit(12).all()
-            return jsonify([
+            if q:
+                query_emb = get_query_encoder().encode(q)
+                recs = recommender.recommend_by_text(query_emb, top_k=12)
+            if recs:
+                return recs, ['model'] + book_tags(recs)
+            books = Book.query.order_by(Book.avg_rating.desc()).limit(12).all()
+            recs = [
                 {'id': b.id, 'title': b.title, 'author': b.author, 'genres': b.genres, 'score': b.avg_rating}
-                for b in recs
-            ])
-        return jsonify(recs)
+                for b in books
+            ]
+            return recs, list_tags(recs, limit=12)
+        
+        # Keyed on the model version so workers still serving the previous version don't mix results
+        params = {'q': q, 'version': recommender.version or ''}
+        return jsonify(response_cache.get_or_set('recommendations', params, load))
     except Exception:
         if q:
-            t = q.lower()
-            mood_map = {
-                'cozy': ['cozy','comfort','heartwarming','warm','gentle','wholesome','feel-good'],
-                'thrilling': ['thrilling','suspense','fast-paced','tense','gripping','page-turner'],
-                'thought-provoking': ['thought','philosophy','reflective','introspective','provocative','contemplative'],
-                'light & funny': ['humor','funny','witty','lighthearted','comedy','hilarious','satirical'],
-                'sad': ['sad','melancholic','melancholy','grief','poignant','somber','tragic','heartbreaking','tear-jerker'],
-                'happy': ['happy','joyful','cheerful','uplifting','feel-good'],
-                'hopeful': ['hopeful','optimistic','inspiring','encouraging','uplifting'],
-                'adventurous': ['adventurous','exciting','exploration','quest','voyage'],
-                'romantic': ['romantic','love','heartfelt','passionate'],
-                'calm': ['calm','relaxing','soothing','tranquil','peaceful','serene'],
-                'anxious': ['anxious','nervous','uneasy','tense','worry'],
-                'angry': ['angry','rage','furious','vengeful','wrath'],
-                'dark': ['dark','gritty','bleak','noir','grim'],
-                'inspiring': ['inspiring','motivational','uplifting','encouraging','empowering'],
-                'nostalgic': ['nostalgic','nostalgia','wistful','sentimental']
-            }
-            terms = [t]
-            for k, v in mood_map.items():
-                if (k in t) or any(s in t for s in v):
-                    terms.extend(v + [k])
-            filters = [or_(
-                Book.title.ilike(f'%{term}%'),
-                Book.author.ilike(f'%{term}%'),
-                Book.genres.ilike(f'%{term}%'),
-                Book.description.ilike(f'%{term}%')
-            ) for term in set(terms)]
-            query_obj = Book.query
-            if filters:
-                query_obj = query_obj.filter(or_(*filters))
-            books = query_obj.order_by(Book.avg_rating.desc(), Book.ratings_count.desc()).limit(12).all()
+            books = book_search.search(q, moods=moods_in(q), description=True, limit=12)
             return jsonify([
                 {'id': b.id, 'title': b.title, 'author': b.author, 'genres': b.genres, 'score': b.avg_rating}
                 for b in books
@@ -289,6 +267,36 @@ def api_recommendations():
             for b in books
         ])
 
+@user_bp.route('/api/recommendations/batch', methods=['POST'])
+def api_recommendations_batch():
+    """Recommendations for lists of user ids, book ids and/or queries in one call
+
+    JSON body: {"user_ids": [...], "book_ids": [...], "queries": [...], "top_k": 12}.
+    Results are keyed by input; user ids other than your own need an admin account.
+    """
+    data = request.get_json(silent=True) or {}
+    try:
+        user_ids = [int(u) for u in data.get('user_ids') or []]
+        book_ids = [int(b) for b in data.get('book_ids') or []]
+        top_k = int(data.get('top_k', 12))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'user_ids, book_ids and top_k must be integers'}), 400
+    queries = [str(q).strip() for q in data.get('queries') or [] if str(q).strip()]
+    top_k = min(max(top_k, 1), 100)
+    
+    if len(user_ids) + len(book_ids) + len(queries) > Config.RECOMMEND_BATCH_MAX:
+        return jsonify({'error': f'At most {Config.RECOMMEND_BATCH_MAX} inputs per request'}), 400
+    if user_ids and not (current_user.is_authenticated
+                         and (current_user.is_admin or set(user_ids) == {current_user.id})):
+        return jsonify({'error': 'Admin access required for other users'}), 403
+    
+    try:
+        results = get_recommender().recommend_batch(user_ids, book_ids, queries, top_k=top_k)
+    except Exception:
+        return jsonify({'error': 'Recommendation engine unavailable'}), 503
+    # JSON object keys are strings
+    return jsonify({group: {str(key): recs for key, recs in items.items()} for group, items in results.items()})
+
 @user_bp.route('/api/explore')
 def api_explore():
     count = request.args.get('count', default=12, type=int)
@@ -348,10 +356,13 @@ def rate_book(book_id):
             review=review if review else None
         )
         db.session.add(rating)
+    RatingDelta.record(current_user.id, book_id, 'rating', rating_value)
+    UserRecommendation.invalidate(current_user.id)
     
     try:
         db.session.commit()
         update_book_rating_stats(book_id)
+        response_cache.invalidate(f'book:{book_id}', 'ratings')
         flash('Rating saved!', 'success')
     except Exception as e:
         db.session.rollback()
@@ -374,6 +385,7 @@ def toggle_favorite(book_id):
         favorite = Favorite(user_id=current_user.id, book_id=book_id)
         db.session.add(favorite)
         flash('Added to favorites!', 'success')
+    UserRecommendation.invalidate(current_user.id)
     
     try:
         db.session.commit()
@@ -403,6 +415,8 @@ def submit_feedback(book_id):
             is_like=1 if is_like else 0
         )
         db.session.add(feedback)
+    RatingDelta.record(current_user.id, book_id, 'feedback', 1 if is_like else 0)
+    UserRecommendation.invalidate(current_user.id)
     
     try:
         db.session.commit()
@@ -420,19 +434,15 @@ def recommendations():
     """Get personalized recommendations"""
     query = request.args.get('q', '').strip()
     
-    # Lazy-load recommender
     try:
-        from recommender.hybrid_recommender import HybridRecommender
-        recommender = HybridRecommender()
-        recommender.load_artifacts()
+        recommender = get_recommender()
         
         if query:
-            from sentence_transformers import SentenceTransformer
-            model = SentenceTransformer('all-MiniLM-L6-v2')
-            query_emb = model.encode([query])[0]
-            recommendations = recommender.recommend_by_text(query_emb, top_k=12)
+            query_emb = get_query_encoder().encode(query)
+            rated_ids = [r.book_id for r in Rating.query.with_entities(Rating.book_id).filter_by(user_id=current_user.id)]
+            recommendations = recommender.recommend_by_text(query_emb, top_k=12, exclude_ids=rated_ids)
         elif current_user.id:
-            recommendations = recommender.recommend_hybrid(user_id=current_user.id, top_k=12)
+            recommendations = cached_recommendations(recommender, current_user.id, top_k=12)
         else:
             recommendations = []
         
@@ -444,40 +454,7 @@ def recommendations():
     
     except Exception as e:
         if query:
-            q = query.lower()
-            mood_map = {
-                'cozy': ['cozy','comfort','heartwarming','warm','gentle','wholesome','feel-good'],
-                'thrilling': ['thrilling','suspense','fast-paced','tense','gripping','page-turner'],
-                'thought-provoking': ['thought','philosophy','reflective','introspective','provocative','contemplative'],
-                'light & funny': ['humor','funny','witty','lighthearted','comedy','hilarious','satirical'],
-                'sad': ['sad','melancholic','melancholy','grief','poignant','somber','tragic','heartbreaking','tear-jerker'],
-                'happy': ['happy','joyful','cheerful','uplifting','feel-good'],
-                'hopeful': ['hopeful','optimistic','inspiring','encouraging','uplifting'],
-                'adventurous': ['adventurous','exciting','exploration','quest','voyage'],
-                'romantic': ['romantic','love','heartfelt','passionate'],
-                'calm': ['calm','relaxing','soothing','tranquil','peaceful','serene'],
-                'anxious': ['anxious','nervous','uneasy','tense','worry'],
-                'angry': ['angry','rage','furious','vengeful','wrath'],
-                'dark': ['dark','gritty','bleak','noir','grim'],
-                'inspiring': ['inspiring','motivational','uplifting','encouraging','empowering'],
-                'nostalgic': ['nostalgic','nostalgia','wistful','sentimental']
-            }
-            terms = [q]
-            for k, v in mood_map.items():
-                if (k in q) or any(s in q for s in v):
-                    terms.extend(v + [k])
-            filters = []
-            for t in set(terms):
-                filters.append(or_(
-                    Book.title.ilike(f'%{t}%'),
-                    Book.author.ilike(f'%{t}%'),
-                    Book.genres.ilike(f'%{t}%'),
-                    Book.description.ilike(f'%{t}%')
-                ))
-            query_obj = Book.query
-            if filters:
-                query_obj = query_obj.filter(or_(*filters))
-            books = query_obj.order_by(Book.avg_rating.desc(), Book.ratings_count.desc()).limit(12).all()
+            books = book_search.search(query, moods=moods_in(query), description=True, limit=12)
             recommendations = [{'id': b.id, 'title': b.title, 'author': b.author,
                                'genres': b.genres, 'score': b.avg_rating} for b in books]
         else:
@@ -91,7 +91,7 @@ else:
 print("\nTesting imports...")
 try:
     from app import create_app
-    app = create_app()
+    app = create_app(preload_recommender=False)
     print("✅ App factory works correctly")
     print(f"   App type: {type(app)}")
 except Exception as e: